@@ -1,3 +1,7 @@
+import time
+# Cold start measurement: taken before any heavy import
+APP_START_TIME = time.perf_counter()
+
 import flet as ft
 import os
 import shutil
@@ -6,10 +10,11 @@ from ocr_processor import search_images, OllamaClient, are_models_loaded
 import ollama
 import unicodedata
 import threading
-import time
 import subprocess
 import sys
 
+IMPORTS_DONE_TIME = time.perf_counter()
+
 # Temporary directory for Flet to serve images from
 ASSETS_DIR = "assets"
 if not os.path.exists(ASSETS_DIR):
@@ -408,43 +413,34 @@ def main(page: ft.Page):
         def task():
             try:
                 show_toast("Deep analysis in progress...", ACCENT_COLOR)
-                from ocr_processor import generate_image_description, OllamaClient
+                from ocr_processor import get_ai_description, replace_description_embedding
                 
-                # 1. Generate new description
-                desc, model = generate_image_description(res['filepath'])
+                # 1. Generate new description (cached per image bytes, model and prompt version)
+                desc, model = get_ai_description(res['filepath'])
                 if not desc:
                     raise Exception("Failed to generate description")
                 
-                # 2. Update Database
-                import psycopg2
-                conn = psycopg2.connect(
-                    host=os.getenv("POSTGRES_HOST"),
-                    port=os.getenv("POSTGRES_PORT"),
-                    dbname=os.getenv("POSTGRES_DB"),
-                    user=os.getenv("POSTGRES_USER"),
-                    password=os.getenv("POSTGRES_PASSWORD")
-                )
-                cursor = conn.cursor()
-                
-                # Update image description
-                cursor.execute(
-                    "UPDATE images SET ai_description = %s, model_name = %s WHERE id = %s",
-                    (desc, model, res['id'])
-                )
+                if desc == res.get('ai_description'):
+                    # Nothing relevant changed; stored description and embedding are current
+                    show_toast("AI Analysis is already up to date", "#10B981")
+                    return
                 
-                # Update embedding for chunk -1
-                client = OllamaClient()
-                emb = client.generate_embedding(desc)
-                if emb:
+                # 2. Update Database
+                import db
+                with db.connection() as conn:
+                    cursor = conn.cursor()
+                    
+                    # Update image description
                     cursor.execute(
-                        "INSERT INTO text_embedding (image_id, embedding, chunk_index) VALUES (%s, %s, -1) "
-                        "ON CONFLICT (image_id, chunk_index) DO UPDATE SET embedding = EXCLUDED.embedding",
-                        (res['id'], emb)
+                        "UPDATE images SET ai_description = %s, model_name = %s WHERE id = %s",
+                        (desc, model, res['id'])
                     )
-                
-                conn.commit()
-                cursor.close()
-                conn.close()
+                    
+                    # Update embedding for chunk -1
+                    replace_description_embedding(cursor, res['id'], desc)
+                    
+                    conn.commit()
+                    cursor.close()
                 
                 # Update local UI data
                 res['ai_description'] = desc
@@ -535,6 +531,10 @@ def main(page: ft.Page):
     )
     
     threading.Thread(target=check_ollama, daemon=True).start()
+    
+    ui_ready_time = time.perf_counter()
+    print(f"Startup: imports {IMPORTS_DONE_TIME - APP_START_TIME:.2f}s, "
+          f"UI ready {ui_ready_time - APP_START_TIME:.2f}s after launch")
 
 if __name__ == "__main__":
     ft.run(main, assets_dir=ASSETS_DIR)
@@ -0,0 +1,465 @@
+"""
+Asyncio ingest engine - the same steps as process_image_to_db, on one event loop.
+
+Vision requests go through ollama.AsyncClient, embeddings through the
+cross-image EmbeddingBatcher and database work through an asyncpg connection
+pool, so a screenshot waiting on the model or on PostgreSQL is just a
+suspended coroutine, not a blocked thread.
+Hundreds of images can be in flight in one process; only CPU-bound work
+(decode, OCR, payload encoding) runs in small bounded executors.
+
+Concurrency is controlled with semaphores:
+  ASYNC_INGEST_MAX_IN_FLIGHT   screenshots being processed at once
+  ASYNC_INGEST_MAX_DECODED     screenshots holding decoded pixels (memory bound)
+  VISION_MAX_IN_FLIGHT         vision requests (shared with vision_scheduler)
+  ASYNC_INGEST_EMBED_IN_FLIGHT batched embedding requests
+  ASYNC_INGEST_DB_POOL         PostgreSQL connections
+
+    python async_ingest.py "C:\\Users\\user\\Pictures\\Screenshots\\*.png"
+"""
+import asyncio
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+import asyncpg
+import ollama
+
+import ocr_processor
+from embedding_batcher import EmbeddingBatcher
+from near_duplicate import get_near_duplicate_mode
+from ocr_pool import OCRWorkerPool, get_pool_size
+from pipeline import IngestJob
+from vision_cache import get_description_cache
+from vision_payload import is_passthrough_candidate, prepare_payload
+from vision_scheduler import get_scheduler_config
+
+
+def get_async_config() -> dict:
+    """Engine settings from .env."""
+    return {
+        "max_in_flight": int(os.getenv("ASYNC_INGEST_MAX_IN_FLIGHT", "256")),
+        "max_decoded": int(os.getenv("ASYNC_INGEST_MAX_DECODED", "8")),
+        "embed_in_flight": int(os.getenv("ASYNC_INGEST_EMBED_IN_FLIGHT", "4")),
+        "db_pool": int(os.getenv("ASYNC_INGEST_DB_POOL", "4")),
+        "decode_workers": int(os.getenv("PIPELINE_DECODE_WORKERS", "2")),
+    }
+
+
+def _encode_vector(values) -> str:
+    return "[" + ",".join(str(float(v)) for v in values) + "]"
+
+
+def _to_asyncpg(sql: str) -> tuple[str, list[str]]:
+    """Rewrite psycopg2 %(name)s placeholders as $1, $2...; returns the SQL and the names in order."""
+    names: list[str] = []
+
+    def placeholder(match):
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f"${names.index(match.group(1)) + 1}"
+    return re.sub(r"%\((\w+)\)s", placeholder, sql), names
+
+
+_STORE_IMAGE_SQL, _STORE_IMAGE_ARGS = _to_asyncpg(ocr_processor.STORE_IMAGE_SQL)
+
+
+def _decode_vector(text: str) -> list[float]:
+    return [float(v) for v in text.strip("[]").split(",") if v]
+
+
+async def _init_connection(conn):
+    # pgvector has no binary codec in asyncpg; exchange vectors as '[x,y,...]' text
+    await conn.set_type_codec("vector", schema="public", encoder=_encode_vector,
+                              decoder=_decode_vector, format="text")
+
+
+class AsyncIngestEngine:
+    """
+    Runs screenshots through decode -> OCR -> vision -> embed -> DB as coroutines.
+
+    Usage:
+        engine = AsyncIngestEngine(on_result=callback)
+        jobs = asyncio.run(engine.run(paths))
+
+    or, inside a running loop: await engine.start(), await engine.process(path)
+    for each file (concurrently), then await engine.close().
+
+    on_result(job) is called on the event loop thread once per file.
+    """
+
+    def __init__(self, on_result: Callable[[IngestJob], None] = None, max_in_flight: int = None,
+                 max_decoded: int = None, vision_in_flight: int = None, embed_in_flight: int = None,
+                 db_pool_size: int = None, ocr_pool: OCRWorkerPool = None, host: str = None):
+        config = get_async_config()
+        vision = get_scheduler_config()
+        self.on_result = on_result
+        self.max_in_flight = max(1, max_in_flight or config["max_in_flight"])
+        self.max_decoded = max(1, max_decoded or config["max_decoded"])
+        self.vision_in_flight = max(1, vision_in_flight or vision["max_in_flight"])
+        self.embed_in_flight = max(1, embed_in_flight or config["embed_in_flight"])
+        self.db_pool_size = max(1, db_pool_size or config["db_pool"])
+        self.decode_workers = max(1, config["decode_workers"])
+        self.vision_timeout = vision["timeout"]
+        self.vision_retries = vision["retries"]
+        self.vision_backoff = vision["backoff"]
+        self.host = host or os.getenv("LOCAL_LLM_API_URL")
+
+        self.ocr_pool = ocr_pool
+        self._owns_ocr_pool = False
+        if self.ocr_pool is None and get_pool_size() > 0:
+            self.ocr_pool = OCRWorkerPool()
+            self._owns_ocr_pool = True
+        # The in-process PaddleOCR engine is not thread-safe: one OCR thread without a pool
+        self.ocr_workers = self.ocr_pool.workers if self.ocr_pool is not None else 1
+
+        self.client: Optional[ollama.AsyncClient] = None
+        self.batcher: Optional[EmbeddingBatcher] = None
+        self.db: Optional[asyncpg.Pool] = None
+        self._cpu: Optional[ThreadPoolExecutor] = None
+        self._ocr: Optional[ThreadPoolExecutor] = None
+        self._started = False
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.vision_completed = 0
+        self.vision_failed = 0
+        self.vision_retried = 0
+        self.stage_busy = {stage: 0.0 for stage in ("decode", "ocr", "vision", "embed", "db")}
+
+    # ------------------------------------------------------------------ lifecycle
+
+    async def start(self):
+        if self._started:
+            return
+        self._started = True
+        # Semaphores belong to the running loop, so they are created here
+        self._image_slots = asyncio.Semaphore(self.max_in_flight)
+        self._decoded_slots = asyncio.Semaphore(self.max_decoded)
+        self._vision_slots = asyncio.Semaphore(self.vision_in_flight)
+        self._cpu = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="async-cpu")
+        self._ocr = ThreadPoolExecutor(max_workers=self.ocr_workers, thread_name_prefix="async-ocr")
+        if self.ocr_pool is not None:
+            self.ocr_pool.start()
+        self.client = ollama.AsyncClient(host=self.host, timeout=self.vision_timeout)
+        self.batcher = EmbeddingBatcher(client=ocr_processor.OllamaClient(host=self.host),
+                                        max_in_flight=self.embed_in_flight)
+        self.db = await self._connect_db()
+
+    async def _connect_db(self):
+        return await asyncpg.create_pool(
+            host=os.getenv("POSTGRES_HOST"),
+            port=int(os.getenv("POSTGRES_PORT", "5432")),
+            database=os.getenv("POSTGRES_DB"),
+            user=os.getenv("POSTGRES_USER"),
+            password=os.getenv("POSTGRES_PASSWORD"),
+            min_size=1,
+            max_size=self.db_pool_size,
+            init=_init_connection,
+        )
+
+    async def close(self):
+        if not self._started:
+            return
+        self._started = False
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+        self.batcher.close()
+        self._cpu.shutdown(wait=True)
+        self._ocr.shutdown(wait=True)
+        if self._owns_ocr_pool:
+            self.ocr_pool.close()
+
+    async def run(self, image_paths: Iterable[str]) -> list[IngestJob]:
+        """Process a finite list of files and return the finished jobs."""
+        await self.start()
+        try:
+            return list(await asyncio.gather(*(self.process(path) for path in image_paths)))
+        finally:
+            await self.close()
+
+    # ------------------------------------------------------------------ per image
+
+    async def process(self, image_path: str) -> IngestJob:
+        """Ingest one screenshot; never raises, the outcome is in job.success / job.reason."""
+        job = IngestJob(image_path)
+        async with self._image_slots:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                await self._ingest(job)
+            except Exception as e:
+                print(f"Async ingest error for {os.path.basename(image_path)}: {e}")
+                job.finish(False, "ingest_error")
+            finally:
+                self.in_flight -= 1
+        if job.success is None:
+            job.finish(False, "incomplete")
+        if self.on_result:
+            try:
+                self.on_result(job)
+            except Exception as e:
+                print(f"Async ingest result callback error: {e}")
+        return job
+
+    async def _ingest(self, job: IngestJob):
+        if await self._find_duplicate(job.image_path):
+            print(f"Skipping duplicate image: {job.image_path}")
+            job.finish(True, "duplicate")
+            return
+        if not os.path.exists(job.image_path):
+            job.finish(False, "file_not_found")
+            return
+
+        payload = None
+        # Decoded pixels are the big allocation: only max_decoded images hold them at once,
+        # released as soon as OCR and the vision payload are done.
+        async with self._decoded_slots:
+            data = await self._in_cpu("decode", ocr_processor.read_image_file, job.image_path)
+            job.content_hash = ocr_processor.compute_content_hash(data)
+            source_id = await self._find_by_hash(job.content_hash)
+            if source_id:
+                job.finish(*await self._in_cpu("db", ocr_processor.copy_image_results,
+                                               source_id, job.image_path, job.content_hash))
+                return
+            job.image = await self._in_cpu("decode", ocr_processor.decode_image, data)
+            if job.image is None:
+                print(f"Could not decode image: {job.image_path}")
+                job.finish(False, "unreadable_image")
+                return
+            if is_passthrough_candidate(data):
+                job.raw_bytes = data
+            del data
+            job.perceptual_hash, job.near_duplicate_of = await self._in_cpu(
+                "decode", ocr_processor.find_near_duplicate, job.image)
+            if job.near_duplicate_of and get_near_duplicate_mode() == "reuse":
+                job.finish(*await self._in_cpu(
+                    "db", ocr_processor.copy_image_results, job.near_duplicate_of, job.image_path,
+                    job.content_hash, job.perceptual_hash, "near_duplicate"))
+                return
+
+            start = time.time()
+            job.ocr_lines = await asyncio.get_running_loop().run_in_executor(
+                self._ocr, lambda: ocr_processor.get_paddle_ocr_lines(job.image_path, ocr_pool=self.ocr_pool,
+                                                                      img=job.image))
+            self.stage_busy["ocr"] += time.time() - start
+            job.text = " ".join(text for _, text, _ in job.ocr_lines)
+
+            payload = await self._resolve_description(job)
+            job.image = None
+            job.raw_bytes = None
+
+        if payload is not None:
+            await self._request_description(job, payload)
+
+        if not job.text.strip() and not job.description.strip():
+            print("Both OCR and description failed for the image")
+            job.finish(False, "ocr_and_vision_failed")
+            return
+
+        start = time.time()
+        job.embeddings = await self._generate_embeddings(job.text, job.description)
+        self.stage_busy["embed"] += time.time() - start
+
+        start = time.time()
+        job.finish(*await self._store(job))
+        self.stage_busy["db"] += time.time() - start
+
+    async def _in_cpu(self, stage: str, func, *args):
+        start = time.time()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._cpu, func, *args)
+        finally:
+            self.stage_busy[stage] += time.time() - start
+
+    # ------------------------------------------------------------------ vision
+
+    async def _resolve_description(self, job: IngestJob) -> Optional[bytes]:
+        """
+        Settle the description without the model where possible (routing,
+        near-duplicate, cache); otherwise return the encoded payload to send.
+        """
+        decision = ocr_processor.route_vision(job.ocr_lines)
+        if decision != "describe":
+            job.vision_deferred = decision == "defer"
+            return None
+        if job.near_duplicate_of:
+            description, model_name = await self._in_cpu(
+                "vision", ocr_processor.get_image_description, job.near_duplicate_of)
+            if description:
+                job.description, job.model_name = description, model_name
+                return None
+        cache = get_description_cache()
+        if cache is not None:
+            cached = await self._in_cpu("vision", cache.get, job.content_hash,
+                                        ocr_processor.get_vision_model(), ocr_processor.get_prompt_version())
+            if cached:
+                print(f"    Vision Description from cache ({len(cached)} chars)")
+                job.description, job.model_name = cached, ocr_processor.get_vision_model()
+                return None
+        return await self._in_cpu("vision", prepare_payload, job.image, job.raw_bytes, job.content_hash)
+
+    async def _request_description(self, job: IngestJob, payload: bytes):
+        model = ocr_processor.get_vision_model()
+        async with self._vision_slots:
+            start = time.time()
+            attempt = 0
+            while True:
+                try:
+                    response = await self.client.chat(**ocr_processor.vision_chat_request(payload))
+                    job.description = response['message']['content'].strip()
+                    job.model_name = model
+                    self.vision_completed += 1
+                    break
+                except Exception as e:
+                    if attempt >= self.vision_retries:
+                        print(f"Error during vision analysis: {e}")
+                        self.vision_failed += 1
+                        break
+                    attempt += 1
+                    self.vision_retried += 1
+                    delay = self.vision_backoff * attempt
+                    print(f"    Vision request failed ({e}); retry {attempt}/{self.vision_retries} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            self.stage_busy["vision"] += time.time() - start
+        cache = get_description_cache()
+        if cache is not None and job.description:
+            await self._in_cpu("vision", cache.put, job.content_hash, model,
+                               ocr_processor.get_prompt_version(), job.description)
+
+    # ------------------------------------------------------------------ embeddings
+
+    async def _generate_embeddings(self, text: str, description: str) -> list[ocr_processor.EmbeddedChunk]:
+        """
+        Description as chunk -1 and OCR chunks 0..n, like ocr_processor.generate_image_embeddings:
+        chunks already stored are skipped, the rest go through the shared EmbeddingBatcher.
+        """
+        chunks = ocr_processor.get_image_chunks(text, description)
+        stored = await self._find_stored_chunks([content_hash for _, content_hash, _ in chunks])
+        pending = ocr_processor.get_pending_chunks(chunks, stored)
+        vectors = await asyncio.wrap_future(self.batcher.submit(list(pending.values())))
+        embedded = {content_hash: vector for content_hash, vector in zip(pending, vectors) if vector}
+        return ocr_processor.assemble_embedded_chunks(chunks, stored, embedded)
+
+    # ------------------------------------------------------------------ database
+
+    async def _find_duplicate(self, filepath: str) -> Optional[int]:
+        try:
+            return await self.db.fetchval("SELECT id FROM images WHERE filepath = $1", filepath)
+        except Exception as e:
+            print(f"Error checking for duplicate image: {e}")
+            return None
+
+    async def _find_by_hash(self, content_hash: str) -> Optional[int]:
+        try:
+            # Only reuse images whose embeddings were stored, i.e. fully processed ones
+            return await self.db.fetchval("""
+                SELECT i.id FROM images i
+                WHERE i.content_hash = $1
+                  AND EXISTS (SELECT 1 FROM image_chunks ic WHERE ic.image_id = i.id)
+                ORDER BY i.id
+                LIMIT 1
+            """, content_hash)
+        except Exception as e:
+            print(f"Error looking up content hash: {e}")
+            return None
+
+    async def _find_stored_chunks(self, content_hashes: list[str]) -> set[str]:
+        if not content_hashes:
+            return set()
+        try:
+            rows = await self.db.fetch("SELECT content_hash FROM embedding_chunks WHERE content_hash = ANY($1::text[])",
+                                       list(set(content_hashes)))
+            return {row[0] for row in rows}
+        except Exception as e:
+            print(f"Error looking up stored chunks: {e}")
+            return set()
+
+    async def _refill_missing_chunks(self, job: IngestJob) -> Optional[list[ocr_processor.EmbeddedChunk]]:
+        """Async ocr_processor.refill_missing_chunks, embedding through the shared batcher."""
+        reused = [content_hash for _, content_hash, vector in job.embeddings if vector is None]
+        missing = set(reused) - await self._find_stored_chunks(reused)
+        if not missing:
+            return None
+        chunks = ocr_processor.get_image_chunks(job.text, job.description)
+        pending = {content_hash: piece for content_hash, piece in ocr_processor.get_pending_chunks(chunks, set()).items()
+                   if content_hash in missing}
+        vectors = await asyncio.wrap_future(self.batcher.submit(list(pending.values())))
+        return ocr_processor.fill_missing_chunks(job.embeddings, missing, dict(zip(pending, vectors)))
+
+    async def _store(self, job: IngestJob) -> tuple[bool, str]:
+        """Insert image, OCR results and embeddings in one statement (ocr_processor.STORE_IMAGE_SQL)."""
+        if job.text.strip():
+            ocr_row = (job.text, float(ocr_processor.get_ocr_confidence(job.ocr_lines)),
+                       ocr_processor.lines_to_json(job.ocr_lines))
+        else:
+            # Empty OCR record keeps one ocr_results row per image
+            ocr_row = ("[No text extracted]", 0.0, None)
+        params = {
+            "filename": os.path.basename(job.image_path),
+            "filepath": job.image_path,
+            "timestamp": datetime.fromtimestamp(os.path.getmtime(job.image_path)),
+            "description": job.description,
+            "model_name": job.model_name,
+            "content_hash": job.content_hash,
+            "perceptual_hash": job.perceptual_hash,
+            "vision_deferred": job.vision_deferred,
+            "text": ocr_row[0],
+            "confidence": ocr_row[1],
+            "lines": ocr_row[2],
+            **ocr_processor.chunk_params(job.embeddings),
+        }
+        try:
+            try:
+                row = await self.db.fetchrow(_STORE_IMAGE_SQL, *(params[name] for name in _STORE_IMAGE_ARGS))
+            except Exception as e:
+                # A reused chunk may have been deleted since it was looked up: embed it again and retry once
+                refilled = await self._refill_missing_chunks(job) if job.embeddings else None
+                if not refilled:
+                    raise
+                print(f"Re-embedded chunks deleted while storing ({e}); retrying")
+                job.embeddings = refilled
+                params.update(ocr_processor.chunk_params(refilled))
+                row = await self.db.fetchrow(_STORE_IMAGE_SQL, *(params[name] for name in _STORE_IMAGE_ARGS))
+            image_id, linked, new_chunks = row
+            print(f"Stored image {image_id} with {linked} embeddings ({new_chunks} new chunks)")
+        except Exception as e:
+            print(f"Error storing image: {e}")
+            return False, "database_error"
+        if not job.embeddings:
+            print("Warning: No embeddings generated for image")
+            return False, "no_embeddings"
+        return True, "success"
+
+    def stage_report(self) -> str:
+        parts = [f"{stage}={busy:.1f}s" for stage, busy in self.stage_busy.items()]
+        return (f"Stage time (summed over images): {', '.join(parts)}\n"
+                f"Peak {self.peak_in_flight} images in flight; vision requests: {self.vision_completed} ok, "
+                f"{self.vision_failed} failed, {self.vision_retried} retries (max {self.vision_in_flight} in flight)\n"
+                f"{self.batcher.stats() if self.batcher else ''}")
+
+
+def run_async_ingest(image_paths: Iterable[str], on_result: Callable[[IngestJob], None] = None,
+                     engine: AsyncIngestEngine = None) -> list[IngestJob]:
+    """Blocking helper: run the async engine over a list of files."""
+    engine = engine or AsyncIngestEngine(on_result=on_result)
+    return asyncio.run(engine.run(list(image_paths)))
+
+
+if __name__ == "__main__":
+    pattern = sys.argv[1] if len(sys.argv) > 1 else os.path.join(r'C:\Users\user\Pictures\Screenshots', '*.png')
+    files = sorted(glob.glob(pattern))
+    print(f"Found {len(files)} files")
+    engine = AsyncIngestEngine(on_result=lambda job: print(f"Finished {os.path.basename(job.image_path)} "
+                                                           f"({job.reason})"))
+    start_time = time.time()
+    jobs = run_async_ingest(files, engine=engine)
+    ok = sum(1 for job in jobs if job.success)
+    print(f"\n✅ {ok}/{len(jobs)} succeeded in {time.time() - start_time:.1f}s")
+    print(engine.stage_report())
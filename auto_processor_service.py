@@ -8,13 +8,22 @@ from pathlib import Path
 from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from ocr_processor import process_image_to_db, are_models_loaded
+from ocr_processor import are_models_loaded
+from pipeline import IngestPipeline
+from incremental_ocr import IncrementalOCR
 
 class ScreenshotHandler(FileSystemEventHandler):
     """Handle new screenshot files"""
     
-    def __init__(self):
+    def __init__(self, pipeline: IngestPipeline = None):
         self.processed_count = 0
+        if pipeline is None:
+            # Consecutive captures mostly differ in a small region; only re-OCR that
+            incremental = IncrementalOCR() if os.getenv("INCREMENTAL_OCR", "1") != "0" else None
+            pipeline = IngestPipeline(incremental_ocr=incremental)
+        self.pipeline = pipeline
+        self.pipeline.on_result = self.on_processed
+        self.pipeline.start()
     
     def on_created(self, event):
         """Process new PNG files"""
@@ -27,16 +36,25 @@ class ScreenshotHandler(FileSystemEventHandler):
             
             print(f"\n[{datetime.now().strftime('%H:%M:%S')}] New screenshot detected: {Path(event.src_path).name}")
             
-            success, reason = process_image_to_db(event.src_path)
-            if success:
-                self.processed_count += 1
-                if reason == "duplicate":
-                    print(f"  ⏭️  Skipped (duplicate) - Total: {self.processed_count}")
-                else:
-                    print(f"  ✅ Processed successfully - Total: {self.processed_count}")
+            # Hand off to the pipeline so the watcher thread never blocks on OCR/vision
+            self.pipeline.submit(event.src_path)
+    
+    def on_processed(self, job):
+        """Report a finished screenshot (called by the pipeline)"""
+        name = Path(job.image_path).name
+        if job.success:
+            self.processed_count += 1
+            if job.reason == "duplicate":
+                print(f"  ⏭️  Skipped (duplicate) {name} - Total: {self.processed_count}")
+            elif job.reason == "reused":
+                print(f"  ♻️  Reused results of identical file for {name} - Total: {self.processed_count}")
+            elif job.reason == "near_duplicate":
+                print(f"  ♻️  Reused results of near-identical screenshot for {name} - Total: {self.processed_count}")
             else:
-                reason_display = reason.replace('_', ' ').title()
-                print(f"  ❌ Processing failed: {reason_display}")
+                print(f"  ✅ Processed {name} successfully - Total: {self.processed_count}")
+        else:
+            reason_display = job.reason.replace('_', ' ').title()
+            print(f"  ❌ Processing failed for {name}: {reason_display}")
 
 def start_service():
     """Start the background service"""
@@ -68,6 +86,8 @@ def start_service():
         print("\n\nStopping service...")
         observer.stop()
         observer.join()
+        print("Finishing queued screenshots...")
+        event_handler.pipeline.close()
         print(f"✅ Service stopped. Processed {event_handler.processed_count} screenshots.")
 
 if __name__ == "__main__":
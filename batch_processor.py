@@ -3,43 +3,68 @@ Interactive batch processor - Using Ollama for processing
 """
 import os
 import glob
-from ocr_processor import process_image_to_db, are_models_loaded
-
-print("=" * 60)
-print("Screenshot Batch Processor (Ollama Edition)")
-print("=" * 60)
-
-# Check if Ollama is available
-if are_models_loaded():
-    print("✅ Ollama is connected and ready!")
-else:
-    print("❌ Ollama not detected. Please ensure Ollama is running.")
+from ocr_processor import are_models_loaded, backfill_content_hashes, describe_deferred_images
+from pipeline import IngestPipeline
 
 screenshot_dir = r'C:\Users\user\Pictures\Screenshots'
 
-def process_all():
-    """Process all screenshots"""
-    files = glob.glob(os.path.join(screenshot_dir, '*.png'))
-    print(f"\nFound {len(files)} PNG files")
-    
+def process_files(files):
+    """Run files through the staged ingest pipeline and print a summary"""
     processed = 0
     skipped = 0
     failed = 0
     failed_files = []  # List of (filename, reason) tuples
-    
-    for i, file_path in enumerate(files, 1):
-        print(f"[{i}/{len(files)}] Processing {os.path.basename(file_path)}")
-        success, reason = process_image_to_db(file_path)
-        if success:
-            if reason == "duplicate":
+    reused = 0
+    completed = 0
+    
+    # Older rows need a content hash so renamed/copied files can reuse their results
+    backfill_content_hashes()
+    
+    def on_result(job):
+        nonlocal processed, skipped, reused, failed, completed
+        completed += 1
+        filename = os.path.basename(job.image_path)
+        print(f"[{completed}/{len(files)}] Finished {filename} ({job.reason})")
+        if job.success:
+            if job.reason == "duplicate":
                 skipped += 1
+            elif job.reason in ("reused", "near_duplicate"):
+                reused += 1
             else:
                 processed += 1
         else:
             failed += 1
-            failed_files.append((os.path.basename(file_path), reason))
+            failed_files.append((filename, job.reason))
     
-    print(f"\n✅ Complete: {processed} processed, {skipped} skipped (duplicates), {failed} failed")
+    # INGEST_ENGINE=async runs the asyncio engine instead of the threaded pipeline
+    if os.getenv("INGEST_ENGINE", "pipeline").strip().lower() == "async":
+        from async_ingest import AsyncIngestEngine, run_async_ingest
+        pipeline = AsyncIngestEngine(on_result=on_result)
+        run_async_ingest(files, engine=pipeline)
+    else:
+        # BULK_LOAD=1 writes results with COPY in large batches (large backfills)
+        loader = None
+        if os.getenv("BULK_LOAD", "0") == "1":
+            from bulk_loader import BulkLoader
+            loader = BulkLoader()
+            loader.begin()
+        pipeline = IngestPipeline(on_result=on_result, bulk_loader=loader)
+        try:
+            pipeline.run(files)
+        finally:
+            if loader is not None:
+                loader.finish()
+    
+    print(f"\n✅ Complete: {processed} processed, {reused} reused (identical or near-identical), "
+          f"{skipped} skipped (duplicates), {failed} failed")
+    print(pipeline.stage_report())
+    
+    # Warn (or with VECTOR_INDEX_AUTO_REBUILD=1 rebuild) once the library has outgrown the vector index
+    try:
+        from vector_index import check_index
+        check_index(rebuild_due=os.getenv("VECTOR_INDEX_AUTO_REBUILD", "0") == "1")
+    except Exception as e:
+        print(f"Vector index check failed: {e}")
     
     if failed_files:
         print(f"\n{'='*60}")
@@ -50,27 +75,27 @@ def process_all():
             print(f"{idx:3d}. {filename}")
             print(f"      Reason: {reason_display}")
     
-    return processed, failed
+    return processed + reused, failed
+
+def process_all():
+    """Process all screenshots"""
+    files = glob.glob(os.path.join(screenshot_dir, '*.png'))
+    print(f"\nFound {len(files)} PNG files")
+    
+    return process_files(files)
 
 def process_new():
     """Process only images not in database"""
-    import psycopg2
+    import db
     from dotenv import load_dotenv
     load_dotenv()
     
     # Get existing filepaths from database
-    conn = psycopg2.connect(
-        host=os.getenv("POSTGRES_HOST"),
-        port=os.getenv("POSTGRES_PORT"),
-        dbname=os.getenv("POSTGRES_DB"),
-        user=os.getenv("POSTGRES_USER"),
-        password=os.getenv("POSTGRES_PASSWORD")
-    )
-    cursor = conn.cursor()
-    cursor.execute("SELECT filepath FROM images")
-    existing = {row[0] for row in cursor.fetchall()}
-    cursor.close()
-    conn.close()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT filepath FROM images")
+        existing = {row[0] for row in cursor.fetchall()}
+        cursor.close()
     
     # Get all PNG files
     files = glob.glob(os.path.join(screenshot_dir, '*.png'))
@@ -82,86 +107,80 @@ def process_new():
         print("No new files to process!")
         return 0, 0
     
-    processed = 0
-    skipped = 0
-    failed = 0
-    failed_files = []  # List of (filename, reason) tuples
-    
-    for i, file_path in enumerate(new_files, 1):
-        print(f"[{i}/{len(new_files)}] Processing {os.path.basename(file_path)}")
-        success, reason = process_image_to_db(file_path)
-        if success:
-            if reason == "duplicate":
-                skipped += 1
-            else:
-                processed += 1
-        else:
-            failed += 1
-            failed_files.append((os.path.basename(file_path), reason))
-    
-    print(f"\n✅ Complete: {processed} processed, {skipped} skipped (duplicates), {failed} failed")
-    
-    if failed_files:
-        print(f"\n{'='*60}")
-        print(f"FAILED FILES ({len(failed_files)}):")
-        print(f"{'='*60}")
-        for idx, (filename, reason) in enumerate(failed_files, 1):
-            reason_display = reason.replace('_', ' ').title()
-            print(f"{idx:3d}. {filename}")
-            print(f"      Reason: {reason_display}")
-    
-    return processed, failed
+    return process_files(new_files)
 
-# Interactive menu
-while True:
-    print("\n" + "=" * 60)
-    print("Options:")
-    print("  1. Process all screenshots")
-    print("  2. Process only new screenshots")
-    print("  3. Show database stats")
-    print("  4. Exit")
+def main():
+    """Interactive menu"""
     print("=" * 60)
-    
-    choice = input("Choose option (1-4): ").strip()
-    
-    if choice == "1":
-        process_all()
-    
-    elif choice == "2":
-        process_new()
-    
-    elif choice == "3":
-        import psycopg2
-        from dotenv import load_dotenv
-        load_dotenv()
-        
-        conn = psycopg2.connect(
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT"),
-            dbname=os.getenv("POSTGRES_DB"),
-            user=os.getenv("POSTGRES_USER"),
-            password=os.getenv("POSTGRES_PASSWORD")
-        )
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM images")
-        img_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM ocr_results")
-        ocr_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM text_embedding")
-        emb_count = cursor.fetchone()[0]
+    print("Screenshot Batch Processor (Ollama Edition)")
+    print("=" * 60)
+
+    # Check if Ollama is available
+    if are_models_loaded():
+        print("✅ Ollama is connected and ready!")
+    else:
+        print("❌ Ollama not detected. Please ensure Ollama is running.")
+    
+    while True:
+        print("\n" + "=" * 60)
+        print("Options:")
+        print("  1. Process all screenshots")
+        print("  2. Process only new screenshots")
+        print("  3. Show database stats")
+        print("  4. Describe deferred screenshots (VISION_ROUTING=defer)")
+        print("  5. Re-embed stored screenshots (after a chunker or embedding model change)")
+        print("  6. Exit")
+        print("=" * 60)
+    
+        choice = input("Choose option (1-6): ").strip()
+    
+        if choice == "1":
+            process_all()
+    
+        elif choice == "2":
+            process_new()
+    
+        elif choice == "3":
+            import db
+            from dotenv import load_dotenv
+            load_dotenv()
         
-        print(f"\nDatabase Statistics:")
-        print(f"  Images: {img_count}")
-        print(f"  OCR Results: {ocr_count}")
-        print(f"  Embeddings: {emb_count}")
+            with db.connection() as conn:
+                cursor = conn.cursor()
+            
+                cursor.execute("SELECT COUNT(*) FROM images")
+                img_count = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM ocr_results")
+                ocr_count = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM image_chunks")
+                emb_count = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM embedding_chunks")
+                chunk_count = cursor.fetchone()[0]
+                cursor.close()
         
-        cursor.close()
-        conn.close()
-    
-    elif choice == "4":
-        print("Goodbye!")
-        break
+            print(f"\nDatabase Statistics:")
+            print(f"  Images: {img_count}")
+            print(f"  OCR Results: {ocr_count}")
+            print(f"  Embeddings: {emb_count} ({chunk_count} distinct chunks stored)")
+    
+        elif choice == "4":
+            described = describe_deferred_images()
+            print(f"\n✅ Described {described} deferred screenshots")
+    
+        elif choice == "5":
+            from bulk_loader import BulkLoader
+            loader = BulkLoader()
+            changed = loader.reembed()
+            print(f"\n✅ Re-embedded {changed} screenshots")
+            print(loader.stats())
+    
+        elif choice == "6":
+            print("Goodbye!")
+            break
     
-    else:
-        print("Invalid option!")
+        else:
+            print("Invalid option!")
+
+# Guard keeps OCR worker processes (spawned on Windows) from re-running the menu
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark the embedding chunker on real OCR output: chunks per image and
+chunking time, old character chunker vs the token-aware one.
+
+    python bench_chunker.py                    # ocr_results.text from the database
+    python bench_chunker.py "notes\\*.txt"      # text files instead
+    python bench_chunker.py --tokens 512 --overlap 32
+    python bench_chunker.py --limit 100 --embed  # also time embedding the chunks
+
+Token counts use text_chunker's counter (EMBED_TOKENIZER if set). Fewer,
+fuller chunks mean fewer texts to embed and fewer rows to store and search;
+--embed sends both sets of chunks to Ollama to show the end-to-end time.
+"""
+import argparse
+import glob
+import os
+import time
+
+from dotenv import load_dotenv
+
+import db
+import text_chunker
+
+
+def legacy_chunk_text(text: str, max_chunk_size: int = 1000, overlap: int = 100) -> list[str]:
+    """The original OllamaClient.chunk_text: 1000 characters, 100 overlap, rfind for a break."""
+    if not text or len(text) <= max_chunk_size:
+        return [text] if text else []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + max_chunk_size
+        if end < len(text):
+            for break_char in ['\n\n', '\n', '. ', ', ']:
+                break_pos = text.rfind(break_char, start + max_chunk_size // 2, end)
+                if break_pos > start:
+                    end = break_pos + len(break_char)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end - overlap
+    return chunks
+
+
+def load_texts(pattern: str, limit: int) -> list[str]:
+    if pattern:
+        texts = []
+        for path in sorted(glob.glob(pattern))[:limit]:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                texts.append(f.read())
+        return texts
+
+    load_dotenv()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT text FROM ocr_results WHERE text <> '' ORDER BY length(text) DESC LIMIT %s",
+                       (limit,))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def measure(name: str, chunker, texts: list[str], count_unit, client=None):
+    start = time.perf_counter()
+    results = [chunker(text) for text in texts]
+    elapsed = time.perf_counter() - start
+    chunks = [chunk for result in results for chunk in result]
+    tokens = [text_chunker.count_tokens(chunk, count_unit) for chunk in chunks] or [0]
+    line = (f"  {name:<24} {len(chunks):>7} chunks {len(chunks) / len(texts):>6.2f}/image "
+            f"{elapsed * 1000:>8.1f} ms  tokens avg {sum(tokens) / len(tokens):>6.0f} max {max(tokens):>5}")
+    if client is not None:
+        start = time.perf_counter()
+        client.generate_embeddings(chunks)
+        embed_time = time.perf_counter() - start
+        line += f"  embed {embed_time:.1f}s"
+        elapsed += embed_time
+    print(line)
+    return len(chunks), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pattern", nargs="?", help="text files to chunk (default: ocr_results in the database)")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--tokens", type=int, default=None, help="chunk budget (default EMBED_CHUNK_TOKENS)")
+    parser.add_argument("--overlap", type=int, default=None, help="overlap (default EMBED_CHUNK_OVERLAP_TOKENS)")
+    parser.add_argument("--embed", action="store_true", help="embed the chunks with Ollama and time it")
+    args = parser.parse_args()
+
+    texts = load_texts(args.pattern, args.limit)
+    if not texts:
+        print("No OCR text to chunk")
+        return
+    count_unit = text_chunker.get_token_counter()
+    max_tokens, overlap = text_chunker.get_chunk_config()
+    max_tokens = args.tokens or max_tokens
+    overlap = overlap if args.overlap is None else args.overlap
+
+    print(f"{len(texts)} texts, {sum(len(t) for t in texts):,} characters, "
+          f"{sum(text_chunker.count_tokens(t, count_unit) for t in texts):,} tokens")
+    client = None
+    if args.embed:
+        from ocr_processor import OllamaClient
+        client = OllamaClient()
+    old_chunks, old_time = measure("legacy 1000 chars/100", legacy_chunk_text, texts, count_unit, client)
+    new_chunks, new_time = measure(f"tokens {max_tokens}/{overlap}",
+                                   lambda text: text_chunker.chunk_text(text, max_tokens, overlap, count_unit),
+                                   texts, count_unit, client)
+    label = "chunk + embed" if client else "chunking"
+    print(f"  {(1 - new_chunks / max(old_chunks, 1)) * 100:.0f}% fewer chunks; {label} "
+          f"{old_time * 1000:.0f} ms -> {new_time * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Measure recall and latency of the vector index modes on the stored chunks.
+
+    python bench_vector_recall.py                   # 50 stored chunks as queries, top 10
+    python bench_vector_recall.py --queries 200 --k 20 --candidates 400
+    python bench_vector_recall.py --queries-file searches.txt   # real searches, one per line
+
+For each mode, recall@k is the share of the exact top-k chunks (full-precision
+sequential scan) that the mode's search returns: full is the plain ivfflat
+search (with the app's ivfflat.probes / hnsw.ef_search), halfvec and binary
+re-rank VECTOR_RERANK_CANDIDATES quantized candidates by exact distance. Only the mode schema.sql was run with has an
+index; the other modes are measured with a sequential scan, so their numbers
+show the quantization loss and not the index's. Index sizes are listed too.
+"""
+import argparse
+import os
+import time
+
+import db
+from ocr_processor import (VECTOR_CANDIDATE_ORDER, VECTOR_INDEX_MODES, get_query_embedding,
+                           set_vector_search_params)
+
+INDEXES = {"full": "idx_embedding_vector", "halfvec": "idx_embedding_halfvec", "binary": "idx_embedding_binary"}
+
+EXACT_QUERY = "SELECT id FROM embedding_chunks ORDER BY embedding <=> %(embedding)s::vector LIMIT %(k)s"
+
+
+def mode_query(mode: str) -> str:
+    if mode not in VECTOR_CANDIDATE_ORDER:
+        return EXACT_QUERY
+    return f"""
+        WITH candidates AS (
+            SELECT id, embedding FROM embedding_chunks
+            ORDER BY {VECTOR_CANDIDATE_ORDER[mode]}
+            LIMIT %(candidates)s
+        )
+        SELECT id FROM candidates ORDER BY embedding <=> %(embedding)s::vector LIMIT %(k)s
+    """
+
+
+def load_queries(cursor, args) -> list[str]:
+    """Query vectors in pgvector text form."""
+    if args.queries_file:
+        with open(args.queries_file, encoding="utf-8") as f:
+            searches = [line.strip() for line in f if line.strip()][:args.queries]
+        embeddings = [get_query_embedding(search) for search in searches]
+        return [str(embedding) for embedding in embeddings if embedding]
+    cursor.execute("SELECT embedding::text FROM embedding_chunks ORDER BY random() LIMIT %s", (args.queries,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def run(cursor, sql: str, queries: list[str], params: dict) -> tuple[list[set[int]], float]:
+    results = []
+    start = time.perf_counter()
+    for embedding in queries:
+        cursor.execute(sql, {**params, "embedding": embedding})
+        results.append({row[0] for row in cursor.fetchall()})
+    return results, (time.perf_counter() - start) / max(len(queries), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--queries-file", help="search strings to embed, one per line")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, default=int(os.getenv("VECTOR_RERANK_CANDIDATES", "200")))
+    args = parser.parse_args()
+
+    conn = db.getconn()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*), pg_size_pretty(pg_total_relation_size('embedding_chunks')) "
+                       "FROM embedding_chunks")
+        chunk_count, table_size = cursor.fetchone()
+        print(f"{chunk_count} chunks, embedding_chunks {table_size} with indexes")
+        for mode, index in INDEXES.items():
+            cursor.execute("SELECT pg_size_pretty(pg_relation_size(to_regclass(%s)))", (index,))
+            size = cursor.fetchone()[0]
+            print(f"  {mode:<8} index {index}: {size or 'not built'}")
+
+        queries = load_queries(cursor, args)
+        if not queries:
+            print("No queries to run")
+            return
+        params = {"k": args.k, "candidates": max(args.candidates, args.k)}
+
+        cursor.execute("SET enable_indexscan = off")
+        exact, exact_time = run(cursor, EXACT_QUERY, queries, params)
+        cursor.execute("RESET enable_indexscan")
+        set_vector_search_params(cursor, params["candidates"])
+        print(f"\n{len(queries)} queries, recall@{args.k} against exact search ({exact_time * 1000:.1f} ms/query)")
+
+        for mode in VECTOR_INDEX_MODES:
+            found, mode_time = run(cursor, mode_query(mode), queries, params)
+            recall = sum(len(f & e) / max(len(e), 1) for f, e in zip(found, exact)) / len(queries)
+            print(f"  {mode:<8} recall {recall:.3f}  {mode_time * 1000:>7.1f} ms/query")
+    finally:
+        db.putconn(conn)
+
+
+if __name__ == "__main__":
+    main()
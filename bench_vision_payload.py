@@ -0,0 +1,81 @@
+"""
+Benchmark vision payload encoders: encode time and bytes sent per image.
+
+    python bench_vision_payload.py                      # screenshots folder
+    python bench_vision_payload.py "D:\\shots\\*.png" --limit 50
+
+Compares the old path (PIL open + LANCZOS resize + lossless PNG) with the
+cv2 encoders in vision_payload. Bytes sent are the base64 size the Ollama
+client puts on the wire.
+"""
+import argparse
+import glob
+import io
+import os
+import time
+
+from ocr_processor import load_image, read_image_file
+from vision_payload import VISION_MAX_SIZE, encode_image, is_passthrough_candidate
+
+
+def legacy_pil_png(image_path: str) -> bytes:
+    """The original get_ai_description payload: PIL + LANCZOS + PNG."""
+    from PIL import Image
+    with Image.open(image_path) as img:
+        if max(img.size) > VISION_MAX_SIZE:
+            scale = VISION_MAX_SIZE / max(img.size)
+            img = img.resize((int(img.width * scale), int(img.height * scale)), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return buf.getvalue()
+
+
+def base64_size(n: int) -> int:
+    return 4 * ((n + 2) // 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pattern", nargs="?", default=os.path.join(r'C:\Users\user\Pictures\Screenshots', '*.png'))
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--quality", type=int, default=90)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(args.pattern))[:args.limit]
+    if not files:
+        print(f"No images match {args.pattern}")
+        return
+
+    encoders = {
+        "legacy PIL png": lambda path, img: legacy_pil_png(path),
+        "cv2 png": lambda path, img: encode_image(img, "png", args.quality, VISION_MAX_SIZE),
+        f"jpeg q{args.quality}": lambda path, img: encode_image(img, "jpeg", args.quality, VISION_MAX_SIZE),
+        f"webp q{args.quality}": lambda path, img: encode_image(img, "webp", args.quality, VISION_MAX_SIZE),
+    }
+    totals = {name: [0.0, 0] for name in encoders}
+    passthrough = 0
+
+    for path in files:
+        img = load_image(path)
+        if img is None:
+            continue
+        raw = read_image_file(path)
+        if max(img.shape[:2]) <= VISION_MAX_SIZE and is_passthrough_candidate(raw):
+            passthrough += 1
+        for name, encode in encoders.items():
+            start = time.perf_counter()
+            payload = encode(path, img)
+            totals[name][0] += time.perf_counter() - start
+            totals[name][1] += base64_size(len(payload))
+
+    count = len(files)
+    print(f"\n{count} images from {args.pattern}")
+    print(f"{'encoder':<18}{'encode ms/img':>15}{'KB sent/img':>14}")
+    print("-" * 47)
+    for name, (seconds, sent) in totals.items():
+        print(f"{name:<18}{seconds / count * 1000:>15.1f}{sent / count / 1024:>14.0f}")
+    print(f"\n{passthrough}/{count} images small enough for raw passthrough (no encode)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+"""
+Bulk loading for large backfills and re-embedding runs.
+
+With BULK_LOAD=1 the batch processor's DB stage hands finished screenshots
+to a BulkLoader instead of writing each one. The loader buffers
+BULK_LOAD_BATCH images and loads them with two COPY streams into temporary
+staging tables: image and OCR rows as text, and chunk rows in binary with
+binary pgvector values. A few set-based INSERT ... SELECT statements then
+move everything into the real tables in one transaction. If a flush fails,
+its images are stored one at a time, so one bad image does not drop the
+batch.
+
+reembed() re-chunks the OCR text and description stored for every image
+(after a chunker or embedding model change), embeds only chunks that are
+not stored yet, COPYs the new vectors into the same staging table and
+swaps each changed image's image_chunks links in bulk. Images whose chunks
+are unchanged are skipped, so an interrupted run can simply be restarted.
+
+    python bulk_loader.py --reembed
+
+With BULK_LOAD_DROP_INDEXES=1 the expensive-to-maintain indexes (ivfflat,
+HNSW and GIN) are dropped before the load and rebuilt once at the end.
+A rebuilt ivfflat index is also trained on all the vectors instead of the
+first few. The dropped definitions are kept in search_settings, so a run
+that dies half-way has its indexes restored by the next one.
+"""
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Callable, Optional
+
+import db
+import ocr_processor
+
+# pg_am names of the indexes dropped during a load
+REBUILT_INDEX_METHODS = ("ivfflat", "hnsw", "gin")
+DROPPED_INDEXES_KEY = "bulk_load_dropped_indexes"
+
+_CREATE_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS bulk_images (
+        slot INTEGER, filename TEXT, filepath TEXT, timestamp TIMESTAMP, ai_description TEXT, model_name TEXT,
+        content_hash TEXT, perceptual_hash TEXT, vision_deferred BOOLEAN, text TEXT, confidence FLOAT,
+        lines JSONB, image_id INTEGER
+    ) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS bulk_chunks (
+        slot INTEGER, chunk_index INTEGER, content_hash TEXT, embedding VECTOR
+    ) ON COMMIT DELETE ROWS;
+"""
+
+_MOVE_STAGED = """
+    UPDATE bulk_images SET image_id = nextval(pg_get_serial_sequence('images', 'id'));
+    INSERT INTO images (id, filename, filepath, timestamp, ai_description, model_name, content_hash,
+                        perceptual_hash, vision_deferred)
+    SELECT image_id, filename, filepath, timestamp, ai_description, model_name, content_hash,
+           perceptual_hash, vision_deferred
+    FROM bulk_images;
+    INSERT INTO ocr_results (image_id, text, confidence, lines)
+    SELECT image_id, text, confidence, lines FROM bulk_images;
+    INSERT INTO embedding_chunks (content_hash, embedding)
+    SELECT DISTINCT ON (content_hash) content_hash, embedding
+    FROM bulk_chunks
+    WHERE embedding IS NOT NULL
+    ON CONFLICT (content_hash) DO NOTHING;
+    INSERT INTO image_chunks (image_id, chunk_index, chunk_id)
+    SELECT i.image_id, c.chunk_index, e.id
+    FROM bulk_chunks c
+    JOIN bulk_images i ON i.slot = c.slot
+    JOIN embedding_chunks e ON e.content_hash = c.content_hash;
+"""
+
+# Stored images to re-embed, by id after the last batch
+_SELECT_STORED = """
+    SELECT i.id, COALESCE(o.text, ''), i.ai_description
+    FROM images i
+    LEFT JOIN ocr_results o ON o.image_id = i.id
+    WHERE i.id > %s
+    ORDER BY i.id
+    LIMIT %s
+"""
+
+_SELECT_LINKS = """
+    SELECT ic.image_id, ic.chunk_index, e.content_hash
+    FROM image_chunks ic
+    JOIN embedding_chunks e ON e.id = ic.chunk_id
+    WHERE ic.image_id = ANY(%s)
+"""
+
+# bulk_chunks.slot holds the image id. Chunks the new links use get an extra reference
+# while the old links are dropped, so the ref_count trigger cannot delete them in between.
+_STORE_REEMBEDDED = """
+    INSERT INTO embedding_chunks (content_hash, embedding)
+    SELECT DISTINCT ON (content_hash) content_hash, embedding
+    FROM bulk_chunks
+    WHERE embedding IS NOT NULL
+    ON CONFLICT (content_hash) DO NOTHING;
+    UPDATE embedding_chunks SET ref_count = ref_count + 1
+    WHERE content_hash IN (SELECT content_hash FROM bulk_chunks);
+    DELETE FROM image_chunks WHERE image_id = ANY(%(image_ids)s);
+"""
+
+_LINK_REEMBEDDED = """
+    INSERT INTO image_chunks (image_id, chunk_index, chunk_id)
+    SELECT c.slot, c.chunk_index, e.id
+    FROM bulk_chunks c
+    JOIN embedding_chunks e ON e.content_hash = c.content_hash
+"""
+
+_RELEASE_REEMBEDDED = """
+    UPDATE embedding_chunks SET ref_count = ref_count - 1
+    WHERE content_hash IN (SELECT content_hash FROM bulk_chunks)
+"""
+
+
+def _copy_text(value) -> str:
+    """One field in COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _binary_field(data: Optional[bytes]) -> bytes:
+    return struct.pack(">i", -1) if data is None else struct.pack(">i", len(data)) + data
+
+
+def _binary_vector(embedding: list[float]) -> bytes:
+    """pgvector's binary (vector_recv) format: int16 dimensions, int16 unused, big-endian float4s."""
+    values = array("f", embedding)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return struct.pack(">hh", len(values), 0) + values.tobytes()
+
+
+def encode_chunk_copy(rows: list[tuple[int, int, str, Optional[list[float]]]]) -> bytes:
+    """COPY ... (FORMAT binary) stream for bulk_chunks rows (slot, chunk_index, content_hash, embedding)."""
+    out = io.BytesIO()
+    out.write(b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0))
+    for slot, chunk_index, content_hash, embedding in rows:
+        out.write(struct.pack(">h", 4))
+        out.write(_binary_field(struct.pack(">i", slot)))
+        out.write(_binary_field(struct.pack(">i", chunk_index)))
+        out.write(_binary_field(content_hash.encode("utf-8")))
+        out.write(_binary_field(None if embedding is None else _binary_vector(embedding)))
+    out.write(struct.pack(">h", -1))
+    return out.getvalue()
+
+
+class BulkLoader:
+    """
+    Buffers finished ingest jobs and loads them with COPY, BULK_LOAD_BATCH at a time.
+
+    add(job) is thread-safe; the call that fills the buffer flushes it while
+    other callers keep adding to a fresh one. Once a batch is written, each
+    job is finished with its real result and passed to on_stored(job).
+    Call begin() before a run (drops indexes when enabled) and finish()
+    after it (flushes the rest and rebuilds them).
+    """
+
+    def __init__(self, batch_size: int = None, drop_indexes: bool = None,
+                 on_stored: Callable[[object], None] = None):
+        self.batch_size = max(1, batch_size or int(os.getenv("BULK_LOAD_BATCH", "500")))
+        if drop_indexes is None:
+            drop_indexes = os.getenv("BULK_LOAD_DROP_INDEXES", "0") == "1"
+        self.drop_indexes = drop_indexes
+        self.on_stored = on_stored
+        self._buffer: list = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.images = 0
+        self.chunks = 0
+        self.flushes = 0
+        self.fallbacks = 0
+        self.failed = 0
+        self.load_time = 0.0
+        self.index_time = 0.0
+
+    def add(self, job):
+        """Queue a finished job (image_path, text, description, embeddings... as on pipeline.IngestJob)."""
+        with self._lock:
+            self._buffer.append(job)
+            if len(self._buffer) < self.batch_size:
+                return
+            batch, self._buffer = self._buffer, []
+        self._flush(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch: list):
+        with self._flush_lock:
+            start = time.time()
+            try:
+                self._copy_batch(batch)
+                for job in batch:
+                    # Stored either way; like the per-image store, no embeddings counts as a failure
+                    job.finish(bool(job.embeddings), "success" if job.embeddings else "no_embeddings")
+            except Exception as e:
+                print(f"Bulk load of {len(batch)} images failed ({e}); storing them one by one")
+                self.fallbacks += 1
+                for job in batch:
+                    try:
+                        job.finish(*ocr_processor.store_processed_image(
+                            job.image_path, job.text, job.description, job.model_name, job.embeddings,
+                            content_hash=job.content_hash, perceptual_hash=job.perceptual_hash,
+                            ocr_lines=job.ocr_lines, vision_deferred=job.vision_deferred,
+                        ))
+                    except Exception as e:
+                        print(f"Error storing {os.path.basename(job.image_path)}: {e}")
+                        job.finish(False, "database_error")
+            self.failed += sum(1 for job in batch if not job.success)
+            self.load_time += time.time() - start
+            if self.on_stored:
+                for job in batch:
+                    self.on_stored(job)
+
+    def _copy_batch(self, batch: list):
+        image_lines = []
+        chunk_rows = []
+        for slot, job in enumerate(batch):
+            if job.text.strip():
+                text = job.text
+                confidence = ocr_processor.get_ocr_confidence(job.ocr_lines or [])
+                lines = ocr_processor.lines_to_json(job.ocr_lines or [])
+            else:
+                # Empty OCR record keeps one ocr_results row per image
+                text, confidence, lines = "[No text extracted]", 0.0, None
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(job.image_path)))
+            fields = (slot, os.path.basename(job.image_path), job.image_path, timestamp, job.description,
+                      job.model_name, job.content_hash, job.perceptual_hash, bool(job.vision_deferred),
+                      text, float(confidence), lines, None)
+            image_lines.append("\t".join(_copy_text(value) for value in fields))
+            chunk_rows.extend((slot, chunk_index, content_hash, embedding)
+                              for chunk_index, content_hash, embedding in job.embeddings)
+
+        conn = db.getconn()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(_CREATE_STAGING)
+            cursor.copy_expert("COPY bulk_images FROM STDIN",
+                               io.BytesIO(("\n".join(image_lines) + "\n").encode("utf-8")))
+            cursor.copy_expert("COPY bulk_chunks FROM STDIN WITH (FORMAT binary)",
+                               io.BytesIO(encode_chunk_copy(chunk_rows)))
+            cursor.execute(_MOVE_STAGED)
+            linked = cursor.rowcount
+            if linked != len(chunk_rows):
+                raise ValueError(f"linked {linked} of {len(chunk_rows)} chunks; some are no longer stored")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            db.putconn(conn)
+        self.flushes += 1
+        self.images += len(batch)
+        self.chunks += len(chunk_rows)
+        print(f"Bulk loaded {len(batch)} images, {len(chunk_rows)} embeddings")
+
+    # ------------------------------------------------------------------ re-embedding
+
+    def reembed(self, client: "ocr_processor.OllamaClient" = None) -> int:
+        """
+        Re-chunk and re-embed every stored image from its stored OCR text and
+        description, BULK_LOAD_BATCH images at a time, with the same index
+        drop and rebuild as a bulk load. Returns the number of images re-linked.
+        """
+        client = client or ocr_processor.OllamaClient()
+        checked = 0
+        changed = 0
+        last_id = 0
+        self.begin()
+        try:
+            while True:
+                with db.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(_SELECT_STORED, (last_id, self.batch_size))
+                    rows = cursor.fetchall()
+                    cursor.execute(_SELECT_LINKS, ([image_id for image_id, _, _ in rows],))
+                    links = cursor.fetchall()
+                    cursor.close()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                checked += len(rows)
+
+                current = {}
+                for image_id, chunk_index, content_hash in links:
+                    current.setdefault(image_id, set()).add((chunk_index, content_hash))
+                images = {}
+                for image_id, text, description in rows:
+                    # Placeholder row written for images without OCR text
+                    if text == "[No text extracted]":
+                        text = ""
+                    chunks = ocr_processor.get_image_chunks(text, description, client)
+                    if {(index, content_hash) for index, content_hash, _ in chunks} != current.get(image_id, set()):
+                        images[image_id] = chunks
+                if images:
+                    changed += self._reembed_batch(images, client)
+                print(f"Re-embed: {checked} images checked, {changed} re-linked")
+        finally:
+            self.finish()
+        return changed
+
+    def _reembed_batch(self, images: dict[int, list], client) -> int:
+        """Embed the new chunks of a batch of images and swap their links; returns images re-linked."""
+        start = time.time()
+        chunks = [chunk for image_chunks in images.values() for chunk in image_chunks]
+        embedded = {}
+        image_ids = []
+        try:
+            # A chunk another image drops between the lookup and the swap is embedded on the second try
+            for attempt in range(2):
+                stored = ocr_processor.find_stored_chunks([content_hash for _, content_hash, _ in chunks])
+                pending = {content_hash: piece
+                           for content_hash, piece in ocr_processor.get_pending_chunks(chunks, stored).items()
+                           if content_hash not in embedded}
+                vectors = client.generate_embeddings(list(pending.values()))
+                embedded.update((content_hash, vector) for content_hash, vector in zip(pending, vectors) if vector)
+
+                image_ids = []
+                chunk_rows = []
+                for image_id, image_chunks in images.items():
+                    if any(content_hash not in stored and content_hash not in embedded
+                           for _, content_hash, _ in image_chunks):
+                        # Keep the old links rather than drop chunks that failed to embed
+                        continue
+                    image_ids.append(image_id)
+                    chunk_rows.extend((image_id, index, content_hash, embedded.get(content_hash))
+                                      for index, content_hash, _ in image_chunks)
+                try:
+                    self._swap_chunks(image_ids, chunk_rows)
+                    break
+                except ValueError as e:
+                    if attempt:
+                        raise
+                    print(f"Re-embed batch retrying: {e}")
+        except Exception as e:
+            print(f"Re-embedding {len(images)} images failed: {e}")
+            image_ids = []
+        self.failed += len(images) - len(image_ids)
+        self.load_time += time.time() - start
+        return len(image_ids)
+
+    def _swap_chunks(self, image_ids: list[int], chunk_rows: list):
+        """COPY re-embedded chunks (slot = image id) and replace those images' links in one transaction."""
+        if not image_ids:
+            return
+        conn = db.getconn()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(_CREATE_STAGING)
+            cursor.copy_expert("COPY bulk_chunks FROM STDIN WITH (FORMAT binary)",
+                               io.BytesIO(encode_chunk_copy(chunk_rows)))
+            cursor.execute(_STORE_REEMBEDDED, {"image_ids": image_ids})
+            cursor.execute(_LINK_REEMBEDDED)
+            linked = cursor.rowcount
+            if linked != len(chunk_rows):
+                raise ValueError(f"linked {linked} of {len(chunk_rows)} chunks; some are no longer stored")
+            cursor.execute(_RELEASE_REEMBEDDED)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            db.putconn(conn)
+        self.flushes += 1
+        self.images += len(image_ids)
+        self.chunks += len(chunk_rows)
+        print(f"Re-embedded {len(image_ids)} images, {len(chunk_rows)} embeddings")
+
+    # ------------------------------------------------------------------ indexes
+
+    def begin(self):
+        """Restore indexes left dropped by an interrupted run, then drop them for this one if enabled."""
+        restored = self._rebuild_dropped_indexes()
+        if restored:
+            print(f"Restored {restored} indexes left dropped by an earlier bulk load")
+        if self.drop_indexes:
+            self._drop_indexes()
+
+    def finish(self):
+        """Load whatever is still buffered and rebuild dropped indexes."""
+        self.flush()
+        rebuilt = self._rebuild_dropped_indexes()
+        if rebuilt:
+            print(f"Rebuilt {rebuilt} indexes in {self.index_time:.1f}s")
+
+    def _drop_indexes(self):
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT ic.relname, pg_get_indexdef(i.indexrelid)
+                FROM pg_index i
+                JOIN pg_class ic ON ic.oid = i.indexrelid
+                JOIN pg_class tc ON tc.oid = i.indrelid
+                JOIN pg_am am ON am.oid = ic.relam
+                WHERE tc.relname IN ('embedding_chunks', 'image_chunks', 'ocr_results', 'images')
+                  AND tc.relnamespace = 'public'::regnamespace
+                  AND am.amname = ANY(%s)
+            """, (list(REBUILT_INDEX_METHODS),))
+            indexes = cursor.fetchall()
+            if not indexes:
+                return
+            try:
+                # Record the definitions first, in the same transaction as the drops
+                cursor.execute("""
+                    INSERT INTO search_settings (key, value) VALUES (%s, %s)
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+                """, (DROPPED_INDEXES_KEY, json.dumps([definition for _, definition in indexes])))
+                for name, _ in indexes:
+                    cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+                conn.commit()
+                print(f"Dropped {len(indexes)} indexes for the bulk load: {', '.join(n for n, _ in indexes)}")
+            except Exception as e:
+                conn.rollback()
+                print(f"Could not drop indexes (needs the table owner), loading with them in place: {e}")
+            finally:
+                cursor.close()
+
+    def _rebuild_dropped_indexes(self) -> int:
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT to_regclass('search_settings') IS NOT NULL")
+                if not cursor.fetchone()[0]:
+                    return 0
+                cursor.execute("SELECT value FROM search_settings WHERE key = %s", (DROPPED_INDEXES_KEY,))
+                row = cursor.fetchone()
+                if not row:
+                    return 0
+                definitions = json.loads(row[0])
+                start = time.time()
+                cursor.execute("SET LOCAL maintenance_work_mem = %s",
+                               (os.getenv("BULK_LOAD_MAINTENANCE_WORK_MEM", "1GB"),))
+                for definition in definitions:
+                    print(f"Rebuilding: {definition}")
+                    cursor.execute(definition.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+                cursor.execute("DELETE FROM search_settings WHERE key = %s", (DROPPED_INDEXES_KEY,))
+                cursor.execute("ANALYZE images, ocr_results, embedding_chunks, image_chunks")
+                conn.commit()
+                self.index_time += time.time() - start
+                return len(definitions)
+            except Exception as e:
+                conn.rollback()
+                print(f"Index rebuild failed, rerun the batch or schema.sql to retry: {e}")
+                return 0
+            finally:
+                cursor.close()
+
+    def stats(self) -> str:
+        return (f"Bulk load: {self.images} images, {self.chunks} embeddings in {self.flushes} COPY batches "
+                f"({self.load_time:.1f}s), {self.fallbacks} fallbacks, {self.failed} failed"
+                + (f", indexes rebuilt in {self.index_time:.1f}s" if self.index_time else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reembed", action="store_true", help="re-chunk and re-embed all stored screenshots")
+    args = parser.parse_args()
+    if not args.reembed:
+        parser.print_help()
+        return
+    loader = BulkLoader()
+    changed = loader.reembed()
+    print(f"Re-embedded {changed} screenshots")
+    print(loader.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,10 @@ Check which screenshot files failed to process or were skipped
 """
 import os
 import glob
-import psycopg2
 from dotenv import load_dotenv
 
+import db
+
 load_dotenv()
 
 screenshot_dir = r'C:\Users\user\Pictures\Screenshots'
@@ -15,18 +16,11 @@ all_files = set(glob.glob(os.path.join(screenshot_dir, '*.png')))
 print(f"Total PNG files in directory: {len(all_files)}")
 
 # Get files in database
-conn = psycopg2.connect(
-    host=os.getenv("POSTGRES_HOST"),
-    port=os.getenv("POSTGRES_PORT"),
-    dbname=os.getenv("POSTGRES_DB"),
-    user=os.getenv("POSTGRES_USER"),
-    password=os.getenv("POSTGRES_PASSWORD")
-)
-cursor = conn.cursor()
-cursor.execute("SELECT filepath FROM images")
-processed_files = {row[0] for row in cursor.fetchall()}
-cursor.close()
-conn.close()
+with db.connection() as conn:
+    cursor = conn.cursor()
+    cursor.execute("SELECT filepath FROM images")
+    processed_files = {row[0] for row in cursor.fetchall()}
+    cursor.close()
 
 print(f"Files in database: {len(processed_files)}")
 
@@ -2,7 +2,8 @@
 \c image_search_db;
 
 -- Truncate all tables (CASCADE handles foreign key dependencies)
-TRUNCATE TABLE text_embedding CASCADE;
+TRUNCATE TABLE image_chunks CASCADE;
+TRUNCATE TABLE embedding_chunks CASCADE;
 TRUNCATE TABLE ocr_results CASCADE;
 TRUNCATE TABLE images CASCADE;
 
@@ -11,4 +12,6 @@ SELECT 'images' as table_name, COUNT(*) as record_count FROM images
 UNION ALL
 SELECT 'ocr_results', COUNT(*) FROM ocr_results
 UNION ALL
-SELECT 'text_embedding', COUNT(*) FROM text_embedding;
+SELECT 'image_chunks', COUNT(*) FROM image_chunks
+UNION ALL
+SELECT 'embedding_chunks', COUNT(*) FROM embedding_chunks;
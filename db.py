@@ -0,0 +1,216 @@
+"""
+Shared PostgreSQL connection pool.
+
+Every database function borrows a connection from one process-wide pool
+instead of opening its own, so ingesting an image or running a search no
+longer pays a TCP + authentication handshake per query:
+
+    conn = db.getconn()
+    try:
+        ...
+    finally:
+        db.putconn(conn)
+
+or `with db.connection() as conn:`. Returned connections are rolled back if a
+transaction was left open and kept for reuse; broken ones are discarded.
+DB_POOL_MIN connections are opened on first use, at most DB_POOL_MAX are open
+at once, and a caller waits up to DB_POOL_TIMEOUT seconds for a free one.
+stats() reports how often and how long callers waited.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection became free within the pool timeout."""
+
+
+def get_connect_kwargs() -> dict:
+    """psycopg2.connect arguments from the POSTGRES_* settings in .env."""
+    return dict(
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD")
+    )
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections; getconn blocks while all max_size are in use."""
+
+    def __init__(self, min_size: int = None, max_size: int = None, timeout: float = None, **connect_kwargs):
+        self.max_size = max(1, max_size or int(os.getenv("DB_POOL_MAX", "8")))
+        self.min_size = min(self.max_size, int(os.getenv("DB_POOL_MIN", "1")) if min_size is None else min_size)
+        self.timeout = float(os.getenv("DB_POOL_TIMEOUT", "30")) if timeout is None else timeout
+        self.connect_kwargs = connect_kwargs or get_connect_kwargs()
+        # Idle connections; the most recently returned one is reused first
+        self._idle: list = []
+        self._size = 0            # open connections, idle or in use
+        self._waiters: deque = deque()  # callers waiting for a connection, served first come first served
+        self._cond = threading.Condition()
+        self.pid = os.getpid()
+        self.checkouts = 0
+        self.connects = 0
+        self.discarded = 0
+        self.waits = 0            # checkouts that had to wait for a connection to be returned
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._cond:
+            self.connects += 1
+        return conn
+
+    def open(self):
+        """Open connections until min_size are idle or in use."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify_all()
+
+    def getconn(self, timeout: float = None):
+        """Borrow a connection, opening a new one while fewer than max_size exist."""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        waited = False
+        conn = None
+        token = object()
+        with self._cond:
+            self._waiters.append(token)
+            while True:
+                if self._waiters[0] is token:
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                remaining = timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    self._waiters.remove(token)
+                    self._cond.notify_all()
+                    raise PoolTimeout(f"no database connection free after {timeout:g}s "
+                                      f"({self.max_size} in use, raise DB_POOL_MAX)")
+                waited = True
+                self._cond.wait(remaining)
+            self._waiters.popleft()
+            # The next waiter may be able to go too (an idle connection or room for a new one)
+            self._cond.notify_all()
+            wait = time.perf_counter() - start
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify_all()
+                raise
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        """Return a borrowed connection; an open transaction is rolled back, a broken connection closed."""
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True        # server connection lost
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    close = True
+        if close or conn.closed:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._cond:
+                self._size -= 1
+                self.discarded += 1
+                self._cond.notify_all()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify_all()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> str:
+        with self._cond:
+            in_use = self._size - len(self._idle)
+            avg_wait = self.wait_total / self.waits * 1000 if self.waits else 0.0
+            return (f"DB pool: {self._size}/{self.max_size} open, {in_use} in use, {self.checkouts} checkouts, "
+                    f"{self.connects} connects, waited {self.waits} times "
+                    f"(avg {avg_wait:.1f} ms, max {self.wait_max * 1000:.1f} ms)")
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """The process-wide pool, created on first use (and again in a forked child)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool()
+            try:
+                _pool.open()
+            except Exception as e:
+                print(f"Could not open database connections: {e}")
+        return _pool
+
+
+def getconn():
+    return get_pool().getconn()
+
+
+def putconn(conn, close: bool = False):
+    get_pool().putconn(conn, close=close)
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for the duration of a with block."""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def stats() -> str:
+    return get_pool().stats()
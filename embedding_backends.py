@@ -0,0 +1,181 @@
+"""
+Embedding backends for bge-m3.
+
+ocr_processor.OllamaClient hands every embedding to a backend chosen by
+EMBED_BACKEND (ingest) and QUERY_EMBED_BACKEND (the search box, defaults to
+EMBED_BACKEND):
+
+- ollama: the bge-m3 model served by Ollama over HTTP (default)
+- onnx: bge-m3 exported to ONNX, run in-process on the CPU with onnxruntime,
+  so a search does not wait behind ingest work in Ollama's queue
+
+Both return 1024-dimensional dense vectors from the same model (CLS pooling,
+unit length), so they can be compared with the stored VECTOR(1024) rows and
+share the chunk store. The onnx backend needs `pip install onnxruntime
+tokenizers` and EMBED_ONNX_MODEL pointing to the exported model.onnx, with
+its tokenizer.json next to it (or at EMBED_TOKENIZER).
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+import ollama
+
+EMBEDDING_MODEL_NAME = "bge-m3:latest"
+EMBEDDING_DIMENSIONS = 1024
+EMBED_BACKENDS = ("ollama", "onnx")
+
+
+class EmbeddingBackend:
+    """Turns texts into bge-m3 vectors. Subclasses implement embed_batch."""
+
+    # Identifies the vectors in the chunk store and the query cache; backends
+    # of the same model share it so their vectors are reused across backends.
+    model_name = EMBEDDING_MODEL_NAME
+
+    def embed_batch(self, texts: list[str]) -> list[Optional[list[float]]]:
+        """One vector per text, None for each on failure."""
+        raise NotImplementedError
+
+    def generate_embedding(self, text: str) -> Optional[list[float]]:
+        if not text or not text.strip():
+            return None
+        return self.embed_batch([text])[0]
+
+
+class OllamaEmbeddingBackend(EmbeddingBackend):
+    """bge-m3 through the Ollama server."""
+
+    def __init__(self, host: str = None):
+        # An explicit host gets its own client; otherwise the module-level default (OLLAMA_HOST)
+        self._api = ollama.Client(host=host) if host else ollama
+
+    def generate_embedding(self, text: str) -> Optional[list[float]]:
+        """Generate embedding for text using Ollama's bge-m3."""
+        if not text or not text.strip():
+            return None
+
+        start_time = time.time()
+        try:
+            response = self._api.embeddings(
+                model=self.model_name,
+                prompt=text,
+                options={'num_ctx': 2048},
+                keep_alive="10m"
+            )
+            elapsed = time.time() - start_time
+            if elapsed > 0.5: # Only log slow ones
+                print(f"    Embedding took {elapsed:.2f}s")
+            return response['embedding']
+        except Exception as e:
+            print(f"Embedding error: {e}")
+            return None
+
+    def embed_batch(self, texts: list[str]) -> list[Optional[list[float]]]:
+        """Embed several texts in one request to Ollama's embed endpoint (None for each on failure)."""
+        if not texts:
+            return []
+
+        start_time = time.time()
+        try:
+            response = self._api.embed(
+                model=self.model_name,
+                input=texts,
+                options={'num_ctx': 2048},
+                keep_alive="10m"
+            )
+            elapsed = time.time() - start_time
+            if elapsed > 0.5:
+                print(f"    Embedding {len(texts)} texts took {elapsed:.2f}s")
+            embeddings = list(response['embeddings'])
+            if len(embeddings) != len(texts):
+                raise ValueError(f"expected {len(texts)} embeddings, got {len(embeddings)}")
+            return embeddings
+        except Exception as e:
+            print(f"Batch embedding error: {e}")
+            return [None] * len(texts)
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """bge-m3 exported to ONNX, run in-process with onnxruntime on the CPU."""
+
+    def __init__(self, model_path: str = None, tokenizer_path: str = None, threads: int = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = model_path or os.getenv("EMBED_ONNX_MODEL")
+        if not model_path:
+            raise ValueError("EMBED_ONNX_MODEL is not set")
+        tokenizer_path = (tokenizer_path or os.getenv("EMBED_TOKENIZER")
+                          or os.path.join(os.path.dirname(model_path), "tokenizer.json"))
+        threads = threads or int(os.getenv("EMBED_ONNX_THREADS", "4"))
+
+        start_time = time.time()
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        # Same context as the Ollama model (num_ctx 2048)
+        self.tokenizer.enable_truncation(max_length=2048)
+        pad_id = self.tokenizer.token_to_id("<pad>")
+        self.tokenizer.enable_padding(pad_id=1 if pad_id is None else pad_id, pad_token="<pad>")
+        print(f"  ONNX embedding model loaded in {time.time() - start_time:.2f}s ({threads} threads)")
+
+    def embed_batch(self, texts: list[str]) -> list[Optional[list[float]]]:
+        """Embed texts in one forward pass (None for each on failure)."""
+        if not texts:
+            return []
+        import numpy as np
+
+        start_time = time.time()
+        try:
+            encodings = self.tokenizer.encode_batch(texts)
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": input_ids,
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            }
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            output = self.session.run(None, feeds)[0]
+            if output.ndim == 3:
+                # Last hidden state: bge-m3's dense embedding is the CLS token
+                output = output[:, 0]
+            if output.shape[1] != EMBEDDING_DIMENSIONS:
+                raise ValueError(f"expected {EMBEDDING_DIMENSIONS} dimensions, got {output.shape[1]}")
+            output = output / np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+            elapsed = time.time() - start_time
+            if elapsed > 0.5:
+                print(f"    Embedding {len(texts)} texts took {elapsed:.2f}s")
+            return output.astype(np.float32).tolist()
+        except Exception as e:
+            print(f"ONNX embedding error: {e}")
+            return [None] * len(texts)
+
+
+_onnx_backend = None          # OnnxEmbeddingBackend, or False once loading it failed
+_onnx_lock = threading.Lock()
+
+
+def get_embedding_backend(kind: str = None, host: str = None) -> EmbeddingBackend:
+    """
+    Backend by name (default EMBED_BACKEND). The ONNX model is loaded once per
+    process; if it cannot be loaded, Ollama is used instead.
+    """
+    global _onnx_backend
+    kind = (kind or os.getenv("EMBED_BACKEND") or "ollama").strip().lower()
+    if kind not in EMBED_BACKENDS:
+        raise ValueError(f"EMBED_BACKEND must be one of {', '.join(EMBED_BACKENDS)}, not {kind!r}")
+    if kind == "onnx":
+        with _onnx_lock:
+            if _onnx_backend is None:
+                try:
+                    _onnx_backend = OnnxEmbeddingBackend()
+                except Exception as e:
+                    print(f"ONNX embedding backend unavailable ({e}); using Ollama")
+                    _onnx_backend = False
+            if _onnx_backend:
+                return _onnx_backend
+    return OllamaEmbeddingBackend(host)
@@ -0,0 +1,153 @@
+"""
+Cross-image embedding batches.
+
+Each image needs one embedding for its description and one per OCR chunk.
+EmbeddingBatcher collects those texts from every image being embedded at the
+same time and sends them to Ollama's embed endpoint in size-capped batches
+(EMBED_BATCH_SIZE texts, EMBED_BATCH_MAX_CHARS characters). Callers block on
+(or await) their own results only. A batch is sent once it is full or after
+EMBED_BATCH_WAIT_MS, so a lone image never waits long.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from ocr_processor import OllamaClient, get_embedding_batch_limits
+
+
+class _Request:
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.results: list[Optional[list[float]]] = [None] * len(texts)
+        self.next_index = 0        # first text not yet handed to a batch
+        self.remaining = len(texts)
+        self.future: Future = Future()
+        self.created = time.time()
+
+
+class EmbeddingBatcher:
+    """
+    Groups embedding texts from concurrent callers into batched requests.
+
+    embed(texts) blocks until this caller's vectors are ready; submit(texts)
+    returns a Future (usable from asyncio via asyncio.wrap_future). Results
+    align with texts, with None where embedding failed. Up to max_in_flight
+    batches are sent at once; while they run, new texts pile up into the next
+    batch.
+    """
+
+    def __init__(self, client: OllamaClient = None, max_texts: int = None, max_chars: int = None,
+                 max_wait: float = None, max_in_flight: int = None):
+        default_texts, default_chars = get_embedding_batch_limits()
+        self.client = client or OllamaClient()
+        self.max_texts = max(1, max_texts or default_texts)
+        self.max_chars = max_chars or default_chars
+        self.max_wait = (float(os.getenv("EMBED_BATCH_WAIT_MS", "20")) / 1000.0
+                         if max_wait is None else max_wait)
+        self.max_in_flight = max(1, max_in_flight or int(os.getenv("EMBED_BATCH_IN_FLIGHT", "1")))
+        self._pending: deque[_Request] = deque()
+        self._pending_texts = 0
+        self._pending_chars = 0
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embed-batch")
+        self._closed = False
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+        self._thread = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: list[str]) -> Future:
+        request = _Request(list(texts))
+        if not request.texts:
+            request.future.set_result([])
+            return request.future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("EmbeddingBatcher is closed")
+            self._pending.append(request)
+            self._pending_texts += len(request.texts)
+            self._pending_chars += sum(len(text) for text in request.texts)
+            self._cond.notify()
+        return request.future
+
+    def embed(self, texts: list[str]) -> list[Optional[list[float]]]:
+        return self.submit(texts).result()
+
+    def close(self):
+        """Send whatever is pending and stop the batcher."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> str:
+        average = self.texts / self.batches if self.batches else 0.0
+        return f"Embedding batches: {self.batches} requests for {self.texts} texts ({average:.1f} per request)"
+
+    def _ready(self) -> bool:
+        if not self._pending:
+            return False
+        if self._closed or self._pending_texts >= self.max_texts or self._pending_chars >= self.max_chars:
+            return True
+        return time.time() - self._pending[0].created >= self.max_wait
+
+    def _collect(self):
+        while True:
+            # Wait for a free request slot first: texts keep accumulating meanwhile
+            self._slots.acquire()
+            with self._cond:
+                while not self._ready():
+                    if self._closed and not self._pending:
+                        self._slots.release()
+                        return
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self.max_wait - (time.time() - self._pending[0].created))
+                    self._cond.wait(timeout)
+                batch = self._take_batch()
+            self._executor.submit(self._send, batch)
+
+    def _take_batch(self) -> list[tuple[_Request, int]]:
+        """Pop up to max_texts / max_chars pending texts, oldest first (always at least one)."""
+        batch = []
+        chars = 0
+        while self._pending and len(batch) < self.max_texts:
+            request = self._pending[0]
+            text = request.texts[request.next_index]
+            if batch and chars + len(text) > self.max_chars:
+                break
+            batch.append((request, request.next_index))
+            chars += len(text)
+            request.next_index += 1
+            self._pending_texts -= 1
+            self._pending_chars -= len(text)
+            if request.next_index == len(request.texts):
+                self._pending.popleft()
+        return batch
+
+    def _send(self, batch: list[tuple[_Request, int]]):
+        try:
+            vectors = self.client.embed_batch([request.texts[index] for request, index in batch])
+        except Exception as e:
+            print(f"Batch embedding error: {e}")
+            vectors = [None] * len(batch)
+        finally:
+            self._slots.release()
+        finished = []
+        # A request split over batches may be completed by two senders at once
+        with self._lock:
+            self.batches += 1
+            self.texts += len(batch)
+            for (request, index), vector in zip(batch, vectors):
+                request.results[index] = vector
+                request.remaining -= 1
+                if request.remaining == 0:
+                    finished.append(request)
+        for request in finished:
+            request.future.set_result(request.results)
@@ -0,0 +1,144 @@
+"""
+Incremental OCR for consecutive screenshots.
+
+Most watcher captures differ from the previous one in a small area (a new
+chat message, a cursor, a scrolled panel). IncrementalOCR diffs a new frame
+against the last processed frame of the same size, runs OCR only on the
+changed tiles, and merges those lines with the cached lines of the untouched
+part of the screen.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# ((x0, y0, x1, y1), text, score) - same shape as ocr_processor.OCRLine
+Line = tuple
+
+
+def _intersects(a, b) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class IncrementalOCR:
+    """
+    Caches the most recent frame (and its OCR lines) per frame size.
+
+    Env settings:
+      INCREMENTAL_OCR_TILE        tile edge in pixels (default 64)
+      INCREMENTAL_OCR_MAX_CHANGE  changed-area fraction above which a full OCR is cheaper (default 0.5)
+    """
+
+    def __init__(self, tile_size: int = None, max_changed_ratio: float = None,
+                 pixel_threshold: int = 12, max_frames: int = 4):
+        self.tile_size = tile_size or int(os.getenv("INCREMENTAL_OCR_TILE", "64"))
+        self.max_changed_ratio = max_changed_ratio if max_changed_ratio is not None else \
+            float(os.getenv("INCREMENTAL_OCR_MAX_CHANGE", "0.5"))
+        self.pixel_threshold = pixel_threshold
+        self.max_frames = max_frames
+        # shape -> (gray frame, lines); one entry per monitor layout
+        self._frames: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.full_runs = 0
+        self.incremental_runs = 0
+        self.reused_runs = 0
+
+    def ocr(self, img, recognise: Callable[[object], list[Line]]) -> list[Line]:
+        """
+        Return OCR lines for img. recognise(region) must OCR a BGR array and
+        return lines with boxes relative to that array.
+        """
+        import cv2
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        with self._lock:
+            previous = self._frames.get(gray.shape)
+
+        if previous is None:
+            lines = recognise(img)
+            self.full_runs += 1
+        else:
+            prev_gray, prev_lines = previous
+            regions = self._changed_regions(prev_gray, gray, prev_lines)
+            if regions is None:
+                lines = recognise(img)
+                self.full_runs += 1
+            elif not regions:
+                lines = list(prev_lines)
+                self.reused_runs += 1
+                print(f"    Incremental OCR: frame unchanged, reused {len(lines)} lines")
+            else:
+                lines = self._merge(img, regions, prev_lines, recognise)
+                self.incremental_runs += 1
+
+        with self._lock:
+            self._frames[gray.shape] = (gray, lines)
+            self._frames.move_to_end(gray.shape)
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+        return lines
+
+    def _changed_regions(self, prev_gray, gray, prev_lines: list[Line]) -> Optional[list[tuple]]:
+        """
+        Pixel rectangles to re-OCR: [] when nothing changed, None when so much
+        changed that a full pass is cheaper.
+        """
+        import cv2
+        import numpy as np
+        tile = self.tile_size
+        height, width = gray.shape
+        changed = cv2.absdiff(prev_gray, gray) > self.pixel_threshold
+        if not changed.any():
+            return []
+
+        rows = -(-height // tile)
+        cols = -(-width // tile)
+        padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+        padded[:height, :width] = changed
+        tile_mask = padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+        if tile_mask.mean() > self.max_changed_ratio:
+            return None
+
+        # Grow by one tile so text touching a changed tile is read in full
+        tile_mask = cv2.dilate(tile_mask.astype(np.uint8), np.ones((3, 3), np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(tile_mask, connectivity=8)
+        regions = []
+        for label in range(1, count):
+            x, y, w, h = stats[label][:4]
+            regions.append((x * tile, y * tile, min((x + w) * tile, width), min((y + h) * tile, height)))
+
+        # A previous line cut by a region must be re-read entirely, so widen the
+        # region to cover it; repeat until no region grows any more
+        grown = True
+        while grown:
+            grown = False
+            for i, region in enumerate(regions):
+                for box, _, _ in prev_lines:
+                    if _intersects(box, region):
+                        merged = _union(region, box)
+                        merged = (max(0, merged[0]), max(0, merged[1]), min(width, merged[2]), min(height, merged[3]))
+                        if merged != region:
+                            regions[i] = region = merged
+                            grown = True
+        return regions
+
+    def _merge(self, img, regions: list[tuple], prev_lines: list[Line],
+               recognise: Callable[[object], list[Line]]) -> list[Line]:
+        kept = [line for line in prev_lines if not any(_intersects(line[0], r) for r in regions)]
+        fresh = []
+        for x0, y0, x1, y1 in regions:
+            for (bx0, by0, bx1, by1), text, score in recognise(img[y0:y1, x0:x1]):
+                box = (bx0 + x0, by0 + y0, bx1 + x0, by1 + y0)
+                # Overlapping regions can read the same line twice
+                if not any(text == t and _intersects(box, b) for b, t, _ in fresh):
+                    fresh.append((box, text, score))
+
+        area = sum((r[2] - r[0]) * (r[3] - r[1]) for r in regions)
+        total = img.shape[0] * img.shape[1]
+        print(f"    Incremental OCR: re-read {len(regions)} regions ({area / total:.0%} of frame), "
+              f"kept {len(kept)} cached lines, {len(fresh)} new")
+        # Reading order: top to bottom, then left to right
+        return sorted(kept + fresh, key=lambda line: (line[0][1], line[0][0]))
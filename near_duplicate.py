@@ -0,0 +1,120 @@
+"""
+Perceptual near-duplicate detection for screenshot bursts.
+
+Every processed image gets a 256-bit difference hash (dHash) of a 17x16
+grayscale thumbnail. Screenshots of the same window that differ only in a
+few pixels hash to (nearly) the same bits, so a new capture within
+NEAR_DUPLICATE_DISTANCE bits of an existing one can skip the vision model.
+"""
+import os
+import threading
+from typing import Optional, Tuple
+
+import db
+
+HASH_SIZE = 16  # 16x16 = 256 bits
+
+
+def compute_perceptual_hash(img) -> str:
+    """dHash of a decoded BGR image, returned as a 64-character hex string."""
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    # One bit per pixel: is it brighter than its right-hand neighbour?
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return f"{value:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """Number of differing bits between two hex hashes."""
+    return (int(hash_a, 16) ^ int(hash_b, 16)).bit_count()
+
+
+def get_near_duplicate_mode() -> str:
+    """
+    NEAR_DUPLICATE_MODE from .env:
+      update - reuse the matched image's description, run OCR fresh (default)
+      reuse  - reuse OCR text, description and embeddings as-is
+      off    - always run the full pipeline
+    """
+    mode = os.getenv("NEAR_DUPLICATE_MODE", "update").strip().lower()
+    return mode if mode in ("update", "reuse", "off") else "update"
+
+
+def get_max_distance() -> int:
+    """NEAR_DUPLICATE_DISTANCE: maximum differing bits (out of 256) to count as a match."""
+    return int(os.getenv("NEAR_DUPLICATE_DISTANCE", "8"))
+
+
+class NearDuplicateIndex:
+    """
+    In-memory index of perceptual hashes of fully processed images.
+    refresh() pulls rows added since the last call, so hashes written by
+    other processes (watcher and batch processor) are picked up too.
+    """
+
+    def __init__(self, max_distance: int = None):
+        self.max_distance = get_max_distance() if max_distance is None else max_distance
+        self._hashes: list[Tuple[int, int]] = []  # (image_id, hash as int), oldest first
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        conn = None
+        cursor = None
+        try:
+            conn = db.getconn()
+            cursor = conn.cursor()
+            with self._lock:
+                last_id = self._last_id
+            cursor.execute("""
+                SELECT id, perceptual_hash FROM images
+                WHERE id > %s AND perceptual_hash IS NOT NULL AND ai_description <> ''
+                ORDER BY id
+            """, (last_id,))
+            rows = cursor.fetchall()
+            with self._lock:
+                for image_id, phash in rows:
+                    if image_id > self._last_id:
+                        self._hashes.append((image_id, int(phash, 16)))
+                        self._last_id = image_id
+        except Exception as e:
+            print(f"Error loading perceptual hashes: {e}")
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                db.putconn(conn)
+
+    def find(self, phash: str) -> Optional[Tuple[int, int]]:
+        """Return (image_id, distance) of the closest processed image within max_distance."""
+        if self.max_distance < 0:
+            return None
+        self.refresh()
+        target = int(phash, 16)
+        best = None
+        with self._lock:
+            hashes = list(self._hashes)
+        # Newest first: bursts usually match the previous capture
+        for image_id, value in reversed(hashes):
+            distance = (value ^ target).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best[1]):
+                best = (image_id, distance)
+                if distance == 0:
+                    break
+        return best
+
+
+_index: Optional[NearDuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index() -> NearDuplicateIndex:
+    """Process-wide index, created on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex()
+        return _index
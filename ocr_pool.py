@@ -0,0 +1,89 @@
+"""
+Process pool of PaddleOCR workers.
+
+Each worker process loads its own PaddleOCR engine once and then receives
+decoded images, so batch OCR scales with the number of CPU cores instead of
+sharing a single engine in the parent process.
+"""
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional
+
+# Engine owned by this worker process (set by _init_worker)
+_worker_engine = None
+
+
+def _init_worker(cpu_threads: int):
+    """Load one OCR engine per worker process."""
+    global _worker_engine
+    # Split the cores between workers instead of every engine using all of them
+    os.environ["OCR_CPU_THREADS"] = str(cpu_threads)
+    import logging
+    logging.getLogger("ppocr").setLevel(logging.ERROR)
+    import ocr_processor
+    _worker_engine = ocr_processor.get_ocr_engine()
+
+
+def _ocr_worker(img) -> list:
+    import ocr_processor
+    return ocr_processor.run_paddle_ocr(_worker_engine, img)
+
+
+def _detect_worker(img) -> list:
+    import ocr_processor
+    return ocr_processor.run_paddle_detection(_worker_engine, img)
+
+
+def get_pool_size() -> int:
+    """OCR_POOL_WORKERS from .env; 0 (the default) keeps OCR in-process."""
+    value = os.getenv("OCR_POOL_WORKERS", "0").strip().lower()
+    if value == "auto":
+        return max(1, (os.cpu_count() or 2) - 1)
+    return max(0, int(value or 0))
+
+
+class OCRWorkerPool:
+    """Pool of worker processes, each running its own PaddleOCR engine."""
+
+    def __init__(self, workers: int = None, cpu_threads: int = None):
+        self.workers = workers or get_pool_size() or 1
+        # Default: share the machine's cores evenly between the workers
+        self.cpu_threads = cpu_threads or int(
+            os.getenv("OCR_CPU_THREADS", str(max(1, (os.cpu_count() or 1) // self.workers)))
+        )
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        if self._executor is None:
+            print(f"Starting {self.workers} OCR worker processes ({self.cpu_threads} threads each)...")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.cpu_threads,),
+            )
+        return self
+
+    def submit(self, img) -> Future:
+        """Queue a decoded image; the future resolves to its OCR lines (box, text, score)."""
+        self.start()
+        return self._executor.submit(_ocr_worker, img)
+
+    def ocr(self, img) -> list:
+        """OCR a decoded image in a worker process and wait for the lines."""
+        return self.submit(img).result()
+
+    def submit_detection(self, img) -> Future:
+        """Queue a decoded image for text detection only; resolves to line boxes."""
+        self.start()
+        return self._executor.submit(_detect_worker, img)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,22 +1,51 @@
 import os
-import base64
+import threading
+import time
 from datetime import datetime
 from dotenv import load_dotenv
-import requests
-from PIL import Image
 import ollama
-import psycopg2
+import db
 from typing import Optional, Tuple
 import unicodedata
-from paddleocr import PaddleOCR
 import logging
+from embedding_backends import get_embedding_backend
+from near_duplicate import compute_perceptual_hash, get_near_duplicate_index, get_near_duplicate_mode
+from ocr_tiling import needs_tiling, tiled_ocr
+from query_cache import get_query_cache
+import text_chunker
+from vision_cache import get_description_cache
+from vision_payload import prepare_payload
+# paddleocr, cv2, numpy and PIL are imported inside the functions that need
+# them, so search-only callers (app.py) never pay for loading the OCR stack.
 
 # Disable PaddleOCR logging to keep console clean
 logging.getLogger("ppocr").setLevel(logging.ERROR)
 
-# Initialize PaddleOCR (Using CPU mode - reliable and fast enough for this use case)
-# GPU mode requires CUDA 11.8, but CPU mode works well (~3-5s per image)
-ocr_engine = PaddleOCR(use_angle_cls=True, lang='korean', use_gpu=False, show_log=False)
+def create_ocr_engine():
+    """Build a PaddleOCR engine. OCR_CPU_THREADS caps the math threads it uses."""
+    import time
+    from paddleocr import PaddleOCR
+    start_time = time.time()
+    # Using CPU mode - reliable and fast enough for this use case
+    # GPU mode requires CUDA 11.8, but CPU mode works well (~3-5s per image)
+    cpu_threads = int(os.getenv("OCR_CPU_THREADS", "10"))
+    engine = PaddleOCR(use_angle_cls=True, lang='korean', use_gpu=False, show_log=False,
+                       cpu_threads=cpu_threads)
+    print(f"  PaddleOCR engine loaded in {time.time() - start_time:.2f}s")
+    return engine
+
+# Built on first use by get_ocr_engine(), not at import time
+_ocr_engine = None
+_ocr_engine_lock = threading.Lock()
+
+def get_ocr_engine():
+    """Return the process-wide PaddleOCR engine, loading it on the first call."""
+    global _ocr_engine
+    if _ocr_engine is None:
+        with _ocr_engine_lock:
+            if _ocr_engine is None:
+                _ocr_engine = create_ocr_engine()
+    return _ocr_engine
 
 # Load variables from .env
 load_dotenv()
@@ -33,13 +62,38 @@ def are_models_loading():
     """Ollama models load on demand."""
     return False
 
+def get_embedding_batch_limits() -> Tuple[int, int]:
+    """Max texts and max characters per embed request (EMBED_BATCH_SIZE, EMBED_BATCH_MAX_CHARS)."""
+    return int(os.getenv("EMBED_BATCH_SIZE", "32")), int(os.getenv("EMBED_BATCH_MAX_CHARS", "32000"))
+
+def plan_embedding_batches(texts: list[str], max_texts: int = None, max_chars: int = None) -> list[list[str]]:
+    """Split texts, in order, into batches capped by count and total characters."""
+    default_texts, default_chars = get_embedding_batch_limits()
+    max_texts = max(1, max_texts or default_texts)
+    max_chars = max_chars or default_chars
+    batches = []
+    batch, batch_chars = [], 0
+    for text in texts:
+        if batch and (len(batch) >= max_texts or batch_chars + len(text) > max_chars):
+            batches.append(batch)
+            batch, batch_chars = [], 0
+        batch.append(text)
+        batch_chars += len(text)
+    if batch:
+        batches.append(batch)
+    return batches
+
 class OllamaClient:
     """Client for Ollama API interactions and bge-m3 embeddings."""
 
-    def __init__(self, host: str = None):
+    def __init__(self, host: str = None, embed_backend: str = None):
         self.host = host or os.getenv("LOCAL_LLM_API_URL")
         self.model = os.getenv("LOCAL_LLM_MODEL", "qwen3-vl:30b")
-        self.embedding_model_name = "bge-m3:latest"
+        # An explicit host gets its own client; otherwise the module-level default (OLLAMA_HOST)
+        self._api = ollama.Client(host=host) if host else ollama
+        # Embeddings go to Ollama or an in-process model, see embedding_backends (EMBED_BACKEND)
+        self.embedder = get_embedding_backend(embed_backend, host=host)
+        self.embedding_model_name = self.embedder.model_name
 
     def is_available(self) -> bool:
         """Check if Ollama is running."""
@@ -58,26 +112,19 @@ class OllamaClient:
             return []
 
     def generate_embedding(self, text: str) -> Optional[list[float]]:
-        """Generate embedding for text using Ollama's bge-m3."""
-        if not text or not text.strip():
-            return None
+        """Generate embedding for text with bge-m3."""
+        return self.embedder.generate_embedding(text)
 
-        import time
-        start_time = time.time()
-        try:
-            response = ollama.embeddings(
-                model=self.embedding_model_name, 
-                prompt=text,
-                options={'num_ctx': 2048},
-                keep_alive="10m"
-            )
-            elapsed = time.time() - start_time
-            if elapsed > 0.5: # Only log slow ones
-                print(f"    Embedding took {elapsed:.2f}s")
-            return response['embedding']
-        except Exception as e:
-            print(f"Embedding error: {e}")
-            return None
+    def embed_batch(self, texts: list[str]) -> list[Optional[list[float]]]:
+        """Embed several texts in one request (None for each on failure)."""
+        return self.embedder.embed_batch(texts)
+
+    def generate_embeddings(self, texts: list[str]) -> list[Optional[list[float]]]:
+        """Embed many texts using as few requests as the batch caps allow; results align with texts."""
+        results = []
+        for batch in plan_embedding_batches(texts):
+            results.extend(self.embed_batch(batch))
+        return results
 
     def generate_embeddings_with_chunks(self, text: str) -> list[Tuple[int, list[float]]]:
         """Generate embeddings for text chunks using Ollama."""
@@ -87,168 +134,269 @@ class OllamaClient:
         chunks = self.chunk_text(text)
         print(f"Text divided into {len(chunks)} chunks")
 
-        results = []
-        try:
-            for i, chunk in enumerate(chunks):
-                emb = self.generate_embedding(chunk)
-                if emb:
-                    results.append((i, emb))
-            return results
-        except Exception as e:
-            print(f"Batch embedding error: {e}")
-            return []
+        return [(i, emb) for i, emb in enumerate(self.generate_embeddings(chunks)) if emb]
 
-    def chunk_text(self, text: str, max_chunk_size: int = 1000, overlap: int = 100) -> list[str]:
-        """Split long text into overlapping chunks for embedding."""
-        if not text or len(text) <= max_chunk_size:
-            return [text] if text else []
+    def chunk_text(self, text: str, max_tokens: int = None, overlap_tokens: int = None) -> list[str]:
+        """Split long text into overlapping chunks of at most EMBED_CHUNK_TOKENS tokens."""
+        return text_chunker.chunk_text(text, max_tokens, overlap_tokens)
 
-        chunks = []
-        start = 0
+def read_image_file(image_path: str) -> bytes:
+    """Read the raw bytes of an image file (works with non-ASCII paths)."""
+    with open(image_path, 'rb') as f:
+        return f.read()
 
-        while start < len(text):
-            end = start + max_chunk_size
+def compute_content_hash(data: bytes) -> str:
+    """SHA-256 of the file bytes; identical files share a hash wherever they live."""
+    import hashlib
+    return hashlib.sha256(data).hexdigest()
 
-            if end < len(text):
-                for break_char in ['\n\n', '\n', '. ', ', ']:
-                    break_pos = text.rfind(break_char, start + max_chunk_size // 2, end)
-                    if break_pos > start:
-                        end = break_pos + len(break_char)
-                        break
+def decode_image(data: bytes):
+    """Decode raw image bytes into a BGR array (None if unreadable)."""
+    import cv2
+    import numpy as np
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
 
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
+def load_image(image_path: str):
+    """Decode an image file into a BGR array (None if unreadable)."""
+    # Use cv2.imdecode to safely read paths with non-ASCII characters
+    return decode_image(read_image_file(image_path))
 
-            start = end - overlap
+# One recognised line: ((x0, y0, x1, y1) bounding box, text, score)
+OCRLine = Tuple[Tuple[int, int, int, int], str, float]
 
+def run_paddle_ocr(engine, img) -> list[OCRLine]:
+    """Run an OCR engine over a decoded image and return the recognised lines."""
+    result = engine.ocr(img, cls=True)
+    if not result or not result[0]:
+        return []
+    lines = []
+    # result[0] holds [box (4 corner points), (text, score)] per line
+    for points, (text, score) in result[0]:
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        box = (int(min(xs)), int(min(ys)), int(max(xs)) + 1, int(max(ys)) + 1)
+        lines.append((box, text, float(score)))
+    return lines
 
-        return chunks
+def run_paddle_detection(engine, img) -> list[Tuple[int, int, int, int]]:
+    """Text detection only (no recognition): bounding boxes of text lines."""
+    result = engine.ocr(img, det=True, rec=False, cls=False)
+    if not result or not result[0]:
+        return []
+    boxes = []
+    for points in result[0]:
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        boxes.append((int(min(xs)), int(min(ys)), int(max(xs)) + 1, int(max(ys)) + 1))
+    return boxes
 
-def get_paddle_ocr_text(image_path: str) -> str:
-    """Extract text using PaddleOCR with GPU acceleration."""
+def get_paddle_ocr_lines(image_path: str, ocr_pool=None, img=None, incremental=None) -> list[OCRLine]:
+    """
+    Extract text lines (box, text, score) using PaddleOCR.
+    Pass img (from load_image) to reuse an already decoded image instead of reading the file.
+    When an ocr_pool.OCRWorkerPool is given, recognition runs in one of its worker processes.
+    With an incremental_ocr.IncrementalOCR, only regions that changed since the
+    previous frame of the same size are recognised.
+    Very large images (or regions) are OCR'd in tiles at an adaptive scale, see ocr_tiling.
+    """
     import time
-    import cv2
-    import numpy as np
     start_time = time.time()
     try:
         print(f"  PaddleOCR Extraction...")
-        # Use cv2.imdecode to safely read paths with non-ASCII characters
-        img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            img = load_image(image_path)
         if img is None:
             print(f"    Error: Could not read image at {image_path}")
-            return ""
+            return []
             
-        result = ocr_engine.ocr(img, cls=True)
+        def recognise_direct(region):
+            if ocr_pool is not None:
+                return ocr_pool.ocr(region)
+            return run_paddle_ocr(get_ocr_engine(), region)
+        
+        def recognise(region):
+            if needs_tiling(region):
+                return tiled_ocr(region, recognise_direct, ocr_pool=ocr_pool)
+            return recognise_direct(region)
+        
+        if incremental is not None:
+            ocr_lines = incremental.ocr(img, recognise)
+        else:
+            ocr_lines = recognise(img)
         
         elapsed = time.time() - start_time
-        if not result or not result[0]:
+        if not ocr_lines:
             print(f"    PaddleOCR returned no text (took {elapsed:.2f}s)")
-            return ""
-            
-        # Extract text and join with spaces
-        lines = []
-        for line in result[0]:
-            lines.append(line[1][0])
+            return []
             
-        full_text = " ".join(lines)
-        print(f"    PaddleOCR complete in {elapsed:.2f}s ({len(lines)} lines)")
+        print(f"    PaddleOCR complete in {elapsed:.2f}s ({len(ocr_lines)} lines, "
+              f"confidence {get_ocr_confidence(ocr_lines):.2f})")
         
         # Print OCR results for verification
         print("\n--- OCR RESULTS START ---")
-        for idx, line in enumerate(lines, 1):
-            print(f"{idx:2d}. {line}")
+        for idx, (_, text, score) in enumerate(ocr_lines, 1):
+            print(f"{idx:2d}. [{score:.2f}] {text}")
         print("--- OCR RESULTS END ---\n")
         
-        return full_text
+        return ocr_lines
     except Exception as e:
         print(f"PaddleOCR error: {e}")
-        return ""
+        return []
 
-def get_ai_description(image_path: str) -> Tuple[str, str]:
-    """Retrieve only a description from the vision model."""
+def get_paddle_ocr_text(image_path: str, ocr_pool=None, img=None, incremental=None) -> str:
+    """Extract text using PaddleOCR; lines joined with spaces (see get_paddle_ocr_lines)."""
+    lines = get_paddle_ocr_lines(image_path, ocr_pool=ocr_pool, img=img, incremental=incremental)
+    return " ".join(text for _, text, _ in lines)
+
+# Optimized Description Prompt
+VISION_PROMPT = (
+    "Provide a clear and professional summary of this screenshot in 8-10 sentences as well as texts up to 100 words. "
+    "Identify the primary application(s) visible and describe the user’s main activity. "
+    "Highlight key on-screen content with specificity. "
+    "Ensure the description is accurate, concise, and contextually informative."
+)
+# Bump when the prompt or its options change in a way that should regenerate cached descriptions
+VISION_PROMPT_VERSION = "1"
+
+def get_prompt_version() -> str:
+    """Explicit version plus a digest of the prompt text, so edits never reuse stale descriptions."""
+    import hashlib
+    return f"{VISION_PROMPT_VERSION}:{hashlib.sha1(VISION_PROMPT.encode('utf-8')).hexdigest()[:8]}"
+
+def get_vision_model() -> str:
+    return os.getenv("LOCAL_LLM_MODEL", "qwen3-vl-4b-gpu-only")
+
+def vision_chat_request(image_data: bytes, stream: bool = False) -> dict:
+    """Keyword arguments for a vision chat call (shared by the sync and asyncio clients)."""
+    return dict(
+        model=get_vision_model(),
+        messages=[{
+            'role': 'user',
+            'content': VISION_PROMPT,
+            'images': [image_data]
+        }],
+        options={
+            'num_ctx': 4096,
+            'num_gpu': 99,
+        },
+        keep_alive="10m",
+        stream=stream
+    )
+
+def request_description(image_data: bytes, client=None, stream: bool = True) -> str:
+    """
+    Send one prepared image to the vision model and return the description.
+    Raises on connection errors and timeouts so callers can retry.
+    With stream=True the description is echoed to the console as it arrives.
+    """
+    chat = client.chat if client is not None else ollama.chat
+    response = chat(**vision_chat_request(image_data, stream=stream))
+    if not stream:
+        return response['message']['content'].strip()
+    
+    description = ""
+    print("\n--- AI DESCRIPTION START ---")
+    for chunk in response:
+        chunk_content = chunk['message']['content']
+        description += chunk_content
+        print(chunk_content, end='', flush=True)
+    print("\n--- AI DESCRIPTION END ---\n")
+    return description.strip()
+
+def get_ai_description(image_path: str, img=None, scheduler=None, content_hash: str = None,
+                       raw_bytes: bytes = None) -> Tuple[str, str]:
+    """
+    Retrieve only a description from the vision model.
+    Pass img (from load_image) to reuse an already decoded image instead of reading the file.
+    With a vision_scheduler.VisionScheduler the request shares its bounded pool of
+    in-flight model calls (with timeouts and retries) instead of a blocking streaming call.
+    Descriptions are cached per (content_hash, model, prompt version); see vision_cache.
+    raw_bytes (the original file) lets small files skip re-encoding; see vision_payload.
+    """
     import time
-    from PIL import Image
-    import io
     
     start_time = time.time()
     try:
-        model = os.getenv("LOCAL_LLM_MODEL", "qwen3-vl-4b-gpu-only")
+        model = get_vision_model()
         print(f"  AI Vision Description using {model}...")
         
-        # 1. Optimize Image for Vision
-        with Image.open(image_path) as img:
-            max_size = 1620 
-            if max(img.size) > max_size:
-                scale = max_size / max(img.size)
-                new_size = (int(img.width * scale), int(img.height * scale))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            buf = io.BytesIO()
-            img.save(buf, format='PNG')
-            image_data = buf.getvalue()
-            
-        # 2. Optimized Description Prompt
-        prompt = (
-            "Provide a clear and professional summary of this screenshot in 8-10 sentences as well as texts up to 100 words. "
-            "Identify the primary application(s) visible and describe the user’s main activity. "
-            "Highlight key on-screen content with specificity. "
-            "Ensure the description is accurate, concise, and contextually informative."
-        )
+        # 0. Same bytes, model and prompt as before? Reuse the cached description
+        if img is None and raw_bytes is None:
+            raw_bytes = read_image_file(image_path)
+        if content_hash is None and raw_bytes is not None:
+            content_hash = compute_content_hash(raw_bytes)
+        cache = get_description_cache()
+        prompt_version = get_prompt_version()
+        if cache is not None and content_hash:
+            cached = cache.get(content_hash, model, prompt_version)
+            if cached:
+                print(f"    Vision Description from cache ({len(cached)} chars)")
+                return cached, model
         
-        response_stream = ollama.chat(
-            model=model,
-            messages=[{
-                'role': 'user',
-                'content': prompt,
-                'images': [image_data]
-            }],
-            options={
-                'num_ctx': 4096, 
-                'num_gpu': 99,
-            },
-            keep_alive="10m",
-            stream=True
-        )
+        # 1. Optimize Image for Vision (downscaled from the shared decoded buffer)
+        if img is None:
+            img = decode_image(raw_bytes)
+            if img is None:
+                print(f"    Error: Could not read image at {image_path}")
+                return "", ""
+        image_data = prepare_payload(img, raw_bytes=raw_bytes, content_hash=content_hash)
+            
+        # 2. Ask the model
+        if scheduler is not None:
+            description = scheduler.describe(image_data)
+        else:
+            description = request_description(image_data)
         
-        description = ""
-        print("\n--- AI DESCRIPTION START ---")
-        for chunk in response_stream:
-            chunk_content = chunk['message']['content']
-            description += chunk_content
-            print(chunk_content, end='', flush=True)
-        print("\n--- AI DESCRIPTION END ---\n")
+        if cache is not None and content_hash and description:
+            cache.put(content_hash, model, prompt_version, description)
         
         elapsed = time.time() - start_time
         print(f"    Vision Description complete in {elapsed:.2f}s")
         
-        return description.strip(), model
+        return description, model
     except Exception as e:
         print(f"Error during vision analysis: {e}")
         return "", ""
 
-def get_ocr_confidence(image_path: str) -> float:
-    """Ollama doesn't return per-token confidence easily. Returning 1.0 for now."""
-    return 1.0
+def get_ocr_confidence(lines: list[OCRLine]) -> float:
+    """Aggregate OCR confidence: per-line PaddleOCR scores weighted by line length."""
+    total_chars = sum(len(text) for _, text, _ in lines)
+    if not total_chars:
+        return 0.0
+    return sum(score * len(text) for _, text, score in lines) / total_chars
+
+def route_vision(lines: list[OCRLine]) -> str:
+    """
+    Decide whether an image needs the vision model (VISION_ROUTING in .env):
+      always  - describe every image (default)
+      skip    - no description when OCR alone is rich and confident
+      defer   - same test, but mark the image to be described later by describe_deferred_images()
+    Returns "describe", "skip" or "defer".
+    """
+    policy = os.getenv("VISION_ROUTING", "always").strip().lower()
+    if policy not in ("skip", "defer"):
+        return "describe"
+    text_chars = sum(len(text) for _, text, _ in lines)
+    rich = (len(lines) >= int(os.getenv("VISION_SKIP_MIN_LINES", "15")) and
+            text_chars >= int(os.getenv("VISION_SKIP_MIN_CHARS", "400")))
+    confident = get_ocr_confidence(lines) >= float(os.getenv("VISION_SKIP_MIN_CONFIDENCE", "0.9"))
+    if rich and confident:
+        print(f"  Text-rich screenshot ({len(lines)} lines, {text_chars} chars): vision {policy}")
+        return policy
+    return "describe"
+
+def lines_to_json(lines: list[OCRLine]) -> str:
+    """Serialise OCR lines for the ocr_results.lines column."""
+    import json
+    return json.dumps([{"text": text, "confidence": round(score, 4), "box": list(box)}
+                       for box, text, score in lines], ensure_ascii=False)
 
 def check_for_duplicate_image(filepath: str) -> Optional[int]:
     """Check if an image with the given filepath already exists and return its ID."""
-    db_host = os.getenv("POSTGRES_HOST")
-    db_port = os.getenv("POSTGRES_PORT")
-    db_name = os.getenv("POSTGRES_DB")
-    db_user = os.getenv("POSTGRES_USER")
-    db_password = os.getenv("POSTGRES_PASSWORD")
-
     conn = None
     cursor = None
     try:
-        conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            dbname=db_name,
-            user=db_user,
-            password=db_password
-        )
+        conn = db.getconn()
         cursor = conn.cursor()
         
         select_query = "SELECT id FROM images WHERE filepath = %s"
@@ -266,217 +414,736 @@ def check_for_duplicate_image(filepath: str) -> Optional[int]:
         if cursor:
             cursor.close()
         if conn:
-            conn.close()
+            db.putconn(conn)
 
-def store_image_data(filename: str, filepath: str, timestamp: datetime, ai_description: str = None, model_name: str = None) -> int:
-    """Store image metadata in database and return the image_id."""
-    db_host = os.getenv("POSTGRES_HOST")
-    db_port = os.getenv("POSTGRES_PORT")
-    db_name = os.getenv("POSTGRES_DB")
-    db_user = os.getenv("POSTGRES_USER")
-    db_password = os.getenv("POSTGRES_PASSWORD")
+def find_image_by_hash(content_hash: str) -> Optional[int]:
+    """Return the ID of an already processed image with identical bytes, if any."""
+    conn = None
+    cursor = None
+    try:
+        conn = db.getconn()
+        cursor = conn.cursor()
+        # Only reuse images whose embeddings were stored, i.e. fully processed ones
+        cursor.execute("""
+            SELECT i.id FROM images i
+            WHERE i.content_hash = %s
+              AND EXISTS (SELECT 1 FROM image_chunks ic WHERE ic.image_id = i.id)
+            ORDER BY i.id
+            LIMIT 1
+        """, (content_hash,))
+        result = cursor.fetchone()
+        return result[0] if result else None
 
+    except Exception as e:
+        print(f"Error looking up content hash: {e}")
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            db.putconn(conn)
+
+def copy_image_results(source_image_id: int, image_path: str, content_hash: str,
+                       perceptual_hash: str = None, reason: str = "reused") -> tuple[bool, str]:
+    """
+    Register image_path by copying the description, OCR text and embeddings of an
+    identical (or near-identical) image that was already processed. Runs in a single transaction.
+    Returns: (success: bool, reason: str)
+    """
+    timestamp = datetime.fromtimestamp(os.path.getmtime(image_path))
+    conn = None
+    cursor = None
     try:
-        conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            dbname=db_name,
-            user=db_user,
-            password=db_password
-        )
+        conn = db.getconn()
         cursor = conn.cursor()
 
-        insert_query = """
-            INSERT INTO images (filename, filepath, timestamp, ai_description, model_name) 
-            VALUES (%s, %s, %s, %s, %s) 
+        cursor.execute("""
+            INSERT INTO images (filename, filepath, timestamp, ai_description, model_name,
+                                content_hash, perceptual_hash, vision_deferred)
+            SELECT %s, %s, %s, ai_description, model_name, %s, COALESCE(%s, perceptual_hash), vision_deferred
+            FROM images WHERE id = %s
             RETURNING id
-        """
-        cursor.execute(insert_query, (filename, filepath, timestamp, ai_description, model_name))
-        image_id = cursor.fetchone()[0]
+        """, (os.path.basename(image_path), image_path, timestamp, content_hash, perceptual_hash, source_image_id))
+        row = cursor.fetchone()
+        if not row:
+            conn.rollback()
+            return False, "database_error"
+        image_id = row[0]
+
+        cursor.execute("""
+            INSERT INTO ocr_results (image_id, text, confidence, lines)
+            SELECT %s, text, confidence, lines FROM ocr_results WHERE image_id = %s
+        """, (image_id, source_image_id))
+        # Chunks are shared, not copied: only references are added (ref counts follow by trigger)
+        cursor.execute("""
+            INSERT INTO image_chunks (image_id, chunk_index, chunk_id)
+            SELECT %s, chunk_index, chunk_id FROM image_chunks WHERE image_id = %s
+        """, (image_id, source_image_id))
+        copied = cursor.rowcount
+
         conn.commit()
-        print(f"Stored image metadata with ID: {image_id}")
-        return image_id
+        print(f"Reused results of image {source_image_id} for {os.path.basename(image_path)} "
+              f"(ID: {image_id}, {copied} embeddings)")
+        return True, reason
 
     except Exception as e:
-        print(f"Error storing image metadata: {e}")
-        if 'conn' in locals() and conn:
+        print(f"Error copying image results: {e}")
+        if conn:
             conn.rollback()
-        return None
+        return False, "database_error"
     finally:
-        if 'cursor' in locals() and cursor:
+        if cursor:
             cursor.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+        if conn:
+            db.putconn(conn)
 
-def store_ocr_results(image_id: int, text: str, confidence: float) -> bool:
-    """Store OCR results in database."""
+def get_image_description(image_id: int) -> Tuple[str, str]:
+    """Return the stored (ai_description, model_name) of an image."""
+    conn = None
+    cursor = None
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT"),
-            dbname=os.getenv("POSTGRES_DB"),
-            user=os.getenv("POSTGRES_USER"),
-            password=os.getenv("POSTGRES_PASSWORD")
-        )
+        conn = db.getconn()
         cursor = conn.cursor()
-
-        cursor.execute(
-            "INSERT INTO ocr_results (image_id, text, confidence) VALUES (%s, %s, %s)",
-            (image_id, text, float(confidence))
-        )
-        conn.commit()
-        print(f"Stored OCR results for image {image_id}")
-        return True
+        cursor.execute("SELECT ai_description, model_name FROM images WHERE id = %s", (image_id,))
+        row = cursor.fetchone()
+        return (row[0] or "", row[1] or "") if row else ("", "")
 
     except Exception as e:
-        print(f"Error storing OCR results: {e}")
-        return False
+        print(f"Error reading image description: {e}")
+        return "", ""
     finally:
-        if 'cursor' in locals() and cursor:
+        if cursor:
             cursor.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+        if conn:
+            db.putconn(conn)
 
-def store_embeddings(image_id: int, embeddings: list[Tuple[int, list[float]]]) -> bool:
-    """Store embeddings with chunk indices in database."""
-    if not embeddings:
-        return False
+def find_near_duplicate(img) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Perceptual-hash a decoded image and look for an almost identical processed one.
+    Returns: (perceptual_hash, matching image_id or None)
+    """
+    try:
+        perceptual_hash = compute_perceptual_hash(img)
+    except Exception as e:
+        print(f"Perceptual hash error: {e}")
+        return None, None
+    if get_near_duplicate_mode() == "off":
+        return perceptual_hash, None
+    match = get_near_duplicate_index().find(perceptual_hash)
+    if not match:
+        return perceptual_hash, None
+    image_id, distance = match
+    print(f"  Near-duplicate of image {image_id} ({distance} bits apart)")
+    return perceptual_hash, image_id
+
+def describe_image(image_path: str, img, ocr_lines: list[OCRLine],
+                   near_duplicate_of: Optional[int] = None, scheduler=None,
+                   content_hash: str = None, raw_bytes: bytes = None) -> Tuple[str, str, bool]:
+    """
+    Get a description for an image, spending a vision call only when needed:
+    text-rich, confident OCR may skip or defer it (route_vision), and
+    near-duplicates reuse the matched image's description.
+    Returns: (description, model_name, deferred)
+    """
+    decision = route_vision(ocr_lines)
+    if decision != "describe":
+        return "", "", decision == "defer"
+    if near_duplicate_of:
+        description, model_name = get_image_description(near_duplicate_of)
+        if description:
+            return description, model_name, False
+    description, model_name = get_ai_description(image_path, img=img, scheduler=scheduler,
+                                                  content_hash=content_hash, raw_bytes=raw_bytes)
+    return description, model_name, False
 
+def describe_deferred_images(limit: int = None) -> int:
+    """Run the vision model for images whose description was deferred. Returns the number described."""
+    conn = None
+    cursor = None
+    described = 0
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT"),
-            dbname=os.getenv("POSTGRES_DB"),
-            user=os.getenv("POSTGRES_USER"),
-            password=os.getenv("POSTGRES_PASSWORD")
-        )
+        conn = db.getconn()
         cursor = conn.cursor()
+        query = "SELECT id, filepath FROM images WHERE vision_deferred ORDER BY id"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        print(f"{len(rows)} images waiting for a description")
 
-        for chunk_index, embedding in embeddings:
-            embedding_list = [float(x) for x in embedding]
+        client = OllamaClient()
+        for image_id, filepath in rows:
+            if not os.path.exists(filepath):
+                continue
+            description, model_name = get_ai_description(filepath)
+            if not description:
+                continue
             cursor.execute(
-                "INSERT INTO text_embedding (image_id, embedding, chunk_index) VALUES (%s, %s, %s)",
-                (image_id, embedding_list, chunk_index)
+                "UPDATE images SET ai_description = %s, model_name = %s, vision_deferred = FALSE WHERE id = %s",
+                (description, model_name, image_id)
             )
+            replace_description_embedding(cursor, image_id, description, client)
+            conn.commit()
+            described += 1
+        return described
+
+    except Exception as e:
+        print(f"Error describing deferred images: {e}")
+        if conn:
+            conn.rollback()
+        return described
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            db.putconn(conn)
 
+def backfill_content_hashes() -> int:
+    """Hash stored images that predate the content_hash column. Returns the number updated."""
+    conn = None
+    cursor = None
+    updated = 0
+    try:
+        conn = db.getconn()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, filepath FROM images WHERE content_hash IS NULL")
+        rows = cursor.fetchall()
+        if rows:
+            print(f"Hashing {len(rows)} stored images without a content hash...")
+        for image_id, filepath in rows:
+            if not os.path.exists(filepath):
+                continue
+            content_hash = compute_content_hash(read_image_file(filepath))
+            cursor.execute("UPDATE images SET content_hash = %s WHERE id = %s", (content_hash, image_id))
+            updated += 1
         conn.commit()
-        print(f"Stored {len(embeddings)} embeddings for image {image_id}")
-        return True
+        return updated
+
+    except Exception as e:
+        print(f"Error backfilling content hashes: {e}")
+        if conn:
+            conn.rollback()
+        return updated
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            db.putconn(conn)
+
+# One embedded piece of an image: (chunk_index, chunk content hash, vector).
+# The vector is None when the chunk is already in embedding_chunks.
+EmbeddedChunk = Tuple[int, str, Optional[list[float]]]
+
+def chunk_content_hash(text: str, model: str) -> str:
+    """Content address of a chunk in embedding_chunks: SHA-256 of the embedding model and text."""
+    import hashlib
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
 
+def find_stored_chunks(content_hashes: list[str]) -> set[str]:
+    """Which of these chunk hashes already have an embedding stored."""
+    if not content_hashes:
+        return set()
+    conn = None
+    cursor = None
+    try:
+        conn = db.getconn()
+        cursor = conn.cursor()
+        cursor.execute("SELECT content_hash FROM embedding_chunks WHERE content_hash = ANY(%s)",
+                       (list(set(content_hashes)),))
+        return {row[0] for row in cursor.fetchall()}
     except Exception as e:
-        print(f"Error storing embeddings: {e}")
+        print(f"Error looking up stored chunks: {e}")
+        return set()
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            db.putconn(conn)
+
+def to_vector_literal(embedding: Optional[list[float]]) -> Optional[str]:
+    """pgvector text form of an embedding ('[0.1,0.2,...]'), None stays None."""
+    if embedding is None:
+        return None
+    return "[" + ",".join(map(str, embedding)) + "]"
+
+# Links the image in the `image` CTE to its chunks in the same statement. Chunks arrive as three
+# parallel arrays (index, content hash, vector text or NULL when already stored), so an image of
+# any size is one statement with a fixed set of parameters.
+CHUNK_LINK_SQL = """
+    chunk AS (
+        SELECT * FROM unnest(%(chunk_indexes)s::integer[], %(chunk_hashes)s::text[], %(chunk_vectors)s::text[])
+            AS c(chunk_index, content_hash, embedding)
+    ),
+    inserted AS (
+        INSERT INTO embedding_chunks (content_hash, embedding)
+        SELECT DISTINCT ON (content_hash) content_hash, embedding::vector
+        FROM chunk
+        WHERE embedding IS NOT NULL
+        -- Another image may have just stored the same text: take (and lock) its row instead
+        ON CONFLICT (content_hash) DO UPDATE SET content_hash = EXCLUDED.content_hash
+        RETURNING id, content_hash, xmax = 0 AS created
+    ),
+    linked AS (
+        -- A chunk that is neither new nor stored any more leaves chunk_id NULL and fails the insert;
+        -- callers re-embed it (refill_missing_chunks) and retry once
+        INSERT INTO image_chunks (image_id, chunk_index, chunk_id)
+        SELECT image.id, chunk.chunk_index, COALESCE(inserted.id, stored.id)
+        FROM image
+        CROSS JOIN chunk
+        LEFT JOIN inserted ON inserted.content_hash = chunk.content_hash
+        LEFT JOIN embedding_chunks stored ON stored.content_hash = chunk.content_hash
+        RETURNING chunk_id
+    )
+    SELECT (SELECT id FROM image), (SELECT COUNT(*) FROM linked), (SELECT COUNT(*) FROM inserted WHERE created)
+"""
+
+# Image row, OCR row and chunk links of one image in a single statement (one round trip)
+STORE_IMAGE_SQL = """
+    WITH image AS (
+        INSERT INTO images (filename, filepath, timestamp, ai_description, model_name, content_hash,
+                            perceptual_hash, vision_deferred)
+        VALUES (%(filename)s, %(filepath)s, %(timestamp)s, %(description)s, %(model_name)s, %(content_hash)s,
+                %(perceptual_hash)s, %(vision_deferred)s)
+        RETURNING id
+    ),
+    ocr AS (
+        INSERT INTO ocr_results (image_id, text, confidence, lines)
+        SELECT id, %(text)s::text, %(confidence)s::float, %(lines)s::jsonb FROM image
+    ),""" + CHUNK_LINK_SQL
+
+ATTACH_CHUNKS_SQL = """
+    WITH image AS (SELECT %(image_id)s::integer AS id),""" + CHUNK_LINK_SQL
+
+def chunk_params(chunks: list[EmbeddedChunk]) -> dict:
+    """CHUNK_LINK_SQL parameters for an image's embedded chunks."""
+    return {
+        "chunk_indexes": [chunk_index for chunk_index, _, _ in chunks],
+        "chunk_hashes": [content_hash for _, content_hash, _ in chunks],
+        "chunk_vectors": [to_vector_literal(embedding) for _, _, embedding in chunks],
+    }
+
+def attach_chunks(cursor, image_id: int, chunks: list[EmbeddedChunk], replace: bool = False) -> int:
+    """
+    Link an image to its chunks inside the caller's transaction, inserting new
+    chunk embeddings into embedding_chunks. With replace=True existing links at
+    the same chunk indices are dropped first (their ref counts go down).
+    Returns the number of chunks newly stored.
+    """
+    if not chunks:
+        return 0
+    if replace:
+        cursor.execute("DELETE FROM image_chunks WHERE image_id = %s AND chunk_index = ANY(%s)",
+                       (image_id, [chunk_index for chunk_index, _, _ in chunks]))
+    cursor.execute(ATTACH_CHUNKS_SQL, {"image_id": image_id, **chunk_params(chunks)})
+    return cursor.fetchone()[2]
+
+def replace_description_embedding(cursor, image_id: int, description: str, client: "OllamaClient" = None) -> bool:
+    """Point an image's description chunk (-1) at the embedding of a new description."""
+    client = client or OllamaClient()
+    emb = client.generate_embedding(description)
+    if not emb:
         return False
+    attach_chunks(cursor, image_id, [(-1, chunk_content_hash(description, client.embedding_model_name), emb)],
+                  replace=True)
+    return True
+
+def store_image_results(image_path: str, text: str, description: str, model_name: str,
+                        embeddings: list[EmbeddedChunk], content_hash: str = None, perceptual_hash: str = None,
+                        ocr_lines: list[OCRLine] = None, vision_deferred: bool = False) -> Optional[int]:
+    """
+    Write an image row, its OCR row and all of its chunk links in one statement
+    and one transaction, so a failure leaves nothing half-written. Returns the
+    new image ID, or None on failure.
+    """
+    if text.strip():
+        ocr_row = (text, get_ocr_confidence(ocr_lines or []), lines_to_json(ocr_lines or []))
+    else:
+        # Empty OCR record keeps one ocr_results row per image
+        ocr_row = ("[No text extracted]", 0.0, None)
+    params = {
+        "filename": os.path.basename(image_path),
+        "filepath": image_path,
+        "timestamp": datetime.fromtimestamp(os.path.getmtime(image_path)),
+        "description": description,
+        "model_name": model_name,
+        "content_hash": content_hash,
+        "perceptual_hash": perceptual_hash,
+        "vision_deferred": vision_deferred,
+        "text": ocr_row[0],
+        "confidence": float(ocr_row[1]),
+        "lines": ocr_row[2],
+        **chunk_params(embeddings),
+    }
+    conn = None
+    cursor = None
+    try:
+        conn = db.getconn()
+        cursor = conn.cursor()
+        cursor.execute(STORE_IMAGE_SQL, params)
+        image_id, linked, new_chunks = cursor.fetchone()
+        conn.commit()
+        print(f"Stored image {image_id} with {linked} embeddings ({new_chunks} new chunks)")
+        return image_id
+
+    except Exception as e:
+        print(f"Error storing image results: {e}")
+        if conn:
+            conn.rollback()
+        return None
     finally:
-        if 'cursor' in locals() and cursor:
+        if cursor:
             cursor.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+        if conn:
+            db.putconn(conn)
+
+def get_image_chunks(text: str, description: str, client: "OllamaClient" = None) -> list[Tuple[int, str, str]]:
+    """(chunk_index, content hash, text) for the description (chunk -1) and OCR text chunks (0, 1, 2...)."""
+    client = client or OllamaClient()
+    pieces = []
+    if description:
+        pieces.append((-1, description))
+    if text.strip():
+        pieces.extend(enumerate(client.chunk_text(text)))
+    return [(index, chunk_content_hash(piece, client.embedding_model_name), piece) for index, piece in pieces]
+
+def get_pending_chunks(chunks: list[Tuple[int, str, str]], stored: set[str]) -> dict[str, str]:
+    """Content hash -> text for each distinct chunk that still needs an embedding."""
+    pending = {}
+    for _, content_hash, piece in chunks:
+        if content_hash not in stored:
+            pending.setdefault(content_hash, piece)
+    return pending
+
+def assemble_embedded_chunks(chunks: list[Tuple[int, str, str]], stored: set[str],
+                             embedded: dict[str, list[float]]) -> list[EmbeddedChunk]:
+    """EmbeddedChunk list for an image; chunks whose embedding failed are left out."""
+    if stored:
+        print(f"  Embeddings: {len(embedded)} new chunks, "
+              f"{sum(1 for _, content_hash, _ in chunks if content_hash in stored)} already stored")
+    result = []
+    for index, content_hash, _ in chunks:
+        if content_hash in stored:
+            result.append((index, content_hash, None))
+        elif content_hash in embedded:
+            result.append((index, content_hash, embedded[content_hash]))
+    return result
+
+def fill_missing_chunks(embeddings: list[EmbeddedChunk], missing: set[str],
+                        embedded: dict[str, list[float]]) -> Optional[list[EmbeddedChunk]]:
+    """Give the missing reused chunks their new vectors; None if any of them failed to embed."""
+    if not all(embedded.get(content_hash) for content_hash in missing):
+        return None
+    return [(index, content_hash, embedded[content_hash] if content_hash in missing else vector)
+            for index, content_hash, vector in embeddings]
+
+def refill_missing_chunks(embeddings: list[EmbeddedChunk], text: str, description: str,
+                          client: "OllamaClient" = None) -> Optional[list[EmbeddedChunk]]:
+    """
+    After a failed store: re-embed the reused chunks (vector None) that were
+    deleted since they were looked up, because the last image using them went
+    away. Returns the embeddings to retry with, or None if no chunk went
+    missing (the store failed for another reason) or one could not be embedded.
+    """
+    reused = [content_hash for _, content_hash, vector in embeddings if vector is None]
+    missing = set(reused) - find_stored_chunks(reused)
+    if not missing:
+        return None
+    client = client or OllamaClient()
+    chunks = get_image_chunks(text, description, client)
+    pending = {content_hash: piece for content_hash, piece in get_pending_chunks(chunks, set()).items()
+               if content_hash in missing}
+    vectors = client.generate_embeddings(list(pending.values()))
+    return fill_missing_chunks(embeddings, missing, dict(zip(pending, vectors)))
+
+def generate_image_embeddings(text: str, description: str, client: "OllamaClient" = None,
+                              batcher=None, skip_stored: bool = True) -> list[EmbeddedChunk]:
+    """
+    Embed the description (chunk -1) and the chunked OCR text (chunks 0, 1, 2...)
+    in one batched request. With an embedding_batcher.EmbeddingBatcher the texts
+    share requests with other images being embedded at the same time.
+    Chunks already in embedding_chunks (menus, toolbars, boilerplate seen in
+    earlier screenshots) are not sent to the model; they come back with vector None.
+    """
+    client = client or OllamaClient()
+    chunks = get_image_chunks(text, description, client)
+    stored = find_stored_chunks([content_hash for _, content_hash, _ in chunks]) if skip_stored else set()
+    # Each new distinct text is embedded once, even if it repeats within the image
+    pending = get_pending_chunks(chunks, stored)
+    texts = list(pending.values())
+    vectors = batcher.embed(texts) if batcher is not None else client.generate_embeddings(texts)
+    embedded = {content_hash: vector for content_hash, vector in zip(pending, vectors) if vector}
+    return assemble_embedded_chunks(chunks, stored, embedded)
+
+def store_processed_image(image_path: str, text: str, description: str, model_name: str,
+                          embeddings: list[EmbeddedChunk], content_hash: str = None,
+                          perceptual_hash: str = None, ocr_lines: list[OCRLine] = None,
+                          vision_deferred: bool = False) -> tuple[bool, str]:
+    """
+    Store image metadata, OCR text and embeddings for an already analysed image.
+    Returns: (success: bool, reason: str)
+    """
+    image_id = store_image_results(image_path, text, description, model_name, embeddings,
+                                   content_hash=content_hash, perceptual_hash=perceptual_hash,
+                                   ocr_lines=ocr_lines, vision_deferred=vision_deferred)
+    if not image_id and embeddings:
+        # A reused chunk may have been deleted since it was looked up: embed it again and retry once
+        refilled = refill_missing_chunks(embeddings, text, description)
+        if refilled:
+            print("Re-embedded chunks deleted while storing; retrying")
+            image_id = store_image_results(image_path, text, description, model_name, refilled,
+                                           content_hash=content_hash, perceptual_hash=perceptual_hash,
+                                           ocr_lines=ocr_lines, vision_deferred=vision_deferred)
+    if not image_id:
+        return False, "database_error"
+    if not embeddings:
+        print("Warning: No embeddings generated for image")
+        return False, "no_embeddings"
+    return True, "success"
 
 def process_image_to_db(image_path: str) -> tuple[bool, str]:
     """
     Process image and store in database.
     Returns: (success: bool, reason: str)
+
+    Runs every step serially for a single file; see pipeline.IngestPipeline
+    for the staged, concurrent version used for batches and the watcher.
     """
     image_id = check_for_duplicate_image(image_path)
     if image_id:
         print(f"Skipping duplicate image: {image_path}")
         return True, "duplicate"
     
+    # Byte-identical file already processed elsewhere (renamed, moved or copied)?
+    data = read_image_file(image_path)
+    content_hash = compute_content_hash(data)
+    source_id = find_image_by_hash(content_hash)
+    if source_id:
+        return copy_image_results(source_id, image_path, content_hash)
+    
+    # Decode once; OCR and vision both work from the same array
+    img = decode_image(data)
+    if img is None:
+        print(f"Could not decode image: {image_path}")
+        return False, "unreadable_image"
+    
+    # Burst of almost identical captures? Reuse what was already computed
+    perceptual_hash, near_id = find_near_duplicate(img)
+    if near_id and get_near_duplicate_mode() == "reuse":
+        return copy_image_results(near_id, image_path, content_hash, perceptual_hash, reason="near_duplicate")
+    
     # 1. OCR Step (PaddleOCR)
-    text = get_paddle_ocr_text(image_path)
+    ocr_lines = get_paddle_ocr_lines(image_path, img=img)
+    text = " ".join(line_text for _, line_text, _ in ocr_lines)
     
-    # 2. Vision Description Step (Qwen3-VL)
-    description, model_name = get_ai_description(image_path)
+    # 2. Vision Description Step (Qwen3-VL), unless routed away or reused from a near-duplicate
+    description, model_name, deferred = describe_image(image_path, img, ocr_lines, near_id,
+                                                       content_hash=content_hash, raw_bytes=data)
     
     if not text.strip() and not description.strip():
         print("Both OCR and description failed for the image")
         return False, "ocr_and_vision_failed"
 
-    confidence = get_ocr_confidence(image_path)
-    timestamp = datetime.fromtimestamp(os.path.getmtime(image_path))
+    # 3. Embeddings + storage
+    embeddings = generate_image_embeddings(text, description)
+    return store_processed_image(image_path, text, description, model_name, embeddings,
+                                 content_hash=content_hash, perceptual_hash=perceptual_hash,
+                                 ocr_lines=ocr_lines, vision_deferred=deferred)
 
-    # 2. Store Image Meta (including description)
-    image_id = store_image_data(os.path.basename(image_path), image_path, timestamp, description, model_name)
-    if not image_id:
-        return False, "database_error"
+def get_query_embedding(query: str, client: OllamaClient = None) -> Optional[list[float]]:
+    """Embedding of a search query, served from the query cache when it was embedded before."""
+    client = client or OllamaClient(embed_backend=os.getenv("QUERY_EMBED_BACKEND"))
+    cache = get_query_cache()
+    if cache is None:
+        return client.generate_embedding(query)
+    return cache.get_or_compute(client.embedding_model_name, query, client.generate_embedding)
 
-    # 4. Store OCR
-    if text.strip():
-        if not store_ocr_results(image_id, text, confidence):
-            print(f"Failed to store OCR for {image_id}")
-            # Even if OCR fails, we might still want to proceed with description/embeddings
-            # For now, we'll just log and continue.
-    else:
-        # Create an empty OCR record to satisfy foreign keys
-        store_ocr_results(image_id, "[No text extracted]", 0.0)
+VECTOR_INDEX_MODES = ("full", "halfvec", "binary")
+_search_settings = None
+_search_settings_read_at = 0.0
+# Seconds a search reuses the settings it read, so a running app picks up vector_index.py rebuilds
+SEARCH_SETTINGS_TTL = 10.0
 
-    # 5. Embeddings
-    client = OllamaClient()
-    all_embeddings = []
-    
-    # Embed description as chunk_index -1 (initial/special chunk)
-    if description:
-        desc_emb = client.generate_embedding(description)
-        if desc_emb:
-            all_embeddings.append((-1, desc_emb))
-            
-    # Embed OCR text in chunks (0, 1, 2...)
-    if text.strip():
-        ocr_embeddings = client.generate_embeddings_with_chunks(text)
-        all_embeddings.extend(ocr_embeddings)
-        
-    if all_embeddings:
-        if not store_embeddings(image_id, all_embeddings):
-            return False, "embedding_error"
-        return True, "success"
-    else:
-        print("Warning: No embeddings generated for image")
-        return False, "no_embeddings"
+def get_search_settings(cursor) -> dict[str, str]:
+    """search_settings rows recorded by schema.sql and vector_index.py, re-read every few seconds."""
+    global _search_settings, _search_settings_read_at
+    if _search_settings is None or time.monotonic() - _search_settings_read_at > SEARCH_SETTINGS_TTL:
+        cursor.execute("SELECT to_regclass('search_settings') IS NOT NULL")
+        settings = {}
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT key, value FROM search_settings")
+            settings = dict(cursor.fetchall())
+        _search_settings = settings
+        _search_settings_read_at = time.monotonic()
+    return _search_settings
+
+def get_vector_index_mode(cursor) -> str:
+    """Vector index mode: VECTOR_INDEX_MODE from .env, else the mode schema.sql recorded."""
+    mode = os.getenv("VECTOR_INDEX_MODE", "").strip().lower()
+    if mode in VECTOR_INDEX_MODES:
+        return mode
+    mode = get_search_settings(cursor).get("vector_index_mode")
+    return mode if mode in VECTOR_INDEX_MODES else "full"
+
+# Distance used to pick re-rank candidates; must match the index expression in schema.sql
+VECTOR_CANDIDATE_ORDER = {
+    "halfvec": "embedding::halfvec(1024) <=> %(embedding)s::vector::halfvec(1024)",
+    "binary": "binary_quantize(embedding)::bit(1024) <~> binary_quantize(%(embedding)s::vector)",
+}
+
+def build_semantic_query(mode: str) -> str:
+    """Semantic search SQL for a vector index mode.
+
+    The %(candidates)s nearest chunks come straight from the index (the
+    VECTOR index in full mode, the smaller quantized one in halfvec and
+    binary modes), each with its exact cosine distance. They are collapsed
+    to the best chunk per image, and the threshold and limit apply to
+    images, so a few images with many matching chunks cannot fill the page.
+    """
+    order = VECTOR_CANDIDATE_ORDER.get(mode, "embedding <=> %(embedding)s::vector")
+    return f"""
+                WITH candidates AS MATERIALIZED (
+                    SELECT id, embedding <=> %(embedding)s::vector AS distance
+                    FROM embedding_chunks
+                    ORDER BY {order}
+                    LIMIT %(candidates)s
+                ),
+                best AS (
+                    SELECT DISTINCT ON (ic.image_id) ic.image_id, c.distance
+                    FROM candidates c
+                    JOIN image_chunks ic ON ic.chunk_id = c.id
+                    ORDER BY ic.image_id, c.distance
+                )
+                SELECT 
+                    i.id, i.filename, i.filepath, i.timestamp, 
+                    COALESCE(o.text, '') as text, COALESCE(o.confidence, 0) as confidence,
+                    1 - best.distance as similarity,
+                    i.ai_description
+                FROM best
+                JOIN images i ON i.id = best.image_id
+                LEFT JOIN ocr_results o ON i.id = o.image_id
+                WHERE best.distance <= 1 - %(threshold)s
+                ORDER BY best.distance
+                LIMIT %(limit)s
+                """
+
+def get_vector_search_candidates(limit: int) -> int:
+    """Chunks fetched from the vector index per search (several per image, so well above limit)."""
+    return max(limit * 4, int(os.getenv("VECTOR_RERANK_CANDIDATES", "200")))
+
+def set_vector_search_params(cursor, candidates: int):
+    """
+    Index search breadth for the current transaction: ivfflat lists probed
+    (VECTOR_IVFFLAT_PROBES, else what vector_index.py recorded for the current
+    lists), and the HNSW candidate list, which also caps the rows an HNSW scan returns.
+    """
+    probes = os.getenv("VECTOR_IVFFLAT_PROBES") or get_search_settings(cursor).get("ivfflat_probes", "10")
+    cursor.execute("SET LOCAL ivfflat.probes = %s", (int(probes),))
+    cursor.execute("SET LOCAL hnsw.ef_search = %s",
+                   (min(1000, max(candidates, int(os.getenv("VECTOR_HNSW_EF_SEARCH", "100")))),))
+
+# Keyword search on the trigram indexes. `query <% text` matches when the query's trigrams are
+# close to some run of words in the text (pg_trgm.word_similarity_threshold), so it also finds
+# Korean words with particles attached ("회의" in "회의를") and OCR misreads of a letter or two.
+# It misses single characters ("회") and text inside a longer token ("config" in "appconfig");
+# those fall back to a substring match (ILIKE), ranked the same way.
+KEYWORD_QUERY = """
+            WITH hits AS (
+                SELECT image_id, word_similarity(%(query)s, text) AS score
+                FROM ocr_results
+                WHERE {ocr_match}
+                UNION ALL
+                SELECT id, word_similarity(%(query)s, ai_description)
+                FROM images
+                WHERE {description_match}
+            ),
+            best AS (
+                SELECT image_id, MAX(score) AS score
+                FROM hits
+                GROUP BY image_id
+                ORDER BY score DESC
+                LIMIT %(limit)s
+            )
+            SELECT 
+                i.id, i.filename, i.filepath, i.timestamp, 
+                o.text, o.confidence, best.score,
+                i.ai_description
+            FROM best
+            JOIN images i ON i.id = best.image_id
+            JOIN ocr_results o ON i.id = o.image_id
+            ORDER BY best.score DESC
+            """
+KEYWORD_TRIGRAM_QUERY = KEYWORD_QUERY.format(ocr_match="%(query)s <%% text",
+                                             description_match="%(query)s <%% ai_description")
+KEYWORD_SUBSTRING_QUERY = KEYWORD_QUERY.format(ocr_match="text ILIKE %(pattern)s",
+                                               description_match="ai_description ILIKE %(pattern)s")
+# pg_trgm pads words, so a two-syllable Korean word ("회의") already has enough trigrams
+KEYWORD_TRIGRAM_MIN_CHARS = 2
+# Substring patterns this long give trigrams, so the GIN indexes serve the ILIKE fallback too
+KEYWORD_INDEXED_SUBSTRING_CHARS = 3
+
+def keyword_substring_search(cursor, query: str, limit: int) -> list[tuple]:
+    """ILIKE '%query%' hits, given up after KEYWORD_SCAN_TIMEOUT_MS (a 1-character query scans every row)."""
+    import psycopg2
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    cursor.execute("SAVEPOINT keyword_substring")
+    cursor.execute("SET LOCAL statement_timeout = %s", (int(os.getenv("KEYWORD_SCAN_TIMEOUT_MS", "200")),))
+    try:
+        cursor.execute(KEYWORD_SUBSTRING_QUERY, {"query": query, "pattern": pattern, "limit": limit})
+        rows = cursor.fetchall()
+    except psycopg2.errors.QueryCanceled:
+        # Also undoes the SET LOCAL
+        cursor.execute("ROLLBACK TO SAVEPOINT keyword_substring")
+        print(f"Keyword search for '{query}' took too long as a substring match, skipped")
+        return []
+    cursor.execute("SET LOCAL statement_timeout = DEFAULT")
+    cursor.execute("RELEASE SAVEPOINT keyword_substring")
+    return rows
+
+def keyword_search(cursor, query: str, limit: int) -> list[tuple]:
+    """
+    Keyword hits, best first: trigram word similarity for queries of 2+
+    characters, falling back to an index-served substring match for 3+.
+    Single characters only get a time-limited substring scan.
+    """
+    length = len(query.strip())
+    if length < KEYWORD_TRIGRAM_MIN_CHARS:
+        return keyword_substring_search(cursor, query, limit)
+    cursor.execute("SET LOCAL pg_trgm.word_similarity_threshold = %s",
+                   (float(os.getenv("KEYWORD_MATCH_THRESHOLD", "0.6")),))
+    cursor.execute(KEYWORD_TRIGRAM_QUERY, {"query": query, "limit": limit})
+    rows = cursor.fetchall()
+    if not rows and length >= KEYWORD_INDEXED_SUBSTRING_CHARS:
+        rows = keyword_substring_search(cursor, query, limit)
+    return rows
 
 def search_images(query: str, mode: str = 'hybrid', limit: int = 12) -> list[dict]:
     """Search for images using semantic or keyword search."""
+    import time
     query = unicodedata.normalize('NFC', query)
+    start_time = time.time()
     
-    db_host = os.getenv("POSTGRES_HOST")
-    db_port = os.getenv("POSTGRES_PORT")
-    db_name = os.getenv("POSTGRES_DB")
-    db_user = os.getenv("POSTGRES_USER")
-    db_password = os.getenv("POSTGRES_PASSWORD")
-
     conn = None
     cursor = None
     try:
-        conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            dbname=db_name,
-            user=db_user,
-            password=db_password
-        )
+        conn = db.getconn()
         cursor = conn.cursor()
 
         results = []
         similarity_threshold = 0.35  # Only show results with at least this similarity
         
         if mode in ['semantic', 'hybrid']:
-            client = OllamaClient()
-            query_embedding = client.generate_embedding(query)
+            query_embedding = get_query_embedding(query)
             
             if query_embedding:
-                semantic_query = """
-                SELECT 
-                    i.id, i.filename, i.filepath, i.timestamp, 
-                    COALESCE(o.text, '') as text, COALESCE(o.confidence, 0) as confidence,
-                    1 - (te.embedding <=> %s::vector) as similarity,
-                    i.ai_description
-                FROM images i
-                LEFT JOIN ocr_results o ON i.id = o.image_id
-                JOIN text_embedding te ON i.id = te.image_id
-                WHERE 1 - (te.embedding <=> %s::vector) >= %s
-                ORDER BY te.embedding <=> %s::vector
-                LIMIT %s
-                """
-                cursor.execute(semantic_query, (query_embedding, query_embedding, similarity_threshold, query_embedding, limit))
+                semantic_query = build_semantic_query(get_vector_index_mode(cursor))
+                candidates = get_vector_search_candidates(limit)
+                set_vector_search_params(cursor, candidates)
+                cursor.execute(semantic_query, {
+                    "embedding": query_embedding,
+                    "threshold": similarity_threshold,
+                    "limit": limit,
+                    "candidates": candidates,
+                })
                 for row in cursor.fetchall():
                     results.append({
                         "id": row[0],
@@ -491,21 +1158,14 @@ def search_images(query: str, mode: str = 'hybrid', limit: int = 12) -> list[dic
                     })
 
         if mode in ['keyword', 'hybrid']:
-            keyword_query = """
-            SELECT 
-                i.id, i.filename, i.filepath, i.timestamp, 
-                o.text, o.confidence,
-                i.ai_description
-            FROM images i
-            JOIN ocr_results o ON i.id = o.image_id
-            WHERE o.text ILIKE %s OR i.ai_description ILIKE %s
-            LIMIT %s
-            """
-            cursor.execute(keyword_query, (f"%{query}%", f"%{query}%", limit))
-            keyword_results = cursor.fetchall()
+            keyword_results = keyword_search(cursor, query, limit)
             
+            seen = {r['id']: r for r in results}
             for row in keyword_results:
-                if not any(r['id'] == row[0] for r in results):
+                if row[0] in seen:
+                    # Found by both: keep the better of the two scores
+                    seen[row[0]]['score'] = max(seen[row[0]]['score'], row[6])
+                else:
                     results.append({
                         "id": row[0],
                         "filename": row[1],
@@ -513,21 +1173,18 @@ def search_images(query: str, mode: str = 'hybrid', limit: int = 12) -> list[dic
                         "timestamp": row[3],
                         "text": row[4],
                         "confidence": row[5],
-                        "score": 1.0,
-                        "ai_description": row[6],
+                        "score": row[6],
+                        "ai_description": row[7],
                         "type": "keyword"
                     })
 
         if mode != 'keyword':
-            # Deduplicate by image ID (highest score wins)
-            unique_results = {}
-            for res in results:
-                if res['id'] not in unique_results or res['score'] > unique_results[res['id']]['score']:
-                    unique_results[res['id']] = res
-            
-            results = list(unique_results.values())
+            # Semantic rows are already one per image and keyword rows merge into them
             results.sort(key=lambda x: x['score'], reverse=True)
 
+        cache = get_query_cache()
+        print(f"Search '{query}' ({mode}): {len(results[:limit])} results in {time.time() - start_time:.2f}s"
+              + (f" | {cache.stats()}" if cache is not None and mode != 'keyword' else ""))
         return results[:limit]
 
     except Exception as e:
@@ -537,4 +1194,4 @@ def search_images(query: str, mode: str = 'hybrid', limit: int = 12) -> list[dic
         if cursor:
             cursor.close()
         if conn:
-            conn.close()
+            db.putconn(conn)
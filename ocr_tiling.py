@@ -0,0 +1,187 @@
+"""
+Tiled, adaptively scaled OCR for very large captures.
+
+PaddleOCR shrinks its detection input to 960px on the long side, so on an
+ultra-wide or multi-monitor capture (7680x2160 and up) small text vanishes
+and the full-resolution buffers use a lot of memory. For such images we:
+
+1. measure the typical text height on a few full-resolution sample patches
+   and downscale the whole image so text lands near OCR_TARGET_TEXT_HEIGHT;
+2. split what is left into overlapping tiles and OCR them (in parallel
+   when an OCR worker pool is available);
+3. map the lines back to image coordinates and de-duplicate lines that were
+   read twice (or cut in half) at tile seams.
+"""
+import os
+from typing import Callable, Optional
+
+# ((x0, y0, x1, y1), text, score) - same shape as ocr_processor.OCRLine
+Line = tuple
+
+# Detection patch size; PaddleOCR does not shrink inputs this small
+SAMPLE_SIZE = 960
+# A line closer than this to an inner tile edge is treated as cut by the seam
+EDGE_MARGIN = 4
+
+
+def get_tiling_config() -> dict:
+    """Tiling settings from .env."""
+    return {
+        "enabled": os.getenv("OCR_TILING", "1") != "0",
+        "threshold": int(os.getenv("OCR_TILE_THRESHOLD", "2560")),
+        # Larger tiles would be shrunk again by PaddleOCR's detector, undoing the text-height scaling
+        "tile_size": min(SAMPLE_SIZE, int(os.getenv("OCR_TILE_SIZE", str(SAMPLE_SIZE)))),
+        "overlap": int(os.getenv("OCR_TILE_OVERLAP", "160")),
+        "target_text_height": float(os.getenv("OCR_TARGET_TEXT_HEIGHT", "20")),
+        "min_scale": float(os.getenv("OCR_MIN_SCALE", "0.35")),
+    }
+
+
+def needs_tiling(img) -> bool:
+    """True when the image's long side exceeds OCR_TILE_THRESHOLD."""
+    config = get_tiling_config()
+    return config["enabled"] and max(img.shape[:2]) > config["threshold"]
+
+
+def plan_tiles(width: int, height: int, tile_size: int, overlap: int) -> list[tuple]:
+    """Overlapping (x0, y0, x1, y1) tiles covering a width x height image."""
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        step = tile_size - overlap
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def estimate_text_height(img, detect_many: Callable[[list], list[list[tuple]]]) -> Optional[float]:
+    """Median text line height (px) measured on full-resolution sample patches."""
+    import numpy as np
+    height, width = img.shape[:2]
+    size = min(SAMPLE_SIZE, width, height)
+    # Three patches across the middle band: left, centre and right
+    ys = (height - size) // 2
+    xs = sorted({0, (width - size) // 2, width - size})
+    patches = [img[ys:ys + size, x:x + size] for x in xs]
+    heights = [box[3] - box[1] for boxes in detect_many(patches) for box in boxes]
+    if len(heights) < 3:
+        return None
+    return float(np.median(heights))
+
+
+def choose_scale(text_height: Optional[float], target_height: float, min_scale: float) -> float:
+    """Downscale factor that brings text_height near the target; never upscales."""
+    if not text_height:
+        return 1.0
+    return max(min_scale, min(1.0, target_height / text_height))
+
+
+def _same_row(a, b) -> bool:
+    overlap = min(a[3], b[3]) - max(a[1], b[1])
+    return overlap > 0.5 * min(a[3] - a[1], b[3] - b[1])
+
+
+def _overlaps_x(a, b) -> bool:
+    return a[0] < b[2] and b[0] < a[2]
+
+
+def _join_overlapping_text(left: str, right: str, min_overlap: int = 3) -> Optional[str]:
+    """Join two fragments of one line if the end of left repeats at the start of right."""
+    for size in range(min(len(left), len(right)), min_overlap - 1, -1):
+        if left[-size:] == right[:size]:
+            return left + right[size:]
+    return None
+
+
+def merge_tile_lines(tile_lines: list[list[Line]], tiles: list[tuple], width: int, height: int) -> list[Line]:
+    """Map per-tile lines to image coordinates and drop or join seam duplicates."""
+    complete = []
+    cut = []
+    for (tx0, ty0, tx1, ty1), lines in zip(tiles, tile_lines):
+        for (bx0, by0, bx1, by1), text, score in lines:
+            box = (bx0 + tx0, by0 + ty0, bx1 + tx0, by1 + ty0)
+            # Only edges shared with another tile can cut a line
+            touches_seam = ((tx0 > 0 and bx0 <= EDGE_MARGIN) or
+                            (ty0 > 0 and by0 <= EDGE_MARGIN) or
+                            (tx1 < width and bx1 >= tx1 - tx0 - EDGE_MARGIN) or
+                            (ty1 < height and by1 >= ty1 - ty0 - EDGE_MARGIN))
+            (cut if touches_seam else complete).append((box, text, score))
+
+    merged: list[Line] = []
+    for line in complete:
+        box, text, _ = line
+        # The same line read whole in two overlapping tiles
+        if any(_same_row(box, b) and _overlaps_x(box, b) and (text in t or t in text) for b, t, _ in merged):
+            continue
+        merged.append(line)
+
+    for box, text, score in sorted(cut, key=lambda line: line[0][0]):
+        duplicate = False
+        for i, (b, t, s) in enumerate(merged):
+            if not (_same_row(box, b) and _overlaps_x(box, b)):
+                continue
+            duplicate = True
+            if text in t:
+                break
+            # A long line cut by the seam in both tiles: stitch the fragments
+            left, right = ((t, text) if b[0] <= box[0] else (text, t))
+            joined = _join_overlapping_text(left, right)
+            if joined:
+                union = (min(b[0], box[0]), min(b[1], box[1]), max(b[2], box[2]), max(b[3], box[3]))
+                merged[i] = (union, joined, min(s, score))
+            elif len(text) > len(t):
+                merged[i] = (box, text, score)
+            break
+        if not duplicate:
+            merged.append((box, text, score))
+
+    return sorted(merged, key=lambda line: (line[0][1], line[0][0]))
+
+
+def tiled_ocr(img, recognise: Callable[[object], list[Line]], ocr_pool=None) -> list[Line]:
+    """
+    OCR a large image tile by tile. recognise(region) OCRs one tile in-process;
+    with an ocr_pool the tiles (and the text-size probes) run in parallel workers.
+    """
+    import time
+    import cv2
+    config = get_tiling_config()
+    start_time = time.time()
+
+    if ocr_pool is not None:
+        def detect_many(regions):
+            return [f.result() for f in [ocr_pool.submit_detection(r) for r in regions]]
+
+        def recognise_many(regions):
+            return [f.result() for f in [ocr_pool.submit(r) for r in regions]]
+    else:
+        import ocr_processor
+
+        def detect_many(regions):
+            engine = ocr_processor.get_ocr_engine()
+            return [ocr_processor.run_paddle_detection(engine, r) for r in regions]
+
+        def recognise_many(regions):
+            return [recognise(r) for r in regions]
+
+    height, width = img.shape[:2]
+    scale = choose_scale(estimate_text_height(img, detect_many),
+                         config["target_text_height"], config["min_scale"])
+    work = img
+    if scale < 1.0:
+        work = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    work_height, work_width = work.shape[:2]
+    tiles = plan_tiles(work_width, work_height, config["tile_size"], config["overlap"])
+    tile_lines = recognise_many([work[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles])
+    lines = merge_tile_lines(tile_lines, tiles, work_width, work_height)
+
+    if scale < 1.0:
+        lines = [(tuple(int(round(v / scale)) for v in box), text, score) for box, text, score in lines]
+
+    print(f"    Tiled OCR: {width}x{height} at scale {scale:.2f}, {len(tiles)} tiles, "
+          f"{len(lines)} lines in {time.time() - start_time:.2f}s")
+    return lines
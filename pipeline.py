@@ -0,0 +1,361 @@
+"""
+Staged ingest pipeline - decode, OCR, vision, embed and DB write stages
+connected by bounded queues, each stage with its own worker count.
+
+While the vision model describes one screenshot, PaddleOCR is already
+reading the next one, so a batch takes roughly as long as its slowest stage.
+"""
+import os
+import queue
+import threading
+import time
+from functools import partial
+from typing import Callable, Iterable, Optional
+
+import db
+import ocr_processor
+from bulk_loader import BulkLoader
+from embedding_batcher import EmbeddingBatcher
+from incremental_ocr import IncrementalOCR
+from near_duplicate import get_near_duplicate_mode
+from ocr_pool import OCRWorkerPool, get_pool_size
+from vision_payload import is_passthrough_candidate
+from vision_scheduler import VisionScheduler
+
+# Order matters: each stage feeds the next one.
+STAGES = ("decode", "ocr", "vision", "embed", "db")
+
+DEFAULT_CONCURRENCY = {
+    "decode": 2,
+    "ocr": 1,      # The in-process PaddleOCR engine is not thread-safe
+    "vision": 1,
+    "embed": 4,    # Workers wait on the shared EmbeddingBatcher, which groups their texts
+    "db": 2,
+}
+
+_STOP = object()
+
+
+def get_stage_concurrency() -> dict[str, int]:
+    """Read per-stage worker counts from PIPELINE_<STAGE>_WORKERS env variables."""
+    concurrency = {}
+    for stage in STAGES:
+        value = os.getenv(f"PIPELINE_{stage.upper()}_WORKERS")
+        concurrency[stage] = max(1, int(value)) if value else DEFAULT_CONCURRENCY[stage]
+    return concurrency
+
+
+class IngestJob:
+    """State for one screenshot as it moves through the pipeline."""
+
+    def __init__(self, image_path: str):
+        self.image_path = image_path
+        self.text = ""
+        self.ocr_lines = []
+        self.vision_deferred = False
+        self.description = ""
+        self.model_name = ""
+        self.embeddings = []
+        self.content_hash = None
+        self.perceptual_hash = None
+        # Processed image this one is a near-duplicate of (its description is reused)
+        self.near_duplicate_of: Optional[int] = None
+        # Decoded BGR array shared by the OCR and vision stages
+        self.image = None
+        # Original file bytes, kept only when small enough to send to the model as-is
+        self.raw_bytes = None
+        self.started_at = time.time()
+        # Set once the job is finished; later stages pass it straight through.
+        self.success: Optional[bool] = None
+        self.reason = ""
+        # Handed to a BulkLoader, which reports the job once its rows are written
+        self.deferred = False
+
+    @property
+    def done(self) -> bool:
+        return self.success is not None
+
+    def finish(self, success: bool, reason: str):
+        self.success = success
+        self.reason = reason
+
+
+def decode_stage(job: IngestJob):
+    """
+    Skip files already in the database, reuse results of byte-identical files,
+    then decode the image once for later stages.
+    """
+    if ocr_processor.check_for_duplicate_image(job.image_path):
+        print(f"Skipping duplicate image: {job.image_path}")
+        job.finish(True, "duplicate")
+        return
+    if not os.path.exists(job.image_path):
+        job.finish(False, "file_not_found")
+        return
+    data = ocr_processor.read_image_file(job.image_path)
+    job.content_hash = ocr_processor.compute_content_hash(data)
+    source_id = ocr_processor.find_image_by_hash(job.content_hash)
+    if source_id:
+        job.finish(*ocr_processor.copy_image_results(source_id, job.image_path, job.content_hash))
+        return
+    job.image = ocr_processor.decode_image(data)
+    if is_passthrough_candidate(data):
+        job.raw_bytes = data
+    if job.image is None:
+        print(f"Could not decode image: {job.image_path}")
+        job.finish(False, "unreadable_image")
+        return
+    job.perceptual_hash, job.near_duplicate_of = ocr_processor.find_near_duplicate(job.image)
+    if job.near_duplicate_of and get_near_duplicate_mode() == "reuse":
+        job.image = None
+        job.finish(*ocr_processor.copy_image_results(
+            job.near_duplicate_of, job.image_path, job.content_hash, job.perceptual_hash,
+            reason="near_duplicate",
+        ))
+
+
+def ocr_stage(job: IngestJob, ocr_pool: OCRWorkerPool = None, incremental: IncrementalOCR = None):
+    job.ocr_lines = ocr_processor.get_paddle_ocr_lines(job.image_path, ocr_pool=ocr_pool, img=job.image,
+                                                       incremental=incremental)
+    job.text = " ".join(text for _, text, _ in job.ocr_lines)
+
+
+def vision_stage(job: IngestJob, scheduler: VisionScheduler = None):
+    job.description, job.model_name, job.vision_deferred = ocr_processor.describe_image(
+        job.image_path, job.image, job.ocr_lines, job.near_duplicate_of, scheduler=scheduler,
+        content_hash=job.content_hash, raw_bytes=job.raw_bytes,
+    )
+    # Last stage that needs pixels; free the buffers while the job waits on embed/db
+    job.image = None
+    job.raw_bytes = None
+    if not job.text.strip() and not job.description.strip():
+        print("Both OCR and description failed for the image")
+        job.finish(False, "ocr_and_vision_failed")
+
+
+def embed_stage(job: IngestJob, batcher: EmbeddingBatcher = None):
+    job.embeddings = ocr_processor.generate_image_embeddings(job.text, job.description, batcher=batcher)
+
+
+def db_stage(job: IngestJob):
+    success, reason = ocr_processor.store_processed_image(
+        job.image_path, job.text, job.description, job.model_name, job.embeddings,
+        content_hash=job.content_hash, perceptual_hash=job.perceptual_hash,
+        ocr_lines=job.ocr_lines, vision_deferred=job.vision_deferred,
+    )
+    job.finish(success, reason)
+
+
+def bulk_db_stage(job: IngestJob, loader: BulkLoader):
+    loader.add(job)
+    # Finished and reported by the loader once its batch is written, possibly already inside add()
+    job.deferred = True
+
+
+STAGE_FUNCTIONS = {
+    "decode": decode_stage,
+    "ocr": ocr_stage,
+    "vision": vision_stage,
+    "embed": embed_stage,
+    "db": db_stage,
+}
+
+
+class IngestPipeline:
+    """
+    Runs screenshots through STAGES with bounded queues in between.
+
+    Usage:
+        pipeline = IngestPipeline(on_result=callback)
+        pipeline.start()
+        pipeline.submit(path)      # blocks while the first queue is full
+        pipeline.close()           # drains every stage and joins the workers
+
+    on_result(job) is called from a worker thread once per submitted file,
+    one call at a time, so callbacks can update counters without locking.
+
+    With OCR_POOL_WORKERS set (or an ocr_pool passed in), the OCR stage hands
+    decoded images to worker processes and runs one thread per worker.
+    Passing an IncrementalOCR makes the OCR stage re-read only the regions
+    that changed since the previous frame (used by the watcher).
+
+    Vision requests go through a VisionScheduler: the vision stage runs one
+    thread per allowed in-flight request (VISION_MAX_IN_FLIGHT), with
+    timeouts and retries, while the OCR stage keeps reading new images.
+
+    Embed workers share an EmbeddingBatcher, so description and OCR chunk
+    texts of several images go to Ollama in one batched request.
+
+    With a bulk_loader.BulkLoader the DB stage buffers finished images and
+    writes them with COPY in large batches; close() flushes what is left.
+    Their on_result call comes after their batch is written, with its result.
+    """
+
+    def __init__(self, concurrency: dict[str, int] = None, queue_size: int = None,
+                 on_result: Callable[[IngestJob], None] = None,
+                 stage_functions: dict[str, Callable[[IngestJob], None]] = None,
+                 ocr_pool: OCRWorkerPool = None, incremental_ocr: IncrementalOCR = None,
+                 vision_scheduler: VisionScheduler = None, embedding_batcher: EmbeddingBatcher = None,
+                 bulk_loader: BulkLoader = None):
+        self.ocr_pool = ocr_pool
+        self._owns_ocr_pool = False
+        if self.ocr_pool is None and get_pool_size() > 0:
+            self.ocr_pool = OCRWorkerPool()
+            self._owns_ocr_pool = True
+
+        self.vision_scheduler = vision_scheduler or VisionScheduler()
+        self.embedding_batcher = embedding_batcher
+        self._owns_batcher = embedding_batcher is None
+
+        self.concurrency = get_stage_concurrency()
+        if self.ocr_pool is not None and not os.getenv("PIPELINE_OCR_WORKERS"):
+            self.concurrency["ocr"] = self.ocr_pool.workers
+        if not os.getenv("PIPELINE_VISION_WORKERS"):
+            self.concurrency["vision"] = self.vision_scheduler.max_in_flight
+        if concurrency:
+            self.concurrency.update(concurrency)
+        self.queue_size = queue_size or int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+        self.on_result = on_result
+        self.incremental_ocr = incremental_ocr
+        self.stage_functions = dict(STAGE_FUNCTIONS)
+        if self.ocr_pool is not None or self.incremental_ocr is not None:
+            self.stage_functions["ocr"] = partial(ocr_stage, ocr_pool=self.ocr_pool,
+                                                  incremental=self.incremental_ocr)
+        self.stage_functions["vision"] = partial(vision_stage, scheduler=self.vision_scheduler)
+        self.stage_functions["embed"] = self._embed_stage
+        self.bulk_loader = bulk_loader
+        if self.bulk_loader is not None:
+            self.stage_functions["db"] = partial(bulk_db_stage, loader=self.bulk_loader)
+            self.bulk_loader.on_stored = self._emit
+        if stage_functions:
+            self.stage_functions.update(stage_functions)
+
+        self.queues = {stage: queue.Queue(maxsize=self.queue_size) for stage in STAGES}
+        self.stage_busy = {stage: 0.0 for stage in STAGES}
+        self._threads: list[threading.Thread] = []
+        self._remaining = {}
+        self._lock = threading.Lock()
+        self._result_lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        if self.ocr_pool is not None:
+            self.ocr_pool.start()
+        if self._owns_batcher:
+            self.embedding_batcher = EmbeddingBatcher()
+        for index, stage in enumerate(STAGES):
+            next_stage = STAGES[index + 1] if index + 1 < len(STAGES) else None
+            self._remaining[stage] = self.concurrency[stage]
+            for worker in range(self.concurrency[stage]):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(stage, next_stage),
+                    name=f"ingest-{stage}-{worker}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, image_path: str):
+        """Queue a file for processing, blocking while the pipeline is saturated."""
+        if not self._started:
+            self.start()
+        self.queues[STAGES[0]].put(IngestJob(image_path))
+
+    def close(self):
+        """Stop accepting files and wait until every queued file has been processed."""
+        if not self._started:
+            return
+        self.queues[STAGES[0]].put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._started = False
+        if self._owns_ocr_pool:
+            self.ocr_pool.close()
+        if self._owns_batcher:
+            self.embedding_batcher.close()
+        if self.bulk_loader is not None:
+            self.bulk_loader.flush()
+
+    def _embed_stage(self, job: IngestJob):
+        # Bound late: an owned batcher is created anew on every start()
+        embed_stage(job, batcher=self.embedding_batcher)
+
+    def run(self, image_paths: Iterable[str]) -> list[IngestJob]:
+        """Process a finite list of files and return the finished jobs."""
+        finished = []
+        callback = self.on_result
+
+        def collect(job):
+            finished.append(job)
+            if callback:
+                callback(job)
+
+        self.on_result = collect
+        try:
+            self.start()
+            for path in image_paths:
+                self.submit(path)
+            self.close()
+        finally:
+            self.on_result = callback
+        return finished
+
+    def _worker(self, stage: str, next_stage: Optional[str]):
+        inbox = self.queues[stage]
+        func = self.stage_functions[stage]
+        while True:
+            job = inbox.get()
+            if job is _STOP:
+                # Let sibling workers see the stop marker; the last one out
+                # forwards it to the next stage once all its work is done.
+                with self._lock:
+                    self._remaining[stage] -= 1
+                    last = self._remaining[stage] == 0
+                if not last:
+                    inbox.put(_STOP)
+                elif next_stage:
+                    self.queues[next_stage].put(_STOP)
+                return
+
+            if not job.done:
+                start = time.time()
+                try:
+                    func(job)
+                except Exception as e:
+                    print(f"Pipeline {stage} error for {os.path.basename(job.image_path)}: {e}")
+                    job.finish(False, f"{stage}_error")
+                with self._lock:
+                    self.stage_busy[stage] += time.time() - start
+
+            if next_stage:
+                self.queues[next_stage].put(job)
+            elif not job.deferred:
+                self._emit(job)
+
+    def _emit(self, job: IngestJob):
+        if job.success is None:
+            job.finish(False, "incomplete")
+        if self.on_result:
+            try:
+                with self._result_lock:
+                    self.on_result(job)
+            except Exception as e:
+                print(f"Pipeline result callback error: {e}")
+
+    def stage_report(self) -> str:
+        """Summarise busy time per stage; the largest one bounds throughput."""
+        parts = []
+        for stage in STAGES:
+            busy = self.stage_busy[stage] / self.concurrency[stage]
+            parts.append(f"{stage}={busy:.1f}s x{self.concurrency[stage]}")
+        report = "Stage time (per worker): " + ", ".join(parts) + "\n" + self.vision_scheduler.stats()
+        if self.embedding_batcher is not None:
+            report += "\n" + self.embedding_batcher.stats()
+        if self.bulk_loader is not None:
+            report += "\n" + self.bulk_loader.stats()
+        return report + "\n" + db.stats()
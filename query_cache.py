@@ -0,0 +1,155 @@
+"""
+LRU cache of search query embeddings.
+
+search_images() needs an embedding of the query before it can ask PostgreSQL
+anything, and the embedding model is the slow part of a search. Repeated
+queries (paging, re-running a search, typing the same words again) reuse the
+cached vector and only pay for the database query.
+
+Queries are normalised (NFC, trimmed, whitespace collapsed) and keyed
+together with the embedding model. QUERY_CACHE_SIZE bounds the number of
+entries; with QUERY_CACHE_PERSIST=1 entries are also kept in a local SQLite
+file so they survive app restarts. Cache hits only update memory; their
+last-used times are written with the next new entry or at exit.
+"""
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Callable, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "query_cache.sqlite3")
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a search query: NFC, trimmed, single spaces."""
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+class QueryEmbeddingCache:
+    """Bounded in-memory LRU of (model, query) -> embedding, optionally backed by SQLite."""
+
+    def __init__(self, max_entries: int = None, path: str = None, persist: bool = None):
+        self.max_entries = max(1, max_entries or int(os.getenv("QUERY_CACHE_SIZE", "512")))
+        if persist is None:
+            persist = os.getenv("QUERY_CACHE_PERSIST", "0") == "1"
+        self._entries: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # (model, query) -> time of cache hits not yet written to SQLite
+        self._touched: dict[tuple[str, str], float] = {}
+        self.hits = 0
+        self.misses = 0
+        if persist:
+            try:
+                self._open(path or os.getenv("QUERY_CACHE_PATH", DEFAULT_CACHE_PATH))
+            except Exception as e:
+                print(f"Query cache persistence unavailable: {e}")
+                self._conn = None
+
+    def _open(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                model TEXT NOT NULL,
+                query TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, query)
+            )
+        """)
+        self._conn.commit()
+        # Warm the in-memory LRU with the most recently used queries, oldest first
+        rows = self._conn.execute(
+            "SELECT model, query, embedding FROM query_embeddings ORDER BY last_used DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for model, query, blob in reversed(rows):
+            self._entries[(model, query)] = array("f", blob).tolist()
+
+    def get(self, model: str, query: str) -> Optional[list[float]]:
+        key = (model, normalize_query(query))
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            if self._conn is not None:
+                # Written with the next put() or at exit, so a cache hit never waits on SQLite
+                self._touched[key] = time.time()
+            return embedding
+
+    def put(self, model: str, query: str, embedding: list[float]):
+        if not embedding:
+            return
+        key = (model, normalize_query(query))
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if self._conn is not None:
+                self._touched.pop(key, None)
+                for evicted_key in evicted:
+                    self._touched.pop(evicted_key, None)
+                self._conn.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                                   (*key, array("f", embedding).tobytes(), time.time()))
+                self._conn.executemany("DELETE FROM query_embeddings WHERE model = ? AND query = ?", evicted)
+                self._write_touched()
+                self._conn.commit()
+
+    def _write_touched(self):
+        """Store last_used of entries hit since the last write (caller holds the lock and commits)."""
+        if self._touched:
+            self._conn.executemany("UPDATE query_embeddings SET last_used = ? WHERE model = ? AND query = ?",
+                                   [(used, *key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def flush(self):
+        """Write pending last_used updates to SQLite (called at exit)."""
+        with self._lock:
+            if self._conn is not None and self._touched:
+                try:
+                    self._write_touched()
+                    self._conn.commit()
+                except Exception as e:
+                    print(f"Query cache write failed: {e}")
+
+    def get_or_compute(self, model: str, query: str,
+                       compute: Callable[[str], Optional[list[float]]]) -> Optional[list[float]]:
+        """Cached embedding for query, calling compute(normalized_query) on a miss."""
+        embedding = self.get(model, query)
+        if embedding is None:
+            embedding = compute(normalize_query(query))
+            self.put(model, query, embedding)
+        return embedding
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (f"Query cache: {len(self._entries)}/{self.max_entries} entries, "
+                f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)")
+
+
+_cache: Optional[QueryEmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> Optional[QueryEmbeddingCache]:
+    """Process-wide cache, or None when QUERY_CACHE=0."""
+    global _cache
+    if os.getenv("QUERY_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryEmbeddingCache()
+            atexit.register(_cache.flush)
+        return _cache
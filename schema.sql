@@ -8,6 +8,8 @@
 
 -- Enable pgvector extension for vector similarity search
 CREATE EXTENSION IF NOT EXISTS vector;
+-- Trigram matching for keyword search (works for Korean as well as English)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 -- ============================================================================
 -- TABLES
@@ -22,6 +24,9 @@ CREATE TABLE IF NOT EXISTS images (
     inserted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     ai_description TEXT,             -- Vision LLM generated description
     model_name TEXT,                 -- Model used for description
+    content_hash TEXT,               -- SHA-256 of the file bytes (reuse results for identical files)
+    perceptual_hash TEXT,            -- 256-bit dHash (hex) for near-duplicate detection
+    vision_deferred BOOLEAN NOT NULL DEFAULT FALSE,  -- Description postponed by VISION_ROUTING=defer
     
     -- Indexes for faster queries
     CONSTRAINT images_filepath_key UNIQUE (filepath)
@@ -31,39 +36,180 @@ CREATE TABLE IF NOT EXISTS images (
 CREATE INDEX IF NOT EXISTS idx_images_timestamp ON images(timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_images_inserted_at ON images(inserted_at DESC);
 
+-- Migration for databases created before content hashing (safe to re-run)
+ALTER TABLE images ADD COLUMN IF NOT EXISTS content_hash TEXT;
+-- Not unique: the same bytes may legitimately live at several file paths
+CREATE INDEX IF NOT EXISTS idx_images_content_hash ON images(content_hash);
+ALTER TABLE images ADD COLUMN IF NOT EXISTS perceptual_hash TEXT;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS vision_deferred BOOLEAN NOT NULL DEFAULT FALSE;
+CREATE INDEX IF NOT EXISTS idx_images_vision_deferred ON images(id) WHERE vision_deferred;
+
 -- OCR Results table: Stores extracted text and confidence scores
 CREATE TABLE IF NOT EXISTS ocr_results (
     id SERIAL PRIMARY KEY,
     image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
     text TEXT NOT NULL,
-    confidence FLOAT NOT NULL CHECK (confidence >= 0 AND confidence <= 1),
+    confidence FLOAT NOT NULL CHECK (confidence >= 0 AND confidence <= 1),  -- Length-weighted mean of line scores
+    lines JSONB,                     -- Per-line [{text, confidence, box}] from PaddleOCR
     
     -- One OCR result per image
     CONSTRAINT ocr_results_image_id_key UNIQUE (image_id)
 );
 
--- Create index for text search
-CREATE INDEX IF NOT EXISTS idx_ocr_text ON ocr_results USING gin(to_tsvector('english', text));
+-- Trigram indexes for keyword search over OCR text and descriptions. They replace the
+-- English-only tsvector index, which keyword search never used.
+CREATE INDEX IF NOT EXISTS idx_ocr_text_trgm ON ocr_results USING gin(text gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_images_description_trgm ON images USING gin(ai_description gin_trgm_ops);
+DROP INDEX IF EXISTS idx_ocr_text;
 CREATE INDEX IF NOT EXISTS idx_ocr_image_id ON ocr_results(image_id);
 
--- Text Embeddings table: Stores bge-m3 embeddings (1024-dimensional)
-CREATE TABLE IF NOT EXISTS text_embedding (
+-- Migration for databases created before per-line confidence (safe to re-run)
+ALTER TABLE ocr_results ADD COLUMN IF NOT EXISTS lines JSONB;
+
+-- Embedding chunks: one row per distinct chunk text (content-addressed), shared by every
+-- image that contains it, so toolbars and boilerplate text are embedded and stored once
+CREATE TABLE IF NOT EXISTS embedding_chunks (
     id SERIAL PRIMARY KEY,
+    content_hash TEXT NOT NULL,             -- SHA-256 of embedding model + chunk text
+    embedding VECTOR(1024) NOT NULL,        -- bge-m3 generates 1024-dim vectors
+    ref_count INTEGER NOT NULL DEFAULT 0,   -- image_chunks rows using this chunk (kept by trigger)
+    
+    CONSTRAINT embedding_chunks_content_hash_key UNIQUE (content_hash)
+);
+
+-- Image chunks: which chunks make up each image (-1 = description, 0+ = OCR chunks)
+CREATE TABLE IF NOT EXISTS image_chunks (
     image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
-    embedding VECTOR(1024) NOT NULL,  -- bge-m3 generates 1024-dim vectors
-    chunk_index INTEGER NOT NULL DEFAULT 0,
+    chunk_index INTEGER NOT NULL,
+    chunk_id INTEGER NOT NULL REFERENCES embedding_chunks(id),
     
-    -- Allow multiple chunks per image
-    CONSTRAINT text_embedding_image_chunk_key UNIQUE (image_id, chunk_index)
+    PRIMARY KEY (image_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_image_chunks_chunk_id ON image_chunks(chunk_id);
+
+-- Reference counting: adding or removing an image's chunk (including the cascade when an
+-- image is deleted) adjusts ref_count, and a chunk no image uses any more is deleted
+CREATE OR REPLACE FUNCTION image_chunks_ref_count() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE embedding_chunks SET ref_count = ref_count + 1 WHERE id = NEW.chunk_id;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE embedding_chunks SET ref_count = ref_count - 1 WHERE id = OLD.chunk_id;
+        DELETE FROM embedding_chunks WHERE id = OLD.chunk_id AND ref_count <= 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_image_chunks_ref_count ON image_chunks;
+CREATE TRIGGER trg_image_chunks_ref_count
+    AFTER INSERT OR DELETE OR UPDATE OF chunk_id ON image_chunks
+    FOR EACH ROW EXECUTE FUNCTION image_chunks_ref_count();
+
+-- Migration for databases created with one text_embedding row per image chunk (safe to re-run).
+-- Description chunks (-1) get the same text-based key new ingest uses (chunk_content_hash:
+-- SHA-256 of model, NUL, text), so later screenshots with the same description reuse them.
+-- OCR chunks were cut by the old character chunker and their text is not stored, so they are
+-- keyed by vector digest instead: they are de-duplicated among themselves but never matched
+-- by new ingest, which embeds and stores its own chunks.
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('text_embedding')) = 'r' THEN
+        CREATE TEMP TABLE legacy_chunks ON COMMIT DROP AS
+        SELECT te.image_id, te.chunk_index, te.embedding,
+               CASE WHEN te.chunk_index = -1 AND i.ai_description IS NOT NULL
+                    THEN encode(sha256(convert_to('bge-m3:latest', 'UTF8') || '\x00'::bytea
+                                       || convert_to(i.ai_description, 'UTF8')), 'hex')
+                    ELSE 'legacy:' || md5(te.embedding::text)
+               END AS content_hash
+        FROM text_embedding te
+        JOIN images i ON i.id = te.image_id;
+        
+        INSERT INTO embedding_chunks (content_hash, embedding)
+        SELECT DISTINCT ON (content_hash) content_hash, embedding
+        FROM legacy_chunks
+        ON CONFLICT (content_hash) DO NOTHING;
+        
+        INSERT INTO image_chunks (image_id, chunk_index, chunk_id)
+        SELECT l.image_id, l.chunk_index, c.id
+        FROM legacy_chunks l
+        JOIN embedding_chunks c ON c.content_hash = l.content_hash
+        ON CONFLICT DO NOTHING;
+        
+        -- CASCADE drops v_image_summary, which is recreated below
+        DROP TABLE text_embedding CASCADE;
+        RAISE NOTICE 'Moved text_embedding rows into embedding_chunks / image_chunks';
+    END IF;
+END $$;
+
+-- Search settings recorded by this script and read by the app
+CREATE TABLE IF NOT EXISTS search_settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
 );
 
--- Create vector index for fast similarity search
--- Using ivfflat for approximate nearest neighbor search
-CREATE INDEX IF NOT EXISTS idx_embedding_vector ON text_embedding 
-    USING ivfflat (embedding vector_cosine_ops)
-    WITH (lists = 100);  -- Tune based on dataset size
+-- Vector index for fast similarity search (ivfflat approximate nearest neighbor).
+-- The index mode sets how the vectors are stored in the index:
+--   full     VECTOR(1024), 4 KB per chunk
+--   halfvec  half precision, about 2x smaller (pgvector 0.7+)
+--   binary   1 bit per dimension, about 32x smaller (pgvector 0.7+)
+-- Quantized modes index an expression over the full vectors, which stay in the table, and
+-- search re-ranks their candidates exactly. Pick a mode before running this script:
+--   \set vector_index_mode binary
+--   \i schema.sql
+-- Without it, the mode recorded by the last run is kept (full the first time). Re-running
+-- with another mode builds the new index and drops the old one. An existing index is kept
+-- as is; `python vector_index.py --rebuild` resizes it (or switches it to HNSW) as the table grows.
+\if :{?vector_index_mode}
+SELECT set_config('app.vector_index_mode', :'vector_index_mode', false);
+\endif
 
-CREATE INDEX IF NOT EXISTS idx_embedding_image_id ON text_embedding(image_id);
+DO $$
+DECLARE
+    mode TEXT := COALESCE(
+        NULLIF(current_setting('app.vector_index_mode', true), ''),
+        (SELECT value FROM search_settings WHERE key = 'vector_index_mode'),
+        'full');
+BEGIN
+    IF mode NOT IN ('full', 'halfvec', 'binary') THEN
+        RAISE EXCEPTION 'vector_index_mode must be full, halfvec or binary, not %', mode;
+    END IF;
+    
+    IF mode = 'full' THEN
+        CREATE INDEX IF NOT EXISTS idx_embedding_vector ON embedding_chunks 
+            USING ivfflat (embedding vector_cosine_ops)
+            WITH (lists = 100);  -- Retuned to the row count by vector_index.py
+    ELSIF mode = 'halfvec' THEN
+        CREATE INDEX IF NOT EXISTS idx_embedding_halfvec ON embedding_chunks 
+            USING ivfflat ((embedding::halfvec(1024)) halfvec_cosine_ops)
+            WITH (lists = 100);
+    ELSE
+        CREATE INDEX IF NOT EXISTS idx_embedding_binary ON embedding_chunks 
+            USING ivfflat ((binary_quantize(embedding)::bit(1024)) bit_hamming_ops)
+            WITH (lists = 100);
+    END IF;
+    
+    -- Drop the other modes' indexes only once the new one exists
+    IF mode <> 'full' THEN DROP INDEX IF EXISTS idx_embedding_vector; END IF;
+    IF mode <> 'halfvec' THEN DROP INDEX IF EXISTS idx_embedding_halfvec; END IF;
+    IF mode <> 'binary' THEN DROP INDEX IF EXISTS idx_embedding_binary; END IF;
+    
+    INSERT INTO search_settings (key, value) VALUES ('vector_index_mode', mode)
+    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+    RAISE NOTICE 'Vector index mode: %', mode;
+END $$;
+
+-- Text Embeddings view: per-image bge-m3 embeddings (1024-dimensional), read through the chunk store
+CREATE OR REPLACE VIEW text_embedding AS
+SELECT 
+    ic.image_id,
+    ic.chunk_index,
+    ic.chunk_id,
+    c.embedding
+FROM image_chunks ic
+JOIN embedding_chunks c ON c.id = ic.chunk_id;
 
 -- ============================================================================
 -- PERMISSIONS
@@ -72,12 +218,15 @@ CREATE INDEX IF NOT EXISTS idx_embedding_image_id ON text_embedding(image_id);
 -- Grant all privileges to the application user
 GRANT ALL PRIVILEGES ON TABLE images TO screuser235;
 GRANT ALL PRIVILEGES ON TABLE ocr_results TO screuser235;
-GRANT ALL PRIVILEGES ON TABLE text_embedding TO screuser235;
+GRANT ALL PRIVILEGES ON TABLE embedding_chunks TO screuser235;
+GRANT ALL PRIVILEGES ON TABLE image_chunks TO screuser235;
+GRANT SELECT ON text_embedding TO screuser235;
+GRANT SELECT ON search_settings TO screuser235;
 
 -- Grant sequence permissions for auto-increment IDs
 GRANT ALL PRIVILEGES ON SEQUENCE images_id_seq TO screuser235;
 GRANT ALL PRIVILEGES ON SEQUENCE ocr_results_id_seq TO screuser235;
-GRANT ALL PRIVILEGES ON SEQUENCE text_embedding_id_seq TO screuser235;
+GRANT ALL PRIVILEGES ON SEQUENCE embedding_chunks_id_seq TO screuser235;
 
 -- ============================================================================
 -- USEFUL VIEWS (Optional)
@@ -96,7 +245,7 @@ SELECT
     o.text,
     o.confidence,
     LENGTH(o.text) as text_length,
-    COUNT(te.id) as embedding_count
+    COUNT(te.chunk_id) as embedding_count
 FROM images i
 LEFT JOIN ocr_results o ON i.id = o.image_id
 LEFT JOIN text_embedding te ON i.id = te.image_id
@@ -145,14 +294,21 @@ DECLARE
     img_count INTEGER;
     ocr_count INTEGER;
     emb_count INTEGER;
+    chunk_count INTEGER;
+    index_size TEXT;
 BEGIN
     SELECT COUNT(*) INTO img_count FROM images;
     SELECT COUNT(*) INTO ocr_count FROM ocr_results;
-    SELECT COUNT(*) INTO emb_count FROM text_embedding;
+    SELECT COUNT(*) INTO emb_count FROM image_chunks;
+    SELECT COUNT(*) INTO chunk_count FROM embedding_chunks;
+    SELECT pg_size_pretty(COALESCE(SUM(pg_relation_size(idx)), 0)) INTO index_size
+    FROM unnest(ARRAY[to_regclass('idx_embedding_vector'), to_regclass('idx_embedding_halfvec'),
+                      to_regclass('idx_embedding_binary')]) AS idx;
     
     RAISE NOTICE 'Database Statistics:';
     RAISE NOTICE '  Images: %', img_count;
     RAISE NOTICE '  OCR Results: %', ocr_count;
-    RAISE NOTICE '  Embeddings: %', emb_count;
+    RAISE NOTICE '  Embeddings: % (% distinct chunks stored)', emb_count, chunk_count;
+    RAISE NOTICE '  Vector index: %', index_size;
     RAISE NOTICE 'Schema setup complete!';
 END $$;
@@ -0,0 +1,153 @@
+"""
+Local stub of the Ollama HTTP API for testing without a GPU or models.
+
+Implements the endpoints this project uses:
+  GET  /api/tags         model list (ollama.list)
+  POST /api/chat         vision descriptions, streaming (NDJSON) or not
+  POST /api/embeddings   single embedding (ollama.embeddings)
+  POST /api/embed        batched embeddings (ollama.embed)
+
+Each chat request sleeps for `chat_delay` seconds, like a model generating
+tokens, and the first `fail_first` chat requests return HTTP 500 so retry
+logic can be exercised. Parallel requests are served in parallel.
+
+    python stub_ollama_server.py --port 11535 --chat-delay 1.0
+    # then point LOCAL_LLM_API_URL / OLLAMA_HOST at http://127.0.0.1:11535
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 1024
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> list[float]:
+    """Deterministic unit-length vector derived from the text."""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    values = [(seed[i % len(seed)] - 127.5) / 127.5 for i in range(dim)]
+    norm = sum(v * v for v in values) ** 0.5 or 1.0
+    return [v / norm for v in values]
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), chat_delay: float = 0.5, fail_first: int = 0,
+                 embed_delay: float = 0.0):
+        super().__init__(address, _Handler)
+        self.chat_delay = chat_delay
+        self.embed_delay = embed_delay
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+        self.chat_requests = 0
+        self.embed_requests = 0
+        self.embedded_texts = 0
+        self.active_chats = 0
+        self.max_active_chats = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start_background(self) -> "StubOllamaServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StubOllamaServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"model": "stub-vision", "name": "stub-vision"},
+                                        {"model": "bge-m3:latest", "name": "bge-m3:latest"}]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.path == "/api/chat":
+            self._chat(request)
+        elif self.path == "/api/embeddings":
+            self._embed([request.get("prompt", "")], legacy=True)
+        elif self.path == "/api/embed":
+            texts = request.get("input", "")
+            self._embed([texts] if isinstance(texts, str) else list(texts), legacy=False)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _chat(self, request: dict):
+        server = self.server
+        with server.lock:
+            server.chat_requests += 1
+            number = server.chat_requests
+            server.active_chats += 1
+            server.max_active_chats = max(server.max_active_chats, server.active_chats)
+        try:
+            if number <= server.fail_first:
+                self._send_json({"error": "stub failure"}, 500)
+                return
+            time.sleep(server.chat_delay)
+            images = request.get("messages", [{}])[-1].get("images") or []
+            content = f"Stub description of a screenshot ({len(images[0]) if images else 0} base64 bytes)."
+            message = {"role": "assistant", "content": content}
+            if request.get("stream", True):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                for word in content.split(" "):
+                    chunk = {"model": request.get("model"), "message": {"role": "assistant", "content": word + " "},
+                             "done": False}
+                    self.wfile.write((json.dumps(chunk) + "\n").encode("utf-8"))
+                final = {"model": request.get("model"), "message": {"role": "assistant", "content": ""},
+                         "done": True}
+                self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+            else:
+                self._send_json({"model": request.get("model"), "message": message, "done": True})
+        finally:
+            with server.lock:
+                server.active_chats -= 1
+
+    def _embed(self, texts: list[str], legacy: bool):
+        server = self.server
+        with server.lock:
+            server.embed_requests += 1
+            server.embedded_texts += len(texts)
+        time.sleep(server.embed_delay)
+        if legacy:
+            self._send_json({"embedding": fake_embedding(texts[0])})
+        else:
+            self._send_json({"model": "bge-m3:latest", "embeddings": [fake_embedding(t) for t in texts]})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama API server")
+    parser.add_argument("--port", type=int, default=11535)
+    parser.add_argument("--chat-delay", type=float, default=0.5)
+    parser.add_argument("--fail-first", type=int, default=0)
+    args = parser.parse_args()
+    server = StubOllamaServer(("127.0.0.1", args.port), chat_delay=args.chat_delay, fail_first=args.fail_first)
+    print(f"Stub Ollama server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
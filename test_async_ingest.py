@@ -0,0 +1,170 @@
+"""
+Test the asyncio ingest engine against the local stub Ollama server, with
+OCR and PostgreSQL replaced by in-memory fakes (no GPU, models or database):
+many images in flight on a handful of threads, vision limit respected.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+import ocr_processor
+from async_ingest import AsyncIngestEngine
+from stub_ollama_server import StubOllamaServer
+
+
+@pytest.fixture(autouse=True)
+def fake_ocr(monkeypatch):
+    """Plain settings and fast fake OCR, undone after each test."""
+    for name, value in {"NEAR_DUPLICATE_MODE": "off", "VISION_CACHE": "0", "VISION_PAYLOAD_CACHE": "0",
+                        "VISION_ROUTING": "always"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(ocr_processor, "get_paddle_ocr_lines", fake_ocr_lines)
+
+
+class InMemoryEngine(AsyncIngestEngine):
+    """Engine with the database swapped for a dict."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stored = {}
+        self.stored_chunks = set()
+        self.peak_threads = 0
+
+    async def _connect_db(self):
+        return None
+
+    async def _find_duplicate(self, filepath):
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+        return None
+
+    async def _find_by_hash(self, content_hash):
+        return None
+
+    async def _find_stored_chunks(self, content_hashes):
+        return {h for h in content_hashes if h in self.stored_chunks}
+
+    async def _store(self, job):
+        self.stored[job.image_path] = job
+        self.stored_chunks.update(content_hash for _, content_hash, _ in job.embeddings)
+        return True, "success"
+
+
+def fake_ocr_lines(image_path, ocr_pool=None, img=None, incremental=None):
+    time.sleep(0.005)
+    return [((0, 0, 10, 10), f"text of {os.path.basename(image_path)}", 0.95)]
+
+
+def write_images(directory, count):
+    paths = []
+    for i in range(count):
+        img = np.full((64, 96, 3), i % 256, dtype=np.uint8)
+        cv2.putText(img, str(i), (5, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        path = os.path.join(directory, f"shot_{i:04d}.png")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def test_many_images_in_flight_on_few_threads():
+    server = StubOllamaServer(chat_delay=0.2).start_background()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_images(directory, 120)
+            engine = InMemoryEngine(host=server.url, vision_in_flight=12, max_in_flight=256)
+            start = time.time()
+            jobs = asyncio.run(engine.run(paths))
+            elapsed = time.time() - start
+
+        assert all(job.success for job in jobs), [job.reason for job in jobs if not job.success]
+        assert len(engine.stored) == 120
+        job = engine.stored[paths[0]]
+        assert job.description.startswith("Stub description")
+        # Description (chunk -1) plus one OCR chunk
+        assert [index for index, _, _ in job.embeddings] == [-1, 0]
+        assert server.max_active_chats <= 12
+        # Up to 240 texts (description + one OCR chunk each; identical stub descriptions
+        # are embedded once) share batched embed requests
+        assert server.embedded_texts <= 240
+        assert server.embed_requests < 60, server.embed_requests
+        # Every image was admitted at once, without a thread per image
+        assert engine.peak_in_flight == 120
+        assert engine.peak_threads < 40, engine.peak_threads
+        # 120 requests x 0.2s with 12 in flight ~ 2s (serial would be 24s)
+        assert elapsed < 8, elapsed
+        print(f"120 images in {elapsed:.2f}s, peak {engine.peak_threads} threads")
+        print(engine.stage_report())
+    finally:
+        server.shutdown()
+
+
+def test_vision_failures_are_retried():
+    server = StubOllamaServer(chat_delay=0.0, fail_first=2).start_background()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_images(directory, 1)
+            engine = InMemoryEngine(host=server.url, vision_in_flight=1)
+            engine.vision_backoff = 0.01
+            jobs = asyncio.run(engine.run(paths))
+        assert jobs[0].success
+        assert jobs[0].description.startswith("Stub description")
+        assert engine.vision_retried == 2
+    finally:
+        server.shutdown()
+
+
+def test_stored_chunks_are_not_embedded_again(monkeypatch):
+    # Every screenshot shows the same toolbar text
+    monkeypatch.setattr(ocr_processor, "get_paddle_ocr_lines",
+                        lambda *args, **kwargs: [((0, 0, 10, 10), "File Edit View Help", 0.95)])
+    server = StubOllamaServer(chat_delay=0.0).start_background()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_images(directory, 10)
+            engine = InMemoryEngine(host=server.url, max_in_flight=1)
+            jobs = asyncio.run(engine.run(paths))
+        assert all(job.success for job in jobs)
+        ocr_chunks = [chunk for job in jobs for chunk in job.embeddings if chunk[0] == 0]
+        assert len({content_hash for _, content_hash, _ in ocr_chunks}) == 1
+        # Embedded for the first screenshot only; the others reference the stored chunk
+        assert sum(1 for _, _, vector in ocr_chunks if vector is not None) == 1
+        assert server.embedded_texts <= 11
+    finally:
+        server.shutdown()
+
+
+def test_deleted_stored_chunk_is_embedded_again():
+    server = StubOllamaServer(chat_delay=0.0).start_background()
+    engine = InMemoryEngine(host=server.url)
+    chunks = ocr_processor.get_image_chunks("File Edit View Help", "A toolbar")
+    # Both chunks were stored when looked up; the description chunk's last image was deleted since
+    job = SimpleNamespace(text="File Edit View Help", description="A toolbar",
+                          embeddings=[(index, content_hash, None) for index, content_hash, _ in chunks])
+    engine.stored_chunks = {chunks[1][1]}
+
+    async def refill():
+        await engine.start()
+        try:
+            return await engine._refill_missing_chunks(job)
+        finally:
+            await engine.close()
+
+    try:
+        refilled = asyncio.run(refill())
+        assert [(index, content_hash) for index, content_hash, _ in refilled] == \
+            [(index, content_hash) for index, content_hash, _ in job.embeddings]
+        assert refilled[0][2] is not None and refilled[1][2] is None
+        assert server.embedded_texts == 1
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    # The tests use pytest fixtures (monkeypatch), so run them through pytest
+    raise SystemExit(pytest.main([__file__, "-q", "-s"]))
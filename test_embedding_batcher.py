@@ -0,0 +1,67 @@
+"""
+Test batched embeddings against the local stub Ollama server (no GPU or
+models needed): one request per image, and texts of concurrent images
+grouped into size-capped batches.
+"""
+import threading
+
+from ocr_processor import OllamaClient, generate_image_embeddings, plan_embedding_batches
+from embedding_batcher import EmbeddingBatcher
+from stub_ollama_server import StubOllamaServer, fake_embedding
+
+OCR_TEXT = " ".join(f"Line {i} of text shown in the screenshot." for i in range(120))
+
+
+def test_plan_respects_caps():
+    texts = ["x" * 100] * 10
+    assert [len(b) for b in plan_embedding_batches(texts, max_texts=4, max_chars=10000)] == [4, 4, 2]
+    assert [len(b) for b in plan_embedding_batches(texts, max_texts=32, max_chars=250)] == [2, 2, 2, 2, 2]
+    # A single text over the character cap still gets its own batch
+    assert plan_embedding_batches(["y" * 500], max_chars=100) == [["y" * 500]]
+
+
+def test_one_request_per_image():
+    server = StubOllamaServer().start_background()
+    try:
+        client = OllamaClient(host=server.url)
+        embeddings = generate_image_embeddings(OCR_TEXT, "A code editor.", client=client, skip_stored=False)
+        chunks = client.chunk_text(OCR_TEXT)
+        assert [index for index, _, _ in embeddings] == [-1] + list(range(len(chunks)))
+        assert embeddings[0][2] == fake_embedding("A code editor.")
+        assert server.embed_requests == 1
+        assert server.embedded_texts == len(chunks) + 1
+    finally:
+        server.shutdown()
+
+
+def test_batcher_groups_concurrent_images():
+    server = StubOllamaServer(embed_delay=0.05).start_background()
+    try:
+        batcher = EmbeddingBatcher(client=OllamaClient(host=server.url), max_texts=16, max_wait=0.05)
+        results = {}
+
+        def embed_image(i):
+            results[i] = generate_image_embeddings(f"text of image {i}", f"description {i}", batcher=batcher,
+                                                   skip_stored=False)
+
+        threads = [threading.Thread(target=embed_image, args=(i,)) for i in range(24)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.close()
+
+        assert all(results[i][0][2] == fake_embedding(f"description {i}") for i in range(24))
+        assert all(results[i][1][2] == fake_embedding(f"text of image {i}") for i in range(24))
+        assert server.embedded_texts == 48
+        # 48 texts, at most 16 per request
+        assert 3 <= server.embed_requests <= 6, server.embed_requests
+        print(batcher.stats())
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    for test in (test_plan_respects_caps, test_one_request_per_image, test_batcher_groups_concurrent_images):
+        test()
+        print(f"✅ {test.__name__}")
@@ -5,7 +5,7 @@ import os
 import glob
 from ocr_processor import process_image_to_db, check_for_duplicate_image
 from dotenv import load_dotenv
-import psycopg2
+import db
 
 load_dotenv()
 
@@ -27,21 +27,15 @@ if test_file:
     image_id = check_for_duplicate_image(test_file)
     if image_id:
         print(f"Duplicate found (ID: {image_id}). Deleting for fresh test...")
-        conn = psycopg2.connect(
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT"),
-            dbname=os.getenv("POSTGRES_DB"),
-            user=os.getenv("POSTGRES_USER"),
-            password=os.getenv("POSTGRES_PASSWORD")
-        )
+        conn = db.getconn()
         cursor = conn.cursor()
         # Delete in correct order to respect foreign key constraints
-        cursor.execute("DELETE FROM text_embedding WHERE image_id = %s", (image_id,))
+        cursor.execute("DELETE FROM image_chunks WHERE image_id = %s", (image_id,))
         cursor.execute("DELETE FROM ocr_results WHERE image_id = %s", (image_id,))
         cursor.execute("DELETE FROM images WHERE id = %s", (image_id,))
         conn.commit()
         cursor.close()
-        conn.close()
+        db.putconn(conn)
         print("Deleted.")
 
     # Process the image
@@ -53,13 +47,7 @@ if test_file:
         print("=" * 60)
         
         # Verify data in database
-        conn = psycopg2.connect(
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT"),
-            dbname=os.getenv("POSTGRES_DB"),
-            user=os.getenv("POSTGRES_USER"),
-            password=os.getenv("POSTGRES_PASSWORD")
-        )
+        conn = db.getconn()
         cursor = conn.cursor()
         
         # Check image record
@@ -81,7 +69,7 @@ if test_file:
             print("  - ❌ AI Description embedding (index -1) MISSING.")
             
         cursor.close()
-        conn.close()
+        db.putconn(conn)
     else:
         print("\n" + "=" * 60)
         print("❌ FAILED - Check errors above")
@@ -0,0 +1,39 @@
+"""
+Test the token-based chunker on inputs made of units larger than a chunk:
+long words and long Hangul runs that are sliced, each slice emitted once.
+"""
+from text_chunker import chunk_text, count_tokens, estimate_unit_tokens
+
+
+def assert_no_repeats(chunks):
+    assert all(a != b for a, b in zip(chunks, chunks[1:])), chunks
+
+
+def test_single_unit_chunks_are_emitted_once():
+    chunks = chunk_text("a" * 20 + " " + "b" * 20, 5, 0, count_unit=estimate_unit_tokens)
+    assert chunks == ["a" * 20, "b" * 20]
+
+
+def test_split_unit_is_emitted_once_per_slice():
+    # 3000 distinct syllables in one run: ~2250 estimated tokens, sliced into 3 chunks
+    text = "".join(chr(0xAC00 + i * 7 % 11172) for i in range(3000))
+    chunks = chunk_text(text, 1024, 64, count_unit=estimate_unit_tokens)
+    assert len(chunks) == 3, [len(chunk) for chunk in chunks]
+    assert_no_repeats(chunks)
+    assert "".join(chunks) == text
+    assert all(count_tokens(chunk, estimate_unit_tokens) <= 1024 for chunk in chunks)
+
+
+def test_long_word_between_sentences():
+    # 200 letters, ~40 estimated tokens: sliced into 4 chunks of 50 letters
+    word = "".join(chr(ord("a") + i * 7 % 26) for i in range(200))
+    chunks = chunk_text("Short sentence. " + word + " tail words here.", 10, 2, count_unit=estimate_unit_tokens)
+    assert_no_repeats(chunks)
+    assert chunks == ["Short sentence.", word[:50], word[50:100], word[100:150], word[150:], "tail words here."]
+
+
+if __name__ == "__main__":
+    for test in (test_single_unit_chunks_are_emitted_once, test_split_unit_is_emitted_once_per_slice,
+                 test_long_word_between_sentences):
+        test()
+        print(f"✅ {test.__name__}")
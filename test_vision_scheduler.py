@@ -0,0 +1,62 @@
+"""
+Test the vision request scheduler against the local stub Ollama server
+(no GPU or models needed): concurrency limit, throughput and retries.
+"""
+import time
+from stub_ollama_server import StubOllamaServer
+from vision_scheduler import VisionScheduler
+
+IMAGE_DATA = b"\x89PNG stub image payload"
+
+
+def test_parallel_requests_respect_limit():
+    server = StubOllamaServer(chat_delay=0.3).start_background()
+    try:
+        scheduler = VisionScheduler(max_in_flight=4, host=server.url, timeout=10, retries=0)
+        start = time.time()
+        futures = [scheduler.submit(IMAGE_DATA) for _ in range(8)]
+        descriptions = [f.result() for f in futures]
+        elapsed = time.time() - start
+        scheduler.close()
+
+        assert all(d.startswith("Stub description") for d in descriptions)
+        assert server.max_active_chats == 4
+        # 8 requests x 0.3s with 4 in flight ~ 0.6s (serial would be 2.4s)
+        assert elapsed < 1.5, elapsed
+        print(f"8 requests, 4 in flight: {elapsed:.2f}s (serial ~{8 * 0.3:.1f}s)")
+    finally:
+        server.shutdown()
+
+
+def test_failed_requests_are_retried():
+    server = StubOllamaServer(chat_delay=0.0, fail_first=2).start_background()
+    try:
+        scheduler = VisionScheduler(max_in_flight=1, host=server.url, timeout=10, retries=2, backoff=0.01)
+        assert scheduler.describe(IMAGE_DATA).startswith("Stub description")
+        assert scheduler.retried == 2
+        assert server.chat_requests == 3
+        print(scheduler.stats())
+    finally:
+        server.shutdown()
+
+
+def test_gives_up_after_retries():
+    server = StubOllamaServer(chat_delay=0.0, fail_first=5).start_background()
+    try:
+        scheduler = VisionScheduler(max_in_flight=1, host=server.url, timeout=10, retries=1, backoff=0.01)
+        try:
+            scheduler.describe(IMAGE_DATA)
+            raise AssertionError("expected the request to fail")
+        except Exception as e:
+            if isinstance(e, AssertionError):
+                raise
+        assert scheduler.failed == 1
+        assert server.chat_requests == 2
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    for test in (test_parallel_requests_respect_limit, test_failed_requests_are_retried, test_gives_up_after_retries):
+        test()
+        print(f"✅ {test.__name__}")
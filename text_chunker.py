@@ -0,0 +1,144 @@
+"""
+Token-aware text chunking for embeddings.
+
+Chunks are packed up to EMBED_CHUNK_TOKENS tokens (bge-m3 runs with
+num_ctx 2048) instead of a fixed number of characters, so dense Korean text
+and sparse English text both fill the model's context. The chunker works in
+a single pass over the text. It prefers to break after a sentence or line
+end in the second half of a chunk, otherwise between words, and starts each
+chunk with up to EMBED_CHUNK_OVERLAP_TOKENS tokens from the previous one.
+
+Token counts come from a per-script estimate of the bge-m3 (XLM-R
+SentencePiece) vocabulary. Set EMBED_TOKENIZER to a tokenizer.json file to
+count with the real tokenizer instead (needs the `tokenizers` package).
+"""
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Optional
+
+# A word, number, Hangul run or other single character, with the whitespace before it
+_UNIT = re.compile(r"(\s*)([A-Za-z\u00c0-\u024f]+|\d+|[\uac00-\ud7a3\u1100-\u11ff\u3130-\u318f]+|\S)")
+_SENTENCE_END = frozenset(".!?\u3002\uff01\uff1f")
+
+
+def estimate_unit_tokens(unit: str) -> int:
+    """Approximate XLM-R token count of one unit from _UNIT."""
+    first = unit[0]
+    if first.isascii() and first.isalpha() or "À" <= first <= "ɏ":
+        # Common English words are one piece; long or rare ones split every ~5 letters
+        return 1 + (len(unit) - 1) // 5
+    if first.isdigit():
+        return 1 + (len(unit) - 1) // 3
+    if "가" <= first <= "힣" or "ᄀ" <= first <= "㆏":
+        # Hangul is much denser: roughly 3 tokens per 4 syllables
+        return max(1, math.ceil(len(unit) * 0.75))
+    # CJK ideographs, kana, symbols and punctuation: about one token each
+    return 1
+
+
+@lru_cache(maxsize=1)
+def _load_tokenizer(path: str):
+    from tokenizers import Tokenizer
+    return Tokenizer.from_file(path)
+
+
+def get_token_counter() -> Callable[[str], int]:
+    """Per-unit token counter: the real tokenizer when EMBED_TOKENIZER is set, else the estimate."""
+    path = os.getenv("EMBED_TOKENIZER")
+    if path:
+        try:
+            tokenizer = _load_tokenizer(path)
+
+            @lru_cache(maxsize=65536)
+            def count(unit: str) -> int:
+                return len(tokenizer.encode(unit, add_special_tokens=False).ids)
+            return count
+        except Exception as e:
+            print(f"Tokenizer {path} unavailable ({e}); estimating token counts")
+    return estimate_unit_tokens
+
+
+def get_chunk_config() -> tuple[int, int]:
+    """(max tokens per chunk, overlap tokens) from .env."""
+    return int(os.getenv("EMBED_CHUNK_TOKENS", "1024")), int(os.getenv("EMBED_CHUNK_OVERLAP_TOKENS", "64"))
+
+
+def count_tokens(text: str, count_unit: Callable[[str], int] = None) -> int:
+    count_unit = count_unit or get_token_counter()
+    return sum(count_unit(m.group(2)) for m in _UNIT.finditer(text))
+
+
+def _split_unit(text: str, start: int, end: int, tokens: int, max_tokens: int,
+                count_unit: Callable[[str], int]) -> list[tuple[int, int, int]]:
+    """Cut a unit larger than max_tokens (a very long word or Hangul run) into slices that fit."""
+    step = max(1, (end - start) * max_tokens // tokens)
+    return [(i, min(i + step, end), count_unit(text[i:min(i + step, end)])) for i in range(start, end, step)]
+
+
+def chunk_text(text: str, max_tokens: int = None, overlap_tokens: int = None,
+               count_unit: Optional[Callable[[str], int]] = None) -> list[str]:
+    """Split text into chunks of at most max_tokens tokens, overlapping by about overlap_tokens."""
+    if not text or not text.strip():
+        return []
+    default_max, default_overlap = get_chunk_config()
+    max_tokens = max(1, max_tokens or default_max)
+    overlap_tokens = default_overlap if overlap_tokens is None else overlap_tokens
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    count_unit = count_unit or get_token_counter()
+    counts: dict[str, int] = {}
+
+    chunks = []
+    # Units of the current chunk as (start, end, tokens); spans index into text
+    units: list[tuple[int, int, int]] = []
+    total = 0
+    last_break = 0           # units before the last sentence or line start in the chunk
+
+    def emit(upto: int):
+        if upto <= 0:
+            return
+        chunk = text[units[0][0]:units[upto - 1][1]].strip()
+        if chunk:
+            chunks.append(chunk)
+
+    for match in _UNIT.finditer(text):
+        start, end = match.span()
+        core = match.group(2)
+        tokens = counts.get(core)
+        if tokens is None:
+            tokens = counts[core] = count_unit(core)
+        if 0 < start < match.start(2) and ("\n" in match.group(1) or text[start - 1] in _SENTENCE_END):
+            last_break = len(units)
+        pieces = [(start, end, tokens)] if tokens <= max_tokens else \
+            _split_unit(text, match.start(2), end, tokens, max_tokens, count_unit)
+
+        for start, end, tokens in pieces:
+            if total + tokens > max_tokens and total > 0:
+                # Break at the last sentence start if it keeps at least half the chunk, else here
+                # (a break at 0 would leave the current chunk empty and emit it twice)
+                cut = last_break if 0 < last_break and last_break >= len(units) // 2 else len(units)
+                emit(cut)
+                rest = units[cut:]
+                rest_tokens = sum(t for _, _, t in rest)
+                if rest_tokens + tokens > max_tokens:
+                    # The text after the cut does not fit with this unit either: it becomes its own chunk
+                    units = rest
+                    emit(len(units))
+                    units, total = [], 0
+                else:
+                    # The next chunk starts with the tail of this one (overlap) plus the units after the cut
+                    keep, carried = cut, 0
+                    while keep > 0 and carried + units[keep - 1][2] <= overlap_tokens \
+                            and carried + units[keep - 1][2] + rest_tokens + tokens <= max_tokens:
+                        keep -= 1
+                        carried += units[keep][2]
+                    units = units[keep:]
+                    total = carried + rest_tokens
+                last_break = 0
+            units.append((start, end, tokens))
+            total += tokens
+
+    if total > 0:
+        emit(len(units))
+    return chunks
@@ -0,0 +1,201 @@
+"""
+Vector index manager: keeps the embedding_chunks index sized for the library.
+
+schema.sql builds the vector index with ivfflat lists = 100, usually on an
+empty table. ivfflat clusters the rows it sees at build time, so as the
+library grows its lists get too few and too long, and its centroids no
+longer fit the data; recall and latency get worse without any error.
+
+    python vector_index.py                      # show the index and whether a rebuild is due
+    python vector_index.py --rebuild            # rebuild if due
+    python vector_index.py --rebuild --force
+    python vector_index.py --rebuild --method hnsw --m 16 --ef-construction 64
+
+ivfflat is rebuilt with lists scaled to the row count (rows / 1000 up to a
+million rows, sqrt(rows) above), and its ivfflat.probes (sqrt(lists)) is
+recorded for search. HNSW has no lists to retune; it is rebuilt only when
+m / ef_construction change. Rebuilds run with CREATE INDEX CONCURRENTLY next
+to the old index, which is swapped out once the new one is valid, so search
+keeps working throughout. The active configuration is recorded in the
+search_settings table.
+
+Needs a database user that owns embedding_chunks (the one schema.sql runs as).
+"""
+import argparse
+import json
+import math
+import os
+import time
+from typing import Optional
+
+import db
+from ocr_processor import VECTOR_INDEX_MODES
+
+INDEX_METHODS = ("ivfflat", "hnsw")
+MIN_RETUNE_ROWS = 10_000
+
+# Index name and indexed expression per vector index mode; must match schema.sql
+INDEX_COLUMNS = {
+    "full": ("idx_embedding_vector", "embedding vector_cosine_ops"),
+    "halfvec": ("idx_embedding_halfvec", "(embedding::halfvec(1024)) halfvec_cosine_ops"),
+    "binary": ("idx_embedding_binary", "(binary_quantize(embedding)::bit(1024)) bit_hamming_ops"),
+}
+
+
+def target_lists(rows: int) -> int:
+    """pgvector's guidance for ivfflat lists: rows / 1000 up to 1M rows, sqrt(rows) above."""
+    if rows <= 1_000_000:
+        return max(10, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def target_probes(lists: int) -> int:
+    return max(1, round(math.sqrt(lists)))
+
+
+def get_settings(cursor) -> dict[str, str]:
+    cursor.execute("SELECT key, value FROM search_settings")
+    return dict(cursor.fetchall())
+
+
+def record_setting(cursor, key: str, value: str):
+    cursor.execute("""
+        INSERT INTO search_settings (key, value) VALUES (%s, %s)
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+    """, (key, value))
+
+
+def get_index(cursor, name: str) -> Optional[dict]:
+    """Method, options, size and validity of an index, or None if it does not exist."""
+    cursor.execute("""
+        SELECT am.amname, COALESCE(c.reloptions, '{}'), pg_relation_size(c.oid), i.indisvalid
+        FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE c.oid = to_regclass(%s)
+    """, (name,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    options = dict(option.split("=", 1) for option in row[1])
+    return {"method": row[0], "options": {k: int(v) for k, v in options.items() if v.isdigit()},
+            "size": row[2], "valid": row[3]}
+
+
+def plan(rows: int, index: Optional[dict], built: dict, method: str, m: int, ef_construction: int) -> tuple[dict, str]:
+    """(index options to build, reason) — reason is empty when the current index is fine."""
+    if method == "ivfflat":
+        options = {"lists": target_lists(rows)}
+    else:
+        options = {"m": m, "ef_construction": ef_construction}
+    if index is None:
+        return options, "no vector index"
+    if not index["valid"]:
+        return options, "index is invalid (an earlier build failed)"
+    if index["method"] != method:
+        return options, f"switching from {index['method']} to {method}"
+    if method == "hnsw":
+        current = {"m": index["options"].get("m", 16), "ef_construction": index["options"].get("ef_construction", 64)}
+        if current != options:
+            return options, f"HNSW options {current} -> {options}"
+        return options, ""
+    if rows < MIN_RETUNE_ROWS:
+        # A few thousand vectors are searched quickly whatever the clustering
+        return options, ""
+    lists = index["options"].get("lists", 100)
+    if not options["lists"] / 2 <= lists <= options["lists"] * 2:
+        return options, f"{lists} lists for {rows} rows (target {options['lists']})"
+    if "rows" not in built:
+        return options, "built by schema.sql, probably on a much smaller table"
+    if rows > int(built["rows"]) * 2:
+        # Centroids were trained on less than half of today's rows
+        return options, f"built on {built['rows']} rows, now {rows}"
+    return options, ""
+
+
+def rebuild(conn, mode: str, method: str, options: dict, rows: int):
+    """Build the new index concurrently beside the old one, then swap it in."""
+    name, column = INDEX_COLUMNS[mode]
+    new_name = name + "_new"
+    with_clause = ", ".join(f"{key} = {value}" for key, value in options.items())
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET maintenance_work_mem = %s", (os.getenv("VECTOR_INDEX_MAINTENANCE_WORK_MEM", "1GB"),))
+        # Left over (invalid) if an earlier concurrent build was interrupted
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}")
+        print(f"Building {method} index ({with_clause}) on {rows} rows, search keeps using the old index...")
+        start = time.time()
+        cursor.execute(f"CREATE INDEX CONCURRENTLY {new_name} ON embedding_chunks "
+                       f"USING {method} ({column}) WITH ({with_clause})")
+        print(f"Built in {time.time() - start:.1f}s")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(f"ALTER INDEX {new_name} RENAME TO {name}")
+
+        built = {"method": method, **options, "rows": rows, "built_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+        record_setting(cursor, "vector_index", json.dumps(built))
+        if method == "ivfflat":
+            record_setting(cursor, "ivfflat_probes", str(target_probes(options["lists"])))
+        cursor.execute("ANALYZE embedding_chunks")
+    finally:
+        cursor.execute("RESET maintenance_work_mem")
+        cursor.close()
+        conn.autocommit = False
+
+
+def check_index(rebuild_due: bool = False, force: bool = False, method: str = None,
+                m: int = None, ef_construction: int = None) -> bool:
+    """Print the vector index status; rebuild it when due (or forced) if asked. Returns True if rebuilt."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM embedding_chunks")
+        rows = cursor.fetchone()[0]
+        settings = get_settings(cursor)
+        mode = settings.get("vector_index_mode", "full")
+        if mode not in VECTOR_INDEX_MODES:
+            mode = "full"
+        name = INDEX_COLUMNS[mode][0]
+        index = get_index(cursor, name)
+        built = json.loads(settings.get("vector_index", "{}"))
+        cursor.close()
+        conn.rollback()
+
+        method = (method or os.getenv("VECTOR_INDEX_METHOD") or (index or {}).get("method") or "ivfflat").lower()
+        if method not in INDEX_METHODS:
+            raise ValueError(f"VECTOR_INDEX_METHOD must be one of {', '.join(INDEX_METHODS)}, not {method!r}")
+        m = m or int(os.getenv("VECTOR_HNSW_M", "16"))
+        ef_construction = ef_construction or int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "64"))
+        options, reason = plan(rows, index, built, method, m, ef_construction)
+
+        if index:
+            print(f"{name} ({mode} mode): {index['method']} {index['options']}, "
+                  f"{index['size'] / 1024 / 1024:.1f} MB, {rows} rows"
+                  + (f", built {built['built_at']} on {built['rows']} rows" if "built_at" in built else ""))
+        else:
+            print(f"{name} ({mode} mode): missing, {rows} rows")
+        if not reason and not force:
+            print("Index is sized for the current library")
+            return False
+        print((f"Rebuild due: {reason}" if reason else "Rebuild forced") + f" -> {method} {options}")
+        if not rebuild_due:
+            print("Run `python vector_index.py --rebuild` to rebuild it")
+            return False
+        rebuild(conn, mode, method, options, rows)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index if it is due")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the current index is fine")
+    parser.add_argument("--method", choices=INDEX_METHODS, help="default: VECTOR_INDEX_METHOD, else the current one")
+    parser.add_argument("--m", type=int, help="HNSW links per node (default VECTOR_HNSW_M, 16)")
+    parser.add_argument("--ef-construction", type=int,
+                        help="HNSW build candidate list (default VECTOR_HNSW_EF_CONSTRUCTION, 64)")
+    args = parser.parse_args()
+    check_index(rebuild_due=args.rebuild, force=args.force, method=args.method,
+                m=args.m, ef_construction=args.ef_construction)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Persistent cache of vision model descriptions.
+
+Entries are keyed by (content hash, model name, prompt version), so a
+description is only regenerated when the image bytes, LOCAL_LLM_MODEL or the
+prompt actually change. The cache lives in a local SQLite file outside
+PostgreSQL, which means re-ingesting after a database rebuild is almost free.
+Least recently used entries are evicted once the cache exceeds
+VISION_CACHE_MAX_MB.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "vision_cache.sqlite3")
+
+
+class DescriptionCache:
+    """SQLite-backed description cache with size-based LRU eviction."""
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        self.path = path or os.getenv("VISION_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes or int(float(os.getenv("VISION_CACHE_MAX_MB", "64")) * 1024 * 1024)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS descriptions (
+                    content_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (content_hash, model, prompt_version)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_descriptions_last_used ON descriptions(last_used)")
+            self._conn.commit()
+
+    def get(self, content_hash: str, model: str, prompt_version: str) -> Optional[str]:
+        key = (content_hash, model, prompt_version)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT description FROM descriptions WHERE content_hash = ? AND model = ? AND prompt_version = ?",
+                key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE descriptions SET last_used = ? WHERE content_hash = ? AND model = ? AND prompt_version = ?",
+                (time.time(), *key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, content_hash: str, model: str, prompt_version: str, description: str):
+        if not description:
+            return
+        size = len(description.encode("utf-8")) + len(content_hash) + len(model) + len(prompt_version)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, model, prompt_version, description, size, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM descriptions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are 10% under the limit
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for rowid, size in self._conn.execute("SELECT rowid, size FROM descriptions ORDER BY last_used"):
+            doomed.append((rowid,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM descriptions WHERE rowid = ?", doomed)
+
+    def stats(self) -> str:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM descriptions").fetchone()
+        return (f"Vision cache: {count} entries, {total / 1024 / 1024:.1f} MB, "
+                f"{self.hits} hits, {self.misses} misses")
+
+
+_cache: Optional[DescriptionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_description_cache() -> Optional[DescriptionCache]:
+    """Process-wide cache, or None when VISION_CACHE=0."""
+    global _cache
+    if os.getenv("VISION_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = DescriptionCache()
+            except Exception as e:
+                print(f"Vision cache unavailable: {e}")
+                return None
+        return _cache
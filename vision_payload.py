@@ -0,0 +1,172 @@
+"""
+Vision model payload preparation.
+
+Turns a decoded screenshot into the bytes sent to the vision model:
+downscale to VISION_MAX_SIZE, then encode with VISION_PAYLOAD_FORMAT
+(jpeg/webp at VISION_PAYLOAD_QUALITY, or png). Files that are already small
+enough are passed through untouched. Prepared payloads are kept in a disk
+cache keyed by content hash, so regenerating or re-ingesting an image does
+not pay for the resize and encode again.
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+VISION_MAX_SIZE = 1620
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "vision_payloads")
+
+_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+_JPEG_MAGIC = b"\xff\xd8\xff"
+
+
+def get_payload_config() -> dict:
+    """Payload settings from .env."""
+    fmt = os.getenv("VISION_PAYLOAD_FORMAT", "jpeg").strip().lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    return {
+        "format": fmt if fmt in _EXTENSIONS else "jpeg",
+        "quality": int(os.getenv("VISION_PAYLOAD_QUALITY", "90")),
+        "max_size": int(os.getenv("VISION_MAX_SIZE", str(VISION_MAX_SIZE))),
+        "passthrough_bytes": int(float(os.getenv("VISION_PASSTHROUGH_MAX_KB", "512")) * 1024),
+        "cache": os.getenv("VISION_PAYLOAD_CACHE", "1") != "0",
+        "cache_dir": os.getenv("VISION_PAYLOAD_CACHE_DIR", DEFAULT_CACHE_DIR),
+        "cache_max_bytes": int(float(os.getenv("VISION_PAYLOAD_CACHE_MAX_MB", "512")) * 1024 * 1024),
+    }
+
+
+def is_passthrough_candidate(raw_bytes: Optional[bytes], config: dict = None) -> bool:
+    """True when the original file bytes are small PNG/JPEG data the model can take as-is."""
+    config = config or get_payload_config()
+    return bool(raw_bytes) and len(raw_bytes) <= config["passthrough_bytes"] and \
+        (raw_bytes.startswith(_PNG_MAGIC) or raw_bytes.startswith(_JPEG_MAGIC))
+
+
+def encode_image(img, fmt: str, quality: int, max_size: int) -> bytes:
+    """Downscale a BGR array so its long side fits max_size and encode it."""
+    import cv2
+    height, width = img.shape[:2]
+    if max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        # INTER_AREA is the right filter for shrinking and much cheaper than LANCZOS
+        img = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        # Low compression level: the payload is sent over localhost, encode time matters more
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+    ok, buf = cv2.imencode(_EXTENSIONS[fmt], img, params)
+    if not ok:
+        raise ValueError(f"{fmt} encoding failed")
+    return buf.tobytes()
+
+
+class PayloadCache:
+    """Prepared payloads on disk, one file per (content hash, encoder settings)."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+
+    def _path(self, content_hash: str, variant: str) -> str:
+        return os.path.join(self.directory, content_hash[:2], f"{content_hash}_{variant}")
+
+    def get(self, content_hash: str, variant: str) -> Optional[bytes]:
+        path = self._path(content_hash, variant)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used for eviction
+            return data
+        except OSError:
+            return None
+
+    def put(self, content_hash: str, variant: str, payload: bytes):
+        path = self._path(content_hash, variant)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"    Payload cache write failed: {e}")
+            return
+        with self._lock:
+            self._writes_since_trim += 1
+            trim = self._writes_since_trim >= 50
+            if trim:
+                self._writes_since_trim = 0
+        if trim:
+            self.trim()
+
+    def trim(self):
+        """Delete least recently used payloads until the cache fits max_bytes."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_cache: Optional[PayloadCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_payload_cache(config: dict = None) -> Optional[PayloadCache]:
+    config = config or get_payload_config()
+    if not config["cache"]:
+        return None
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PayloadCache(config["cache_dir"], config["cache_max_bytes"])
+        return _cache
+
+
+def prepare_payload(img, raw_bytes: bytes = None, content_hash: str = None) -> bytes:
+    """
+    Bytes to send to the vision model for a decoded image.
+    raw_bytes (the original file) is passed through when it is small and fits
+    VISION_MAX_SIZE; otherwise the image is resized and encoded, and the result
+    cached on disk under content_hash.
+    """
+    config = get_payload_config()
+    start_time = time.time()
+    height, width = img.shape[:2]
+    if max(height, width) <= config["max_size"] and is_passthrough_candidate(raw_bytes, config):
+        return raw_bytes
+
+    variant = f"{config['format']}{config['quality']}_{config['max_size']}{_EXTENSIONS[config['format']]}"
+    cache = get_payload_cache(config) if content_hash else None
+    if cache is not None:
+        payload = cache.get(content_hash, variant)
+        if payload:
+            return payload
+
+    payload = encode_image(img, config["format"], config["quality"], config["max_size"])
+    if cache is not None:
+        cache.put(content_hash, variant, payload)
+    print(f"    Vision payload: {config['format']} {len(payload) / 1024:.0f} KB "
+          f"in {time.time() - start_time:.2f}s")
+    return payload
@@ -0,0 +1,101 @@
+"""
+Bounded, concurrent requests to the vision model.
+
+Ollama can serve several chat requests at once (OLLAMA_NUM_PARALLEL), so
+one blocking call per image leaves most of its throughput unused.
+VisionScheduler keeps up to VISION_MAX_IN_FLIGHT requests running, applies a
+per-request timeout and retries failed requests with backoff, while the
+caller (the ingest pipeline) keeps OCR'ing the next screenshots.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import ollama
+
+
+def get_scheduler_config() -> dict:
+    """Scheduler settings from .env."""
+    return {
+        "max_in_flight": int(os.getenv("VISION_MAX_IN_FLIGHT", "2")),
+        "timeout": float(os.getenv("VISION_TIMEOUT", "180")),
+        "retries": int(os.getenv("VISION_RETRIES", "2")),
+        "backoff": float(os.getenv("VISION_RETRY_BACKOFF", "2")),
+    }
+
+
+class VisionScheduler:
+    """
+    Limits concurrent vision requests and retries failures.
+
+    describe(image_data) blocks the calling thread until its request is done;
+    submit(image_data) returns a Future so a single thread can keep several
+    requests in flight. Both share the same in-flight limit.
+    """
+
+    def __init__(self, max_in_flight: int = None, timeout: float = None, retries: int = None,
+                 backoff: float = None, host: str = None):
+        config = get_scheduler_config()
+        self.max_in_flight = max(1, max_in_flight or config["max_in_flight"])
+        self.timeout = timeout or config["timeout"]
+        self.retries = config["retries"] if retries is None else retries
+        self.backoff = config["backoff"] if backoff is None else backoff
+        self.host = host or os.getenv("LOCAL_LLM_API_URL")
+        # One client per scheduler; httpx clients are safe to share between threads
+        self.client = ollama.Client(host=self.host, timeout=self.timeout)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def describe(self, image_data: bytes) -> str:
+        """Describe one prepared image; raises after the last failed attempt."""
+        from ocr_processor import request_description
+        with self._slots:
+            with self._lock:
+                self.in_flight += 1
+            try:
+                attempt = 0
+                while True:
+                    try:
+                        description = request_description(image_data, client=self.client, stream=False)
+                        with self._lock:
+                            self.completed += 1
+                        return description
+                    except Exception as e:
+                        if attempt >= self.retries:
+                            with self._lock:
+                                self.failed += 1
+                            raise
+                        attempt += 1
+                        with self._lock:
+                            self.retried += 1
+                        delay = self.backoff * attempt
+                        print(f"    Vision request failed ({e}); retry {attempt}/{self.retries} in {delay:.1f}s")
+                        time.sleep(delay)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+    def submit(self, image_data: bytes) -> Future:
+        """Queue a request without blocking; the future resolves to the description."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                                    thread_name_prefix="vision")
+        return self._executor.submit(self.describe, image_data)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> str:
+        return (f"Vision requests: {self.completed} ok, {self.failed} failed, "
+                f"{self.retried} retries (max {self.max_in_flight} in flight)")